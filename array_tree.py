@@ -0,0 +1,100 @@
+import numpy
+from topology           import Topology
+from loss_distribution  import LossLinks
+from delay_distribution import DelayLinks
+
+BATCH_ENTRIES = 1 << 23 # (probe, node) entries per probe batch, which bounds the working memory of the batch methods
+
+# A tree whose per-node state lives in contiguous arrays indexed by topology index (preorder, see topology.py)
+# instead of one Tree object (with its own distribution object) per node, so that trees of millions of nodes
+# can be built, probed and estimated without recursion or per-node Python objects.
+# Nodes are numbered like Tree numbers them: ids[k] is node k's rank in postorder, starting from 1.
+# Loss and delay estimates for an ArrayTree are computed by the array functions of LossTomographyMle and
+# DelayTomographyMle, which return per-node arrays in topology order.
+#
+# Memory budget per node, with 8 byte indices and floats:
+#  - shape (Topology): about 90 bytes (parent, CSR child index, levels, depths, subtree sizes, leaf ranges)
+#  - ids: 8 bytes
+#  - loss experiments: 26 bytes of link parameters and Gilbert-Elliot state (see LossLinks) and 8 bytes of true_loss;
+#    the streaming loss estimator adds 8 bytes of counters and 24 bytes for gamma, A and alpha
+#  - delay experiments: 17 bytes of link parameters (see DelayLinks); the delay estimator adds 32 (i_max + 1) bytes
+#    for gamma, A, beta and alpha, and keeps 8 bytes per probe per receiver of end-to-end delays
+#  - probe batches: about 10 (loss) or 16 (delay) bytes per node per probe in the batch, and probes_per_batch keeps
+#    batches within BATCH_ENTRIES (probe, node) entries, i.e., 80-130 MB whatever the size of the tree
+# so a loss simulation on a depth 20 binary tree (about a million nodes) fits in roughly 300 MB.
+class ArrayTree(object):
+  # mean_delay_or_loss and dist_type are either one value for every link or one value per node (for its incoming link)
+  # in topology order. All randomness comes from the numpy.random.Generator rng (a fresh, unseeded one if None).
+  # names optionally gives every node a name in topology order (e.g., its name in a topology file).
+  def __init__(self, topology, expt_type, mean_delay_or_loss, dist_type, rng = None, names = None):
+    assert(expt_type in ["delay", "loss"])
+    if (rng == None):
+      rng = numpy.random.default_rng()
+    self._topology = topology
+    self.rng = rng
+    self.expt_type = expt_type
+    self.ids = topology.postorder_rank() + 1
+    self.names = names
+    num_nodes = topology.num_nodes
+    per_node = lambda values: numpy.broadcast_to(numpy.asarray(values), (num_nodes,))
+    if (expt_type == "loss"):
+      # Packets incoming on the root node are always delivered, so only the other nodes get a lossy link
+      self.loss_links = LossLinks.create(num_nodes - 1, per_node(mean_delay_or_loss)[1:], per_node(dist_type)[1:], rng)
+      self.true_loss = numpy.zeros(num_nodes)
+      self.num_packets_incoming = 0 # every link sees every independent probe
+    else:
+      # Every node, the root included, delays probes on its incoming link
+      # (like a Tree below DelayTomographyMle's fake root)
+      self.delay_links = DelayLinks(per_node(mean_delay_or_loss), per_node(dist_type), num_nodes)
+
+  # the complete tree of depth depth in which every internal node has fanout children, like Tree(...)
+  @staticmethod
+  def complete(depth, expt_type, mean_delay_or_loss, dist_type, rng = None, fanout = 2):
+    assert(fanout >= 2)
+    return ArrayTree(Topology.complete(depth, fanout), expt_type, mean_delay_or_loss, dist_type, rng)
+
+  # the tree of a LinkTable (see topology_file.py) with its links' parameters for expt_type,
+  # using mean_delay_or_loss and dist_type for the links that the table leaves unset
+  @staticmethod
+  def from_links(links, expt_type, mean_delay_or_loss = None, dist_type = None, rng = None):
+    (values, types) = links.parameters(expt_type, mean_delay_or_loss, dist_type)
+    return ArrayTree(links.topology, expt_type, values, types, rng, links.names)
+
+  def topology(self):
+    return self._topology
+
+  def __str__(self):
+    topology = self._topology
+    return "ArrayTree(" + str(topology.num_nodes) + " nodes, " + str(topology.num_receivers) + " receivers, depth " + \
+           str(len(topology.levels)) + ")"
+
+  # number of probes per batch that keeps a batch within BATCH_ENTRIES (probe, node) entries
+  def probes_per_batch(self):
+    return max(1, BATCH_ENTRIES // self._topology.num_nodes)
+
+  # Like Tree.send_multicast_probe_batch: returns a (num_probes x num_receivers) boolean matrix
+  # whose columns follow topology().leaf_order.
+  def send_multicast_probe_batch(self, num_probes):
+    topology = self._topology
+    delivered = numpy.ones((num_probes, topology.num_nodes), dtype = bool)
+    delivered[:, 1:] = self.loss_links.deliver_probes(num_probes, self.rng)
+    topology.accumulate_down(delivered, numpy.logical_and)
+    return delivered[:, topology.leaf_order]
+
+  # Like Tree.send_independent_probe_batch: folds num_probes independent probes on every link into true_loss
+  def send_independent_probe_batch(self, num_probes):
+    losses = num_probes - numpy.count_nonzero(self.loss_links.deliver_probes(num_probes, self.rng), axis = 0)
+    self.num_packets_incoming += num_probes
+    self.true_loss[1:] += (losses - num_probes * self.true_loss[1:]) / self.num_packets_incoming
+
+  # Change the loss probability of every link (one value, or one per node in topology order)
+  def set_loss_prob(self, loss_prob):
+    self.loss_links.set_loss_probs(numpy.broadcast_to(numpy.asarray(loss_prob), (self._topology.num_nodes,))[1:])
+
+  # Like Tree.send_multicast_probe_with_delay_batch: returns a (num_probes x num_receivers) matrix of
+  # end-to-end delays whose columns follow topology().leaf_order.
+  def send_multicast_probe_with_delay_batch(self, num_probes):
+    topology = self._topology
+    delays = self.delay_links.delay_samples(num_probes, self.rng)
+    topology.accumulate_down(delays, numpy.add)
+    return delays[:, topology.leaf_order]
@@ -0,0 +1,251 @@
+#! /usr/local/bin/python3
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import traceback
+import tracemalloc
+import numpy
+from tree import Tree
+from loss_mle import LossTomographyMle
+from delay_mle import DelayTomographyMle
+from loss_distribution import LOSS_TYPES
+from sweep import expand_grid
+
+# Benchmarks of tree construction, probe generation and the estimators over grids of depths, probe counts and distributions.
+# Every benchmark is timed (best and mean of --repeats runs, setup excluded), then run once more under tracemalloc
+# for its peak memory (which numpy arrays count towards). Throughput is reported as
+#   probes/s: probes handled per second
+#   nodes/s: nodes handled per second, i.e., nodes x probes for probe generation and estimators that look at every probe
+# Results can be saved as JSON (--output) and compared against a saved run (--baseline):
+#   python3 benchmark.py --output baseline.json
+#   ... change the code ...
+#   python3 benchmark.py --baseline baseline.json
+# which flags every benchmark that got slower (or used more memory) by more than --tolerance and exits with status 1 if any did.
+
+LOSS_PROB = 0.05
+MEAN_DELAY = 1 # the delay estimator needs some probes to see no delay on any link, so deep delay trees need short delays
+DELAY_EPSILON = 10 # loose, so that sampling noise doesn't fail the sanity check (whose cost is the same either way)
+MAX_ENTRIES = 1 << 25 # grid points with more (probe, node) entries are skipped, so no probe matrix gets over ~270 MB
+
+def expt_type_of(dist_type):
+  return "loss" if (dist_type in LOSS_TYPES) else "delay"
+
+def new_tree(depth, dist_type):
+  expt_type = expt_type_of(dist_type)
+  return Tree(depth, expt_type, LOSS_PROB if (expt_type == "loss") else MEAN_DELAY, dist_type, numpy.random.default_rng(0))
+
+# Every benchmark sets up its inputs and returns (run, probes, nodes), where run does the timed work
+# and probes and nodes are how many of each one call of run handles (None where that doesn't apply).
+
+def tree_construction(depth, dist_type):
+  tree = new_tree(depth, dist_type)
+  return (lambda: new_tree(depth, dist_type), None, len(tree.nodes()))
+
+def send_multicast_probe(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  def run():
+    for p in range(0, num_probes):
+      tree.send_multicast_probe()
+  return (run, num_probes, num_probes * len(tree.nodes()))
+
+def send_multicast_probe_batch(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  return (lambda: tree.send_multicast_probe_batch(num_probes), num_probes, num_probes * len(tree.nodes()))
+
+def send_independent_probes(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  def run():
+    for p in range(0, num_probes):
+      tree.send_independent_probes()
+  return (run, num_probes, num_probes * len(tree.nodes()))
+
+def send_independent_probe_batch(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  return (lambda: tree.send_independent_probe_batch(num_probes), num_probes, num_probes * len(tree.nodes()))
+
+def send_multicast_probe_with_delay(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  def run():
+    for p in range(0, num_probes):
+      tree.send_multicast_probe_with_delay()
+  return (run, num_probes, num_probes * len(tree.nodes()))
+
+def send_multicast_probe_with_delay_batch(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  return (lambda: tree.send_multicast_probe_with_delay_batch(num_probes), num_probes, num_probes * len(tree.nodes()))
+
+# a loss tree with the estimator set up and num_probes multicast probes recorded at the receivers
+def loss_tree_with_probes(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  LossTomographyMle.create_estimator(tree)
+  LossTomographyMle.update_Y_batch(tree, tree.send_multicast_probe_batch(num_probes))
+  return tree
+
+def loss_compute_gamma(depth, dist_type, num_probes):
+  tree = loss_tree_with_probes(depth, dist_type, num_probes)
+  return (lambda: LossTomographyMle.compute_gamma(tree), num_probes, num_probes * len(tree.nodes()))
+
+def loss_update_counts(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  outcomes = tree.send_multicast_probe_batch(num_probes)
+  LossTomographyMle.create_streaming_estimator(tree)
+  return (lambda: LossTomographyMle.update_counts(tree, outcomes), num_probes, num_probes * len(tree.nodes()))
+
+def loss_compute_mle(depth, dist_type, num_probes):
+  tree = loss_tree_with_probes(depth, dist_type, num_probes)
+  LossTomographyMle.compute_gamma(tree)
+  return (lambda: LossTomographyMle.compute_mle(tree, 1.0), None, len(tree.nodes()))
+
+def delay_main(depth, dist_type, num_probes):
+  # set up like delay_tomography.run_delay_experiment
+  tree = new_tree(depth, dist_type)
+  DelayTomographyMle.create_Y_and_root(tree, num_probes)
+  outcomes = tree.send_multicast_probe_with_delay_batch(num_probes)
+  for (receiver, column) in zip(tree.receivers(), outcomes.T):
+    receiver.Y[:] = column
+  i_max = int(numpy.ceil(numpy.max(outcomes)))
+  def run():
+    DelayTomographyMle.create_estimator(tree, i_max, num_probes)
+    DelayTomographyMle.main(tree, 1, i_max, num_probes, DELAY_EPSILON)
+  return (run, num_probes, num_probes * len(tree.nodes()))
+
+def delay_update_histogram(depth, dist_type, num_probes):
+  tree = new_tree(depth, dist_type)
+  DelayTomographyMle.create_root(tree)
+  DelayTomographyMle.create_streaming_estimator(tree, 1)
+  outcomes = tree.send_multicast_probe_with_delay_batch(num_probes)
+  return (lambda: DelayTomographyMle.update_histogram(tree, outcomes), num_probes, num_probes * len(tree.nodes()))
+
+# benchmark name -> (function, grid of its parameters, smaller grid for --quick)
+BENCHMARKS = {
+  "tree_construction" : (tree_construction, {"depth" : [10, 14], "dist_type" : ["bernoulli", "geometric"]},
+                                            {"depth" : [8], "dist_type" : ["bernoulli", "geometric"]}),
+  "send_multicast_probe" : (send_multicast_probe, {"depth" : [6, 10], "dist_type" : LOSS_TYPES, "num_probes" : [1000]},
+                                                  {"depth" : [6], "dist_type" : ["bernoulli"], "num_probes" : [200]}),
+  "send_multicast_probe_batch" : (send_multicast_probe_batch,
+                                  {"depth" : [6, 10, 14], "dist_type" : LOSS_TYPES, "num_probes" : [1000, 10000, 100000]},
+                                  {"depth" : [6], "dist_type" : LOSS_TYPES, "num_probes" : [10000]}),
+  "send_independent_probes" : (send_independent_probes, {"depth" : [6, 10], "dist_type" : LOSS_TYPES, "num_probes" : [1000]},
+                                                        {"depth" : [6], "dist_type" : ["bernoulli"], "num_probes" : [200]}),
+  "send_independent_probe_batch" : (send_independent_probe_batch,
+                                    {"depth" : [6, 10, 14], "dist_type" : LOSS_TYPES, "num_probes" : [1000, 10000, 100000]},
+                                    {"depth" : [6], "dist_type" : LOSS_TYPES, "num_probes" : [10000]}),
+  "send_multicast_probe_with_delay" : (send_multicast_probe_with_delay,
+                                       {"depth" : [6, 10], "dist_type" : ["geometric", "pareto", "uniform"], "num_probes" : [1000]},
+                                       {"depth" : [6], "dist_type" : ["geometric"], "num_probes" : [200]}),
+  "send_multicast_probe_with_delay_batch" : (send_multicast_probe_with_delay_batch,
+                                             {"depth" : [6, 10, 14], "dist_type" : ["geometric", "pareto", "uniform"],
+                                              "num_probes" : [1000, 10000, 100000]},
+                                             {"depth" : [6], "dist_type" : ["geometric"], "num_probes" : [10000]}),
+  "loss_compute_gamma" : (loss_compute_gamma, {"depth" : [6, 10, 14], "dist_type" : ["bernoulli"], "num_probes" : [1000, 10000, 100000]},
+                                              {"depth" : [6], "dist_type" : ["bernoulli"], "num_probes" : [10000]}),
+  "loss_update_counts" : (loss_update_counts, {"depth" : [6, 10, 14], "dist_type" : ["bernoulli"], "num_probes" : [1000, 10000, 100000]},
+                                              {"depth" : [6], "dist_type" : ["bernoulli"], "num_probes" : [10000]}),
+  "loss_compute_mle" : (loss_compute_mle, {"depth" : [6, 10, 14], "dist_type" : ["bernoulli"], "num_probes" : [1000, 10000]},
+                                          {"depth" : [6], "dist_type" : ["bernoulli"], "num_probes" : [10000]}),
+  "delay_update_histogram" : (delay_update_histogram,
+                              {"depth" : [4, 10, 14], "dist_type" : ["geometric", "pareto"], "num_probes" : [1000, 10000, 100000]},
+                              {"depth" : [4], "dist_type" : ["geometric"], "num_probes" : [10000]}),
+  "delay_main" : (delay_main, {"depth" : [2, 3, 4], "dist_type" : ["geometric", "uniform"], "num_probes" : [10000, 100000]},
+                              {"depth" : [3], "dist_type" : ["geometric"], "num_probes" : [10000]}),
+}
+
+# the parameters of every run of a benchmark (within MAX_ENTRIES)
+def benchmark_grid(name, quick):
+  params = expand_grid(BENCHMARKS[name][2 if quick else 1])
+  return [p for p in params if (p.get("num_probes", 1) * (2 ** p["depth"] - 1) <= MAX_ENTRIES)]
+
+# identifies a benchmark run across result files
+def result_key(result):
+  return result["name"] + " " + json.dumps(result["params"], sort_keys = True)
+
+# Set up and run one benchmark; returns its result record.
+# A benchmark that fails (e.g., a sanity check of the delay estimator) gets an "error" instead of measurements.
+# Whatever the benchmarked code prints is discarded.
+def run_benchmark(name, params, repeats):
+  result = {"name" : name, "params" : params}
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      (seconds, peak, probes, nodes) = measure(name, params, repeats)
+  except Exception:
+    result["error"] = traceback.format_exc().strip().split("\n")[-1]
+    return result
+  result["seconds"] = min(seconds)
+  result["mean_seconds"] = sum(seconds) / len(seconds)
+  result["probes_per_s"] = (probes / min(seconds)) if (probes != None) else None
+  result["nodes_per_s"] = (nodes / min(seconds)) if (nodes != None) else None
+  result["peak_mb"] = peak / 2**20
+  return result
+
+# the run times (in seconds) and peak traced memory (in bytes) of a benchmark, and the probes and nodes one run handles
+def measure(name, params, repeats):
+  (run, probes, nodes) = BENCHMARKS[name][0](**params)
+  seconds = []
+  for r in range(0, repeats):
+    start = time.perf_counter()
+    run()
+    seconds += [time.perf_counter() - start]
+  tracemalloc.start()
+  try:
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return (seconds, peak, probes, nodes)
+
+def format_result(result):
+  description = result["name"] + " " + " ".join([key + "=" + str(value) for (key, value) in result["params"].items()])
+  if ("error" in result):
+    return description + ": failed: " + result["error"]
+  rates = [("%.4g " % result[field]) + unit for (field, unit) in [("probes_per_s", "probes/s"), ("nodes_per_s", "nodes/s")] \
+           if (result[field] != None)]
+  return description + ": " + ("%.4f s, " % result["seconds"]) + ", ".join(rates) + (", %.1f MB peak" % result["peak_mb"])
+
+# Compare results against baseline results (both lists of records), flagging benchmarks whose time or peak memory
+# grew by more than tolerance (a fraction). Prints one line per benchmark in both and returns the number of regressions.
+def compare(results, baseline, tolerance):
+  baseline = {result_key(result) : result for result in baseline}
+  regressions = 0
+  for result in results:
+    old = baseline.get(result_key(result))
+    if (old == None or "error" in old or "error" in result):
+      continue
+    time_ratio = result["seconds"] / old["seconds"]
+    memory_ratio = (result["peak_mb"] / old["peak_mb"]) if (old["peak_mb"] > 0) else 1.0
+    flags = (["SLOWER"] if (time_ratio > 1 + tolerance) else []) + (["MORE MEMORY"] if (memory_ratio > 1 + tolerance) else [])
+    regressions += (len(flags) > 0)
+    print("%-90s time x%.2f, memory x%.2f %s" % (result_key(result), time_ratio, memory_ratio, " ".join(flags)))
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--quick", action = "store_true", help = "run the small grids only")
+  parser.add_argument("--only", nargs = "+", choices = list(BENCHMARKS.keys()), help = "benchmarks to run (default: all)")
+  parser.add_argument("--repeats", type = int, default = 3, help = "timed runs per benchmark")
+  parser.add_argument("--output", help = "JSON file to save results to")
+  parser.add_argument("--baseline", help = "JSON file of earlier results to compare against")
+  parser.add_argument("--tolerance", type = float, default = 0.25, help = "relative slowdown or memory growth flagged as a regression")
+  args = parser.parse_args()
+
+  results = []
+  for name in (args.only if (args.only != None) else BENCHMARKS.keys()):
+    for params in benchmark_grid(name, args.quick):
+      results += [run_benchmark(name, params, args.repeats)]
+      print(format_result(results[-1]))
+      sys.stdout.flush()
+
+  if (args.output != None):
+    report = {"python" : platform.python_version(), "numpy" : numpy.__version__, "platform" : platform.platform(),
+              "date" : time.strftime("%Y-%m-%d %H:%M:%S"), "repeats" : args.repeats, "results" : results}
+    with open(args.output, "w") as output_file:
+      json.dump(report, output_file, indent = 1)
+  if (args.baseline != None):
+    with open(args.baseline) as baseline_file:
+      regressions = compare(results, json.load(baseline_file)["results"], args.tolerance)
+    print(regressions, "regressions")
+    sys.exit(1 if (regressions > 0) else 0)
@@ -0,0 +1,87 @@
+import numpy
+
+WORD_BITS = 64
+
+# count the set bits in an array of uint64 words
+def popcount(words):
+  if hasattr(numpy, "bitwise_count"): # numpy >= 2.0
+    return int(numpy.sum(numpy.bitwise_count(words), dtype = numpy.int64))
+  else:
+    return int(numpy.sum(popcount.byte_table[words.view(numpy.uint8)], dtype = numpy.int64))
+popcount.byte_table = numpy.array([bin(i).count("1") for i in range(0, 256)], dtype = numpy.uint8)
+
+# A growable trace of per-probe 0/1 outcomes, packed 64 probes to a uint64 word (probe m is bit m % 64 of word m // 64).
+# Compared to a list of Python ints this takes 1 bit instead of ~8 bytes per probe,
+# and or-ing two traces or counting the 1s becomes a handful of word-wise numpy operations.
+class BitTrace(object):
+  def __init__(self, words = None, length = 0):
+    if (words is None):
+      words = numpy.zeros(1, dtype = numpy.uint64)
+    assert(len(words) * WORD_BITS >= length)
+    self.words = words # may have spare capacity past length; bits past length are always 0
+    self.length = length
+
+  def __len__(self):
+    return self.length
+
+  # make room for at least num_bits bits, doubling the capacity to keep appends cheap
+  def reserve(self, num_bits):
+    num_words = (num_bits + WORD_BITS - 1) // WORD_BITS
+    if (num_words > len(self.words)):
+      words = numpy.zeros(max(num_words, 2 * len(self.words)), dtype = numpy.uint64)
+      words[:len(self.words)] = self.words
+      self.words = words
+
+  def append(self, bit):
+    self.reserve(self.length + 1)
+    if (bit):
+      self.words[self.length // WORD_BITS] |= numpy.uint64(1) << numpy.uint64(self.length % WORD_BITS)
+    self.length += 1
+
+  # append a sequence of outcomes (anything numpy can turn into booleans)
+  def extend(self, bits):
+    bits = numpy.asarray(bits, dtype = bool)
+    self.reserve(self.length + len(bits))
+    # re-pack the partially filled last word together with the new bits
+    first_word = self.length // WORD_BITS
+    partial = self.length % WORD_BITS
+    if (partial != 0):
+      bits = numpy.concatenate((BitTrace.unpack(self.words[first_word:first_word + 1], partial), bits))
+    packed = BitTrace.pack(bits)
+    self.words[first_word:first_word + len(packed)] = packed
+    self.length += len(bits) - partial
+
+  # the words holding the first self.length bits
+  def active_words(self):
+    return self.words[:(self.length + WORD_BITS - 1) // WORD_BITS]
+
+  # number of 1s in the trace
+  def count(self):
+    return popcount(self.active_words())
+
+  # logical or of equally long traces
+  @staticmethod
+  def union(traces):
+    assert(len(traces) > 0)
+    length = len(traces[0])
+    assert(all([len(trace) == length for trace in traces]))
+    words = traces[0].active_words().copy()
+    for trace in traces[1:]:
+      numpy.bitwise_or(words, trace.active_words(), out = words)
+    return BitTrace(words, length)
+
+  # pack booleans into little-endian uint64 words, zero padded
+  @staticmethod
+  def pack(bits):
+    num_words = (len(bits) + WORD_BITS - 1) // WORD_BITS
+    padded = numpy.zeros(num_words * WORD_BITS, dtype = bool)
+    padded[:len(bits)] = bits
+    return numpy.packbits(padded, bitorder = "little").view("<u8").astype(numpy.uint64)
+
+  # unpack the first num_bits bits of words
+  @staticmethod
+  def unpack(words, num_bits):
+    return numpy.unpackbits(words.astype("<u8").view(numpy.uint8), bitorder = "little")[:num_bits].astype(bool)
+
+  def to_array(self):
+    return BitTrace.unpack(self.active_words(), self.length)
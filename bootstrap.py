@@ -0,0 +1,48 @@
+import numpy
+
+# Bootstrap confidence intervals from a single run: instead of simulating num_trials independent runs, the probes of one run
+# are resampled with replacement num_replicates times, and the estimators are rerun on every resample.
+# A resample of n probes is a multinomial(n, 1/n, ..., 1/n) count per probe, so resampled per-probe indicators
+# (e.g., "some receiver under node k got the probe") add up to weights @ indicators, one matrix product per chunk of probes
+# for all replicates at once, and no resample is ever materialized.
+# BootstrapWeights hands out those counts chunk by chunk as probes stream in (see LossTomographyMle.update_bootstrap and
+# DelayTomographyMle.update_bootstrap), so the probes needn't be kept, as long as their number is known up front.
+
+CONFIDENCE = 0.95 # coverage of the bootstrap confidence intervals
+
+class BootstrapWeights(object):
+  def __init__(self, num_probes, num_replicates, rng):
+    assert(num_probes > 0)
+    assert(num_replicates >= 1)
+    self.num_probes = num_probes
+    self.num_replicates = num_replicates
+    self.rng = rng
+    self.remaining = num_probes # probes not handed out yet
+    self.draws = numpy.full(num_replicates, num_probes, dtype = numpy.int64) # draws of every replicate not allocated yet
+
+  # (num_replicates x num_probes) matrix of how many times each of the next num_probes probes is drawn in every replicate.
+  # Every replicate's draws fall on the chunk binomially (the multinomial's marginal), and then uniformly within it,
+  # so that once all probes are handed out, every row of the concatenated matrices is multinomial(n, 1/n, ..., 1/n).
+  def next(self, num_probes):
+    assert(num_probes <= self.remaining)
+    if (num_probes == self.remaining):
+      chunk_draws = self.draws
+    else:
+      chunk_draws = self.rng.binomial(self.draws, num_probes / self.remaining)
+    probes = self.rng.integers(0, num_probes, size = int(numpy.sum(chunk_draws)))
+    flat = (numpy.repeat(numpy.arange(self.num_replicates), chunk_draws) * num_probes) + probes
+    weights = numpy.bincount(flat, minlength = self.num_replicates * num_probes).reshape(self.num_replicates, num_probes)
+    self.draws = self.draws - chunk_draws
+    self.remaining -= num_probes
+    return weights
+
+  # the resampled rates of (num_replicates x num_columns) resampled counts, once every probe has been handed out
+  def rates(self, counts):
+    assert(self.remaining == 0)
+    return counts / self.num_probes
+
+# Percentile bootstrap interval: the (1 - confidence) / 2 and (1 + confidence) / 2 quantiles of replicates along axis 0
+def percentile_interval(replicates, confidence = CONFIDENCE):
+  assert(len(replicates) > 0)
+  (lower, upper) = numpy.quantile(replicates, [(1 - confidence) / 2, (1 + confidence) / 2], axis = 0)
+  return (lower, upper)
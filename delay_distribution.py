@@ -2,19 +2,70 @@ import numpy
 ALPHA = 1.3
 
 class DelayDistribution:
-  def __init__(self, t_mean_delay, t_delay_type):
+  # rng is the numpy.random.Generator to draw from (a fresh, unseeded one if None)
+  def __init__(self, t_mean_delay, t_delay_type, rng = None):
     assert(t_delay_type in ["geometric", "pareto", "uniform"])
     assert(t_mean_delay > 0)
+    self.rng = rng if (rng != None) else numpy.random.default_rng()
     self.mean_delay = t_mean_delay
     self.delay_type = t_delay_type
     self.beta_min = (self.mean_delay * (ALPHA-1)) / ALPHA
 
   def delay_sample(self):
     if (self.delay_type == "geometric"):
-      return numpy.random.geometric(1.0 / (self.mean_delay + 1)) - 1
+      return self.rng.geometric(1.0 / (self.mean_delay + 1)) - 1
     elif (self.delay_type == "pareto"):
-      return (numpy.random.pareto(ALPHA) + 1)* self.beta_min
+      return (self.rng.pareto(ALPHA) + 1)* self.beta_min
     elif (self.delay_type == "uniform"):
-      return numpy.random.random_integers(0, 2 * self.mean_delay)
+      return self.rng.integers(0, int(2 * self.mean_delay), endpoint = True)
     else:
       assert(False)
+
+  # Batch version of delay_sample for many links at once: draws all delays of links sharing a delay type
+  # in one (num_probes x num_links_of_that_type) call from the Generator rng.
+  # Returns a (num_probes x len(delay_dists)) float matrix.
+  @staticmethod
+  def delay_samples_on_links(delay_dists, num_probes, rng):
+    links = DelayLinks([delay_dist.mean_delay for delay_dist in delay_dists], [delay_dist.delay_type for delay_dist in delay_dists])
+    return links.delay_samples(num_probes, rng)
+
+DELAY_TYPES = ["geometric", "pareto", "uniform"]
+
+# Array counterpart of DelayDistribution: the parameters of many links in contiguous arrays indexed by link,
+# so that large trees don't need one DelayDistribution object per link.
+# mean_delays and delay_types hold every link's mean delay and delay type (or one value for all links);
+# types are kept as indices into DELAY_TYPES.
+class DelayLinks(object):
+  def __init__(self, mean_delays, delay_types, num_links = None):
+    if (num_links == None):
+      num_links = max(numpy.size(mean_delays), numpy.size(delay_types))
+    self.mean_delays = numpy.array(numpy.broadcast_to(numpy.asarray(mean_delays, dtype = float), (num_links,)))
+    delay_types = numpy.broadcast_to(numpy.asarray(delay_types), (num_links,))
+    assert(numpy.all(numpy.isin(delay_types, DELAY_TYPES)))
+    assert(numpy.all(self.mean_delays > 0))
+    self.delay_types = numpy.zeros(num_links, dtype = numpy.uint8)
+    for t in range(0, len(DELAY_TYPES)):
+      self.delay_types[delay_types == DELAY_TYPES[t]] = t
+    self.beta_mins = (self.mean_delays * (ALPHA-1)) / ALPHA
+
+  def __len__(self):
+    return len(self.delay_types)
+
+  # Draw num_probes delays on every link from the Generator rng, all links of a delay type in one call.
+  # Returns a (num_probes x len(self)) float matrix.
+  def delay_samples(self, num_probes, rng):
+    delays = numpy.empty((num_probes, len(self)))
+    for t in range(0, len(DELAY_TYPES)):
+      links = numpy.flatnonzero(self.delay_types == t)
+      if (len(links) == 0):
+        continue
+      mean_delays = self.mean_delays[links]
+      size = (num_probes, len(links))
+      if (DELAY_TYPES[t] == "geometric"):
+        delays[:, links] = rng.geometric(1.0 / (mean_delays + 1), size) - 1
+      elif (DELAY_TYPES[t] == "pareto"):
+        delays[:, links] = (rng.pareto(ALPHA, size) + 1) * self.beta_mins[links]
+      else:
+        assert(DELAY_TYPES[t] == "uniform")
+        delays[:, links] = rng.integers(0, numpy.floor(2 * mean_delays).astype(numpy.int64), size, endpoint = True)
+    return delays
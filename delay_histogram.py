@@ -0,0 +1,127 @@
+import math
+import numpy
+
+DEFAULT_TAIL_QUANTILE = 0.99 # With max_bins but no quantile, the estimator's bins end at this quantile (see binning)
+QUANTILE_MARGIN = 2 # With a quantile, the histograms keep bins up to this many times the bin the quantile falls in
+
+# Per-column histograms of delays in bins of width q, e.g., of every node's subtree minimum delay (the minimum over the
+# receivers under it) for every probe, which is all the delay estimator needs: gamma is the binned CDF of those minimums.
+# Bin i covers delays up to (i * q) + (q / 2), like find_y's thresholds. Bins are added as larger delays arrive,
+# so memory is O(columns x bins) however many probes are added, and the CDF can be computed at any time.
+# With quantile, only the delays up to every column's quantile matter to the estimator, the rest going to a tail (see binning),
+# so that a few huge delays (e.g., from heavy-tailed links) needn't blow up memory: the first time a delay falls beyond
+# QUANTILE_MARGIN times the bin the quantile has reached so far, the histogram stops growing, and its last bin counts every
+# larger delay from then on (an overflow bin). The bins before it stay exact; the margin is for the quantile to move up later.
+# Bootstrap replicates (see bootstrap.py) are histograms of num_replicates copies of the delays' columns, one copy per
+# replicate, with every probe counted as many times as the replicate draws it (see add's weights).
+class DelayHistogram(object):
+  def __init__(self, num_columns, q, quantile = None):
+    assert(q > 0)
+    assert(quantile == None or (quantile > 0 and quantile <= 1))
+    self.q = q
+    self.quantile = quantile
+    self.max_width = None # set once the histogram stops growing
+    self.counts = numpy.zeros((num_columns, 1), dtype = numpy.int64) # capacity doubles as needed
+    self.total = 0
+    self.max_delay = -math.inf
+
+  # the bin of every delay: the first bin whose upper edge is at least the delay
+  def bins(self, delays):
+    q = self.q
+    bins = numpy.maximum(0, numpy.ceil((delays - (q / 2)) / q)).astype(numpy.int64)
+    # correct for rounding, so that bins agree exactly with a search over the upper edges (i * q) + (q / 2)
+    bins -= (bins > 0) & (delays <= ((bins - 1) * q) + (q / 2))
+    bins += (delays > (bins * q) + (q / 2))
+    return bins
+
+  # Add a (num_probes x num_columns) matrix of delays. With weights, a (num_replicates x num_probes) matrix of how many
+  # times every replicate draws every probe (e.g., from BootstrapWeights), the histogram has num_replicates * num_columns
+  # columns, and replicate r's copy of column c is column r * num_columns + c. Once all of a run's probes are added,
+  # every replicate has drawn as many probes as were added, so total is every replicate's total too.
+  def add(self, delays, weights = None):
+    delays = numpy.atleast_2d(delays)
+    (num_probes, num_columns) = delays.shape
+    num_replicates = 1 if (weights is None) else weights.shape[0]
+    assert(num_columns * num_replicates == self.counts.shape[0])
+    assert(weights is None or weights.shape[1] == num_probes)
+    if (num_probes == 0):
+      return
+    bins = self.bins(delays)
+    width = self.counts.shape[1]
+    if (self.quantile != None and self.max_width == None):
+      # the quantile of all delays so far is at most the larger of the stored delays' quantile and this batch's
+      # (whose resampling weights are left out: the margin covers them)
+      stored = self.quantile_bin(self.quantile) if (self.total > 0) else 0
+      batch = int(numpy.max(numpy.quantile(bins, self.quantile, axis = 0, method = "higher")))
+      overflow = max(width, (QUANTILE_MARGIN * max(stored, batch)) + 1)
+      if (numpy.max(bins) > overflow):
+        self.max_width = overflow + 1
+    if (self.max_width != None):
+      numpy.minimum(bins, self.max_width - 1, out = bins)
+    needed = int(numpy.max(bins)) + 1
+    if (needed > width):
+      width = max(needed, 2 * width) if (self.max_width == None) else min(max(needed, 2 * width), self.max_width)
+      self.counts = numpy.hstack((self.counts, numpy.zeros((self.counts.shape[0], width - self.counts.shape[1]), dtype = numpy.int64)))
+    # one bincount over (column, bin) pairs flattened into column * width + bin
+    flat = bins + (numpy.arange(0, num_columns) * width)
+    if (weights is None):
+      self.counts += numpy.bincount(flat.ravel(), minlength = num_columns * width).reshape(num_columns, width)
+    else:
+      flat = flat + (numpy.arange(0, num_replicates) * (num_columns * width))[:, numpy.newaxis, numpy.newaxis]
+      counts = numpy.bincount(flat.ravel(), weights = numpy.broadcast_to(weights[:, :, numpy.newaxis], flat.shape).ravel(), \
+                              minlength = num_replicates * num_columns * width)
+      self.counts += numpy.rint(counts).astype(numpy.int64).reshape(num_replicates * num_columns, width)
+    self.total += num_probes
+    self.max_delay = max(self.max_delay, float(numpy.max(delays)))
+
+  # number of the last bin the delay experiments use: ceil(max delay / q) (or the last bin before the overflow bin)
+  def i_max(self):
+    i_max = math.ceil((self.max_delay * 1.0) / self.q)
+    return i_max if (self.max_width == None) else min(i_max, self.max_width - 2)
+
+  # the first bin by which every column's CDF reaches quantile
+  def quantile_bin(self, quantile):
+    assert(quantile > 0 and quantile <= 1)
+    cumulative = numpy.cumsum(self.counts, axis = 1)
+    return int(numpy.max(numpy.argmax(cumulative >= math.ceil(quantile * self.total), axis = 1)))
+
+  # The bins to estimate on, as (i_max, factor): the estimator's bins are factor (odd) bins of this histogram each,
+  # i.e., of width factor * q (see cdf), and i_max is its last bin. By default that's every bin up to i_max().
+  # With quantile, bins end at quantile_bin(quantile), so that a few outliers don't set i_max; the rarest, largest delays
+  # are left to a tail, whose mass on a link is what its estimated alpha is short of 1 (i.e., 1 - sum(alpha)).
+  # With max_bins, bins are merged into the fewest odd-sized groups that keep at most max_bins of them, so that the cost of
+  # the estimator is bounded by max_bins rather than by the largest delay. Merged bins stay on a uniform grid (bin I covers
+  # delays up to (I + 1/2) factor q), which the estimator needs: it adds up link delays by adding up bin numbers.
+  # Merging only keeps a usable resolution up to a quantile, though: bins up to the largest of heavy-tailed delays are so wide
+  # that nearly all the mass lands in bin 0, so max_bins without a quantile cuts at DEFAULT_TAIL_QUANTILE.
+  def binning(self, quantile = None, max_bins = None):
+    last = self.i_max()
+    quantile = DelayHistogram.tail_quantile(quantile, max_bins)
+    if (quantile != None):
+      last = min(last, self.quantile_bin(quantile))
+    factor = 1
+    if (max_bins != None):
+      assert(max_bins >= 1)
+      # the smallest odd factor with (last - (factor - 1) / 2) // factor <= max_bins - 1
+      factor = ((2 * last + 1) // (2 * max_bins + 1)) + 1
+      factor += 1 - (factor % 2)
+    return ((last - (factor - 1) // 2) // factor, factor)
+
+  # the quantile binning's bins end at: quantile, or with max_bins only, DEFAULT_TAIL_QUANTILE (None: the largest delay)
+  @staticmethod
+  def tail_quantile(quantile, max_bins):
+    return DEFAULT_TAIL_QUANTILE if (quantile == None and max_bins != None) else quantile
+
+  # (num_columns x (i_max + 1)) matrix of the fraction of delays in bins 0 .. i for every i, i.e., gamma,
+  # on bins of factor (odd) bins each (see binning)
+  def cdf(self, i_max, factor = 1):
+    assert(self.total > 0)
+    assert(factor % 2 == 1)
+    last = (i_max * factor) + (factor - 1) // 2
+    assert(self.max_width == None or last <= self.max_width - 2)
+    cdf = numpy.cumsum(self.counts[:, :last + 1], axis = 1) / self.total
+    if (cdf.shape[1] < last + 1):
+      # no delays fell beyond the stored bins
+      cdf = numpy.hstack((cdf, numpy.repeat(cdf[:, -1:], last + 1 - cdf.shape[1], axis = 1)))
+    # merged bin I ends where bin I * factor + (factor - 1) / 2 does
+    return cdf[:, (numpy.arange(0, i_max + 1) * factor) + (factor - 1) // 2]
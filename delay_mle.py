@@ -1,8 +1,14 @@
 import math
 from tree import Tree
-import cvxpy
+from loss_mle import LossTomographyMle
+import minc_solver
+from instrumentation import instrumented
 import numpy
-import numpy.matlib
+from array_tree import BATCH_ENTRIES
+from delay_histogram import DelayHistogram
+from bootstrap import BootstrapWeights
+
+SUM_CONSTRAINT_WEIGHT = 1e4 # Weight of the sum(alpha) = 1 row when the sum constraint is active in least_squares
 
 # max likelihood delay distribution estimator from http://nickduffield.net/download/papers/delaylast.pdf
 # "Multicast-based inference of network-internal delay distributions"
@@ -13,12 +19,15 @@ class DelayTomographyMle(object):
   def create_Y_and_root(tree, n):
     all_nodes = tree.nodes()
     for node in all_nodes:
-      node.Y = [math.inf] * n
+      node.Y = numpy.full(n, math.inf)
+    DelayTomographyMle.create_root(tree)
+
+  @staticmethod
+  def create_root(tree):
     # create a fake root node so that k.parent doesn't throw an error
     root = Tree(1, "delay", 0.5, "geometric") # The exact values here are irrelevant because root is a fake node
     root.id = -1
-    root.left = tree
-    root.right = tree
+    root.child_nodes = [tree]
     root.parent = None
     tree.parent = root
 
@@ -43,202 +52,373 @@ class DelayTomographyMle(object):
     # Y and gamma calculations
     DelayTomographyMle.find_y(tree, q, i_max, n)
 
-    # A calculations
+    # A, beta and alpha calculations on the nodes' gammas
+    gamma = numpy.array([node.gamma for node in tree.nodes()])
+    (A, beta, alpha) = DelayTomographyMle.estimate(tree.topology(), gamma, i_max, epsilon)
+    DelayTomographyMle.set_estimates(tree, gamma, A, beta, alpha)
+
+  # store the rows of the (num_nodes x (i_max + 1)) matrices gamma, A, beta and alpha in the nodes of a Tree, as lists
+  @staticmethod
+  def set_estimates(tree, gamma, A, beta, alpha):
+    all_nodes = tree.nodes()
+    for k in range(0, len(all_nodes)):
+      all_nodes[k].gamma = gamma[k].tolist()
+      all_nodes[k].A = A[k].tolist()
+      all_nodes[k].beta = beta[k].tolist()
+      all_nodes[k].alpha = alpha[k].tolist()
+
+  # Streaming mode: gamma only needs, for every node, the binned distribution of the minimum delay over the receivers under it.
+  # Those histograms (see delay_histogram.py) are updated as probes arrive, so the estimator uses O(nodes x bins) memory
+  # however many probes it sees, and estimates can be computed at any point with compute_streaming_estimate.
+  # Works on Trees and ArrayTrees; call create_root on a Tree before sending probes (like create_Y_and_root),
+  # so that probes are delayed on its root's incoming link. With quantile, the histograms only keep the bins up to about
+  # the delays' quantile (the rest in an overflow bin), bounding their memory however heavy-tailed the delays are.
+  @staticmethod
+  def create_streaming_estimator(tree, q, quantile = None):
+    tree.delay_histogram = DelayHistogram(tree.topology().num_nodes, q, quantile) # indexed by topology index
+
+  @staticmethod
+  @instrumented("update_histogram")
+  def update_histogram(tree, leaf_delays):
+    # fold a (num_probes x num_receivers) matrix of end-to-end delays (columns following topology().leaf_order) into the histograms
+    tree.delay_histogram.add(tree.topology().reduce_up(numpy.atleast_2d(leaf_delays), numpy.minimum))
+
+  # Estimate from the probes seen so far on bins 0 .. i_max (tree.delay_histogram.i_max() covers every delay seen),
+  # each factor (odd) histogram bins wide; tree.delay_histogram.binning picks both for a tail quantile or a bin budget.
+  # Returns the (num_nodes x (i_max + 1)) matrices gamma, A, beta and alpha in topology order (see set_estimates for Trees).
+  @staticmethod
+  def compute_streaming_estimate(tree, i_max, epsilon, factor = 1):
+    gamma = DelayTomographyMle.check_gamma(tree.topology(), tree.delay_histogram.cdf(i_max, factor))
+    (A, beta, alpha) = DelayTomographyMle.estimate(tree.topology(), gamma, i_max, epsilon)
+    return (gamma, A, beta, alpha)
+
+  # Bootstrap mode (see bootstrap.py): alongside the streaming histograms, num_replicates resamples of the num_probes probes
+  # the tree will see are binned as probes arrive, into one histogram of num_replicates copies of every node's column
+  # (see DelayHistogram.add), and compute_bootstrap_estimate then estimates every replicate.
+  @staticmethod
+  def create_bootstrap_estimator(tree, q, num_probes, num_replicates, rng):
+    tree.bootstrap_weights = BootstrapWeights(num_probes, num_replicates, rng)
+    tree.bootstrap_histogram = DelayHistogram(num_replicates * tree.topology().num_nodes, q)
+
+  @staticmethod
+  @instrumented("update_bootstrap")
+  def update_bootstrap(tree, leaf_delays):
+    # fold a (num_probes x num_receivers) matrix of end-to-end delays into every replicate's histograms,
+    # in chunks sized to stay within BATCH_ENTRIES (replicate, probe, node) entries, resampling counts included
+    # after update_histogram on the same delays, whose bins (overflow bin included) the replicates' histograms keep,
+    # so that they cover the bins the estimates are cut at
+    minimums = tree.topology().reduce_up(numpy.atleast_2d(leaf_delays), numpy.minimum)
+    tree.bootstrap_histogram.max_width = tree.delay_histogram.max_width
+    chunk = max(1, BATCH_ENTRIES // tree.bootstrap_histogram.counts.shape[0])
+    for start in range(0, minimums.shape[0], chunk):
+      rows = minimums[start : start + chunk]
+      tree.bootstrap_histogram.add(rows, tree.bootstrap_weights.next(rows.shape[0]))
+
+  # compute_streaming_estimate on every replicate, once the tree has seen all its probes, on the same bins.
+  # Returns the (num_replicates x num_nodes x (i_max + 1)) array of alpha of the replicates that pass the sanity checks
+  # (without reporting the ones that don't). The per-bin recursion of estimate is already vectorized across nodes,
+  # so replicates are estimated one at a time.
+  @staticmethod
+  @instrumented("bootstrap_estimate")
+  def compute_bootstrap_estimate(tree, i_max, epsilon, factor = 1):
+    assert(tree.bootstrap_weights.remaining == 0)
+    topology = tree.topology()
+    gammas = tree.bootstrap_histogram.cdf(i_max, factor).reshape(tree.bootstrap_weights.num_replicates, topology.num_nodes, i_max + 1)
+    alphas = []
+    for gamma in gammas:
+      # replicates that fail the estimator's checks are left out, without reporting them
+      if (numpy.any(DelayTomographyMle.gamma_failures(topology, gamma))):
+        continue
+      (A, beta, alpha) = DelayTomographyMle.solve(topology, gamma, i_max)
+      if (not numpy.any(DelayTomographyMle.beta_failures(beta)) and \
+          not numpy.any(DelayTomographyMle.sanity_failures(gamma, A, beta, alpha, epsilon))):
+        alphas += [alpha]
+    return numpy.array(alphas).reshape(len(alphas), topology.num_nodes, i_max + 1)
+
+  # The estimator on per-node arrays indexed by topology index, for trees whose per-node state lives in arrays
+  # (see array_tree.py): gamma is a (num_nodes x (i_max + 1)) matrix, e.g., from find_gamma.
+  # Returns the matrices A, beta and alpha of the same shape, after sanity checking them.
+  @staticmethod
+  @instrumented("estimate")
+  def estimate(topology, gamma, i_max, epsilon):
+    (A, beta, alpha) = DelayTomographyMle.solve(topology, gamma, i_max)
+    DelayTomographyMle.check_beta(beta)
+    DelayTomographyMle.sanity_check(gamma, A, beta, alpha, epsilon)
+    return (A, beta, alpha)
+
+  # estimate without the checks, on a gamma that passes gamma_failures: returns A, beta and alpha for the caller to check
+  # (see beta_failures and sanity_failures). The recursion stops at the first bin whose beta fails, leaving A and beta
+  # at -1 from the next bin on and all of alpha at -1; a node without a valid root in some bin gets NaN there.
+  @staticmethod
+  def solve(topology, gamma, i_max):
+    num_nodes = topology.num_nodes
+    A = numpy.full((num_nodes, i_max + 1), -1.0)
+    beta = numpy.full((num_nodes, i_max + 1), -1.0)
+    # parent_A[k] is the row of A of node k's parent, filled in bin by bin like A,
+    # with the fake root above the tree initialized according to paper's instructions.
+    parent_A = numpy.zeros((num_nodes, i_max + 1))
+    parent_A[0, 0] = 1
+    # child_product[k, i] is prod_j (1 - beta[j, i]) - 1 over the children j of internal node k (see compute_p)
+    child_product = numpy.zeros((num_nodes, i_max + 1))
+
+    # A(0) solves the loss estimator's equation on gamma(0), for all nodes at once
+    A[:, 0] = minc_solver.solve_minc_on_topology(topology, gamma[:, 0])
+    parent_A[1:, 0] = A[topology.parent[1:], 0]
+
+    # A and beta calculations, one bin at a time. Within bin i, a node's A only depends on earlier bins (of its own A
+    # and its children's beta), and its beta on its parent's A up to bin i, so every bin takes two steps over all nodes
+    # at once: first A, then beta.
+    groups = DelayTomographyMle.fanout_groups(topology)
     for i in range(0, i_max + 1):
-      DelayTomographyMle.infer_delay(tree, i, q, i_max)
+      if ((i > 0) and numpy.any(DelayTomographyMle.beta_failures(beta[:, i - 1 : i + 1]))):
+        return (A, beta, numpy.full((num_nodes, i_max + 1), -1.0))
+      DelayTomographyMle.infer_delay(topology, groups, gamma, A, beta, parent_A, child_product, i)
+
+    # Compute alpha using least squares, once per node now that all of A is known: the exact solutions of all nodes
+    # at once, and least_squares for the nodes whose exact solution isn't a distribution (but not for the NaN rows
+    # of nodes without a valid root, whose NaN alpha is left for the sanity check to report)
+    alpha = DelayTomographyMle.forward_substitution(parent_A, A)
+    infeasible = numpy.any(alpha < 0, axis = 1) | (numpy.sum(alpha, axis = 1) > 1)
+    infeasible &= ~numpy.any(numpy.isnan(alpha), axis = 1)
+    for k in numpy.flatnonzero(infeasible).tolist():
+      alpha[k] = DelayTomographyMle.least_squares(parent_A[k], A[k])
+    return (A, beta, alpha)
 
-    # Run sanity check
-    DelayTomographyMle.sanity_check(tree, i_max, epsilon)
+  # Internal nodes grouped by fanout, since the equation of a node with d children has degree d (see solvefor2):
+  # a list of (fanout, nodes, (len(nodes) x fanout) matrix of the positions of their children in topology.child_index).
+  @staticmethod
+  def fanout_groups(topology):
+    internal = numpy.flatnonzero(~topology.is_leaf)
+    fanout = numpy.diff(topology.child_start)[internal]
+    assert(numpy.all(fanout >= 2))
+    groups = []
+    for d in numpy.unique(fanout).tolist():
+      nodes = internal[fanout == d]
+      groups += [(d, nodes, topology.child_start[nodes][:, numpy.newaxis] + numpy.arange(0, d))]
+    return groups
+
+  # The values must be in [0, 1], with some tolerance for floating point approximations: a (num_nodes x (i_max + 1) x 8) mask
+  # of the failures of the lower bounds of alpha, A, gamma and beta, then their upper bounds
+  # (NaN, e.g., from a node without a valid root in solvefor2, fails both)
+  @staticmethod
+  def sanity_failures(gamma, A, beta, alpha, epsilon):
+    values = numpy.stack((alpha, A, gamma, beta), axis = -1)
+    return numpy.concatenate((~(values >= 0-epsilon), ~(values <= 1+epsilon)), axis = -1)
+
+  # sanity_failures, reporting the first failure in the order node, bin, then check
+  @staticmethod
+  @instrumented("sanity_check")
+  def sanity_check(gamma, A, beta, alpha, epsilon):
+    values = numpy.stack((alpha, A, gamma, beta), axis = -1)
+    failed = DelayTomographyMle.sanity_failures(gamma, A, beta, alpha, epsilon)
+    if (numpy.any(failed)):
+      (k, i, check) = numpy.unravel_index(numpy.argmax(failed), failed.shape)
+      print(values[k, i, check % 4])
+      assert(False)
 
-  def sanity_check(tree, i_max, epsilon):
-    # Sanity check the values with some tolerance for floating point approximations
-    for node in tree.nodes():
+  @staticmethod
+  @instrumented("find_y")
+  def find_y(tree, q, i_max, n):
+    assert(n != 0)
+    # bin i covers delays up to (i * q) + (q / 2)
+    thresholds = (numpy.arange(0, i_max + 1) * q) + (q / 2)
+    # Walk the nodes in reverse preorder so that children are processed before their parents
+    for k in reversed(tree.nodes()):
+      for j in k.children():
+        numpy.minimum(k.Y, j.Y, out = k.Y) # for all probes at once
+      # compute CDF for all bins in one pass over the sorted minimum delays
+      k.gamma = (numpy.searchsorted(numpy.sort(k.Y), thresholds, side = "right") / n).tolist()
       for i in range(0, i_max + 1):
-        assert(node.alpha[i] >= 0-epsilon), print(node.alpha[i])
-        assert(node.A[i]     >= 0-epsilon), print(node.A[i])
-        assert(node.gamma[i] >= 0-epsilon), print(node.gamma[i])
-        assert(node.beta[i]  >= 0-epsilon), print(node.beta[i])
-
-        assert(node.alpha[i] <= 1+epsilon), print(node.alpha[i])
-        assert(node.A[i]     <= 1+epsilon), print(node.A[i])
-        assert(node.gamma[i] <= 1+epsilon), print(node.gamma[i])
-        assert(node.beta[i]  <= 1+epsilon), print(node.beta[i])
-
-  @staticmethod
-  def find_y(k, q, i_max, n):
-    for j in k.children():
-      DelayTomographyMle.find_y(j, q, i_max, n)
-      for m in range(0, n): # for all probes
-        k.Y[m] = min(k.Y[m], j.Y[m])
-    for i in range(0, i_max + 1): # compute CDF
-      assert(n != 0)
-      k.gamma[i] = sum([y <= ((i * q) + (q / 2)) for y in k.Y]) / n
-      if ((k.gamma[i] <= 0) or (k.gamma[i] > 1)):
-        print("Invalid k.gamma[", i, "] = ", k.gamma[i], " for node ", k.id)
-        assert(False)
-
-  @staticmethod
-  def infer_delay(k, i, q, i_max):
-    if (i == 0):
-      if (k.children() == []): # leaf nodes
-        k.A[i] = k.gamma[i]
-      else:
-        assert(k.children() != [])
-        if (k.left.gamma[i] + k.right.gamma[i] - k.gamma[i] == 0):
-          print(i)
-          print(k.left.gamma[i])
-          print(k.right.gamma[i])
-          print(k.gamma[i])
-        assert (k.left.gamma[i] + k.right.gamma[i] - k.gamma[i] != 0)
-        # closed form solution for binary trees
-        k.A[i] = (k.left.gamma[i] * k.right.gamma[i] * 1.0) / (k.left.gamma[i] + k.right.gamma[i] - k.gamma[i])
-    else:
-      k.A[i] = DelayTomographyMle.solvefor2(k, i)
-
-    # Compute beta
-    summation = 0
-    for j in range(1, i+1): # 1 to i
-      if (k.beta[i-j] <= 0):
-        print(i, j, k.beta[i-j])
-      assert(k.beta[i-j] > 0)
-      summation += (k.parent.A[j] * k.beta[i-j])
-    k.beta[i] = (k.gamma[i] - summation)/k.parent.A[0]
-
-    # Compute alpha using least squares
-    k.alpha = DelayTomographyMle.least_squares(k, i_max)
-
-    # Recursively process children
-    for j in k.children():
-      DelayTomographyMle.infer_delay(j, i, q, i_max)
-
-  @staticmethod
-  def least_squares(k, i_max):
-    E = numpy.matlib.zeros((i_max + 1, i_max + 1))
-    # populate E
-    for i in range(0, i_max + 1): # row
-      for j in range(0, i_max + 1): # column
-        if (j > i):
-          E[i, j] = 0
-        else:
-          assert(i - j >= 0)
-          E[i, j] = k.parent.A[i-j]
-
-    # populate b
-    b = numpy.array(k.A)
-
-    # Construct the problem.
-    x = cvxpy.Variable(i_max + 1) # solve for alpha
-    objective = cvxpy.Minimize(cvxpy.sum_squares(E*x - b))
-    constraints = [0 <= x, sum(x) <= 1]
-    prob = cvxpy.Problem(objective, constraints)
-
-    # The optimal objective is returned by prob.solve().
-    result = prob.solve()
-
-    # The optimal value for x is stored in x.value.
-    ret = []
-    for var in x:
-      ret += [var.value]
-    return ret
-
-  @staticmethod
-  def solvefor2(k, i):
-    assert(i >= 1)
-    # Use equation 8/16 for solution.
-    if (k.children() == []):
-      summation = 0
-      for j in range(0, i): # 0 to i - 1
-        summation += k.A[j]
-      return k.gamma[i] - summation
-    else:
-      p  = DelayTomographyMle.compute_p(k, i)
-      q  = DelayTomographyMle.compute_q(k)
-      c1 = DelayTomographyMle.compute_c1(k, i)
-      c2 = DelayTomographyMle.compute_c2(k)
-      c3 = DelayTomographyMle.compute_c3(k, i)
-      c4 = DelayTomographyMle.compute_c4(k)
-      (a, b, c)    = DelayTomographyMle.compute_canonical_quadratic_equation(p, q, c1, c2, c3, c4)
-      (sol1, sol2) = DelayTomographyMle.compute_quadratic_solutions(a, b, c)
-
-      # Return second largest solution, i.e., smallest solution in the quadratic case.
-      if (sol1 > sol2):
-        return sol2
-      else:
-        return sol1
+        if ((k.gamma[i] <= 0) or (k.gamma[i] > 1)):
+          print("Invalid k.gamma[", i, "] = ", k.gamma[i], " for node ", k.id)
+          assert(False)
 
-  # Rewrite equation 8/16 as p + qx + (c1 + c2x)(c3 + c4x) = 0
-  # Compute p below.
+  # find_y on a (num_probes x num_receivers) matrix of receiver delays whose columns follow topology.leaf_order,
+  # without keeping a Y per node: the subtree minimum delays of a chunk of probes are binned and counted per node
+  # (see delay_histogram.py), with chunks sized to stay within BATCH_ENTRIES (probe, node) entries.
+  # Returns gamma as a (num_nodes x (i_max + 1)) matrix in topology order.
   @staticmethod
-  def compute_p(k, i):
-    assert(k.left != None)
-    assert(k.right != None)
-    assert(i >= 1)
-    p = k.gamma[i] - k.A[0]
-    if (i == 1):
-      return p
-    else:
-      for j in range(1, i): # i.e., 1 to i-1
-        assert(i - j >= 0)
-        p += k.A[j] * ((1 - k.left.beta[i - j]) * (1 - k.right.beta[i - j]) - 1)
-      return p
+  @instrumented("find_gamma")
+  def find_gamma(topology, leaf_delays, q, i_max):
+    n = leaf_delays.shape[0]
+    assert(n != 0)
+    histogram = DelayHistogram(topology.num_nodes, q)
+    chunk = max(1, BATCH_ENTRIES // topology.num_nodes)
+    for start in range(0, n, chunk):
+      histogram.add(topology.reduce_up(leaf_delays[start : start + chunk], numpy.minimum))
+    return DelayTomographyMle.check_gamma(topology, histogram.cdf(i_max))
 
-  # Rewrite equation 8/16 as p + qx + (c1 + c2x)(c3 + c4x) = 0
-  # Compute q below.
+  # Like find_y, every gamma (in topology order) must be in (0, 1]; and A(0) solves the loss estimator's equation on gamma(0),
+  # whose conditions (see LossTomographyMle.gamma_failures) bin 0 must meet as well: a mask of the gammas that fail
   @staticmethod
-  def compute_q(k):
-    assert(k.left != None)
-    assert(k.right != None)
-    return (1 - k.left.beta[0]) * (1 - k.right.beta[0]) - 1
+  def gamma_failures(topology, gamma):
+    failed = (gamma <= 0) | (gamma > 1)
+    failed[:, 0] |= LossTomographyMle.gamma_failures(topology, gamma[:, 0])[0]
+    return failed
 
-  # Rewrite equation 8/16 as p + qx + (c1 + c2x)(c3 + c4x) = 0
-  # Compute c1 below.
+  # gamma_failures, naming the first node that fails by its id; returns gamma
   @staticmethod
-  def compute_c1(k, i):
-    assert(k.left != None)
-    assert(k.right != None)
-    assert(i >= 1)
-    summation = 0
-    if i == 1:
-      summation = 0
-    else:
-      for j in range(1, i): # i.e., j goes from 1 to i - 1
-        assert(i - j >= 0)
-        assert(k.left.beta[i - j] > 0)
-        summation += k.left.beta[i - j] * k.A[j]
-    return k.A[0] * (1 - k.left.gamma[i]/k.A[0] + summation / k.A[0])
+  def check_gamma(topology, gamma):
+    invalid = DelayTomographyMle.gamma_failures(topology, gamma)
+    if (numpy.any(invalid)):
+      (k, i) = numpy.unravel_index(numpy.argmax(invalid), invalid.shape)
+      print("Invalid gamma[", i, "] = ", gamma[k, i], " for node ", topology.postorder_rank()[k] + 1)
+      assert(False)
+    return gamma
 
-  # Rewrite equation 8/16 as p + qx + (c1 + c2x)(c3 + c4x) = 0
-  # Compute c2 below.
   @staticmethod
-  def compute_c2(k):
-    assert(k.left != None)
-    assert(k.right != None)
-    return k.A[0] * (k.left.beta[0] / k.A[0])
+  @instrumented("infer_delay")
+  def infer_delay(topology, groups, gamma, A, beta, parent_A, child_product, i):
+    # A(0) is computed for all nodes at once by solve
+    if (i > 0):
+      A[:, i] = DelayTomographyMle.solvefor2(topology, groups, gamma, A, beta, child_product, i)
+      parent_A[1:, i] = A[topology.parent[1:], i]
+
+    # Compute beta, where the sum over j = 1 to i of parent_A[j] * beta[i - j] is a convolution of every node's rows
+    summation = numpy.einsum("kj,kj->k", parent_A[:, 1:i + 1], beta[:, :i][:, ::-1])
+    beta[:, i] = (gamma[:, i] - summation) / parent_A[:, 0]
+    internal = numpy.flatnonzero(~topology.is_leaf)
+    child_product[internal, i] = numpy.multiply.reduceat(1 - beta[topology.child_index, i], topology.child_start[internal]) - 1
+
+  # beta must stay positive (and not NaN) for the recursion, i.e., in every bin but the last:
+  # a (num_nodes x i_max) mask of the betas that fail
+  @staticmethod
+  def beta_failures(beta):
+    return ~(beta[:, :-1] > 0)
+
+  # beta_failures, reporting the first failure in the order bin, node
+  @staticmethod
+  def check_beta(beta):
+    failed = DelayTomographyMle.beta_failures(beta).T
+    if (numpy.any(failed)):
+      (i, k) = numpy.unravel_index(numpy.argmax(failed), failed.shape)
+      print(i, k, beta[k, i])
+      assert(False)
+
+  # The exact solutions of A = E alpha (see least_squares) for the rows of A and parent_A of all nodes at once
+  @staticmethod
+  def forward_substitution(parent_A, A):
+    assert(numpy.all(parent_A[:, 0] > 0))
+    x = numpy.zeros(A.shape)
+    for i in range(0, A.shape[1]):
+      x[:, i] = (A[:, i] - numpy.einsum("kj,kj->k", parent_A[:, i:0:-1], x[:, :i])) / parent_A[:, 0]
+    return x
+
+  # Solve for alpha in A = E alpha, i.e., minimize |E alpha - A|^2 subject to alpha >= 0 and sum(alpha) <= 1,
+  # where A is a node's row of A, and E is the lower triangular Toeplitz matrix with E[i, j] = parent_A[i - j] for j <= i.
+  # Usually the exact solution by forward substitution is already feasible; otherwise fall back to
+  # an active-set non-negative least squares, adding the sum constraint if it turns out to be active.
+  @staticmethod
+  @instrumented("least_squares")
+  def least_squares(parent_A, A):
+    i_max = len(A) - 1
+    parent_A = numpy.asarray(parent_A, dtype = float)
+    b = numpy.array(A, dtype = float)
+    assert(parent_A[0] > 0)
+
+    # forward substitution, using the Toeplitz structure so that every row is one dot product
+    x = numpy.zeros(i_max + 1)
+    for i in range(0, i_max + 1):
+      x[i] = (b[i] - numpy.dot(parent_A[i:0:-1], x[:i])) / parent_A[0]
+    if (numpy.all(x >= 0) and numpy.sum(x) <= 1):
+      return x
+
+    # populate E
+    lags = numpy.subtract.outer(numpy.arange(0, i_max + 1), numpy.arange(0, i_max + 1))
+    E = numpy.where(lags >= 0, parent_A[numpy.maximum(lags, 0)], 0.0)
+    x = DelayTomographyMle.nnls(E, b)
+    if (numpy.sum(x) > 1):
+      # sum(alpha) <= 1 is active, so impose sum(alpha) = 1 as a heavily weighted extra row
+      E = numpy.vstack((E, SUM_CONSTRAINT_WEIGHT * numpy.ones(i_max + 1)))
+      b = numpy.append(b, SUM_CONSTRAINT_WEIGHT)
+      x = DelayTomographyMle.nnls(E, b)
+    return x
+
+  # Lawson-Hanson active set algorithm for min |E x - b|^2 subject to x >= 0
+  @staticmethod
+  def nnls(E, b, tolerance = 1e-12):
+    num_vars = E.shape[1]
+    passive = numpy.zeros(num_vars, dtype = bool) # variables allowed to be non-zero
+    x = numpy.zeros(num_vars)
+    for iteration in range(0, 3 * num_vars):
+      gradient = E.T @ (b - E @ x)
+      if (numpy.all(passive) or numpy.max(gradient[~passive]) <= tolerance):
+        break
+      passive[numpy.argmax(numpy.where(passive, -numpy.inf, gradient))] = True
+      while True:
+        z = numpy.zeros(num_vars)
+        z[passive] = numpy.linalg.lstsq(E[:, passive], b, rcond = None)[0]
+        if (numpy.all(z[passive] > 0)):
+          break
+        # step from x towards z until the first passive variable hits 0, and drop it from the passive set
+        blocking = passive & (z <= 0)
+        step = numpy.min(x[blocking] / (x[blocking] - z[blocking]))
+        x = x + step * (z - x)
+        passive &= (x > tolerance)
+        x[~passive] = 0
+      x = z
+    return x
+
+  # A[:, i] of all nodes, given A and beta of bins 0 .. i - 1
+  @staticmethod
+  def solvefor2(topology, groups, gamma, A, beta, child_product, i):
+    assert(i >= 1)
+    x = numpy.empty(topology.num_nodes)
+    # Use equation 8/16 for solution.
+    leaves = topology.leaf_order
+    x[leaves] = gamma[leaves, i] - numpy.sum(A[leaves, :i], axis = 1)
+    p = DelayTomographyMle.compute_p(topology, gamma, A, child_product, i)
+    q = DelayTomographyMle.compute_q(child_product)
+    (u, v) = DelayTomographyMle.compute_u_v(topology, gamma, A, beta, i)
+    for (fanout, nodes, slots) in groups:
+      if (fanout > 2):
+        # p + qx + A(0) prod_j (u_j + v_j x) = 0 has degree fanout, so there is no closed form:
+        # take its second largest real root, which is what the quadratic case below picks
+        coefficients = A[nodes, 0:1] * minc_solver.product_polynomial(u[slots], v[slots])
+        coefficients[:, -2] += q[nodes]
+        coefficients[:, -1] += p[nodes]
+        x[nodes] = minc_solver.second_largest_real_roots(coefficients)
+      else:
+        # p + qx + (c1 + c2x)(c3 + c4x) = 0 with c1 + c2x = A(0) (u_1 + v_1 x) and c3 + c4x = u_2 + v_2 x
+        (c1, c2, c3, c4) = (A[nodes, 0] * u[slots[:, 0]], A[nodes, 0] * v[slots[:, 0]], u[slots[:, 1]], v[slots[:, 1]])
+        (a, b, c)    = DelayTomographyMle.compute_canonical_quadratic_equation(p[nodes], q[nodes], c1, c2, c3, c4)
+        (sol1, sol2) = DelayTomographyMle.compute_quadratic_solutions(a, b, c)
+
+        # Return second largest solution, i.e., smallest solution in the quadratic case.
+        x[nodes] = numpy.minimum(sol1, sol2)
+    return x
 
   # Rewrite equation 8/16 as p + qx + (c1 + c2x)(c3 + c4x) = 0
-  # Compute c3 below.
+  # Compute p below, for every internal node (leaves are left NaN).
+  # For any fanout, p and q are as below with the product taken over all children:
+  # p = gamma(i) - A(0) + sum over j = 1 to i - 1 of A(j) (prod_children (1 - beta_child(i - j)) - 1), a convolution of A and child_product.
   @staticmethod
-  def compute_c3(k, i):
-    summation = 0
-    assert(k.left != None)
-    assert(k.right != None)
+  def compute_p(topology, gamma, A, child_product, i):
     assert(i >= 1)
-    if i == 1:
-      summation = 0
-    else:
-      for j in range(1, i):
-        assert(i - j >= 0)
-        assert(k.right.beta[i - j] > 0)
-        summation += k.right.beta[i - j] * k.A[j]
-    return (1 - k.right.gamma[i]/k.A[0] + summation / k.A[0])
+    internal = numpy.flatnonzero(~topology.is_leaf)
+    p = numpy.full(topology.num_nodes, math.nan)
+    p[internal] = gamma[internal, i] - A[internal, 0] + \
+                  numpy.einsum("kj,kj->k", A[internal, 1:i], child_product[internal, 1:i][:, ::-1])
+    return p
 
   # Rewrite equation 8/16 as p + qx + (c1 + c2x)(c3 + c4x) = 0
-  # Compute c4 below.
+  # Compute q below, for every internal node.
+  @staticmethod
+  def compute_q(child_product):
+    return child_product[:, 0]
+
+  # For fanout d, equation 8/16 becomes p + qx + A(0) prod_j (u_j + v_j x) = 0, with one factor per child j
+  # (for d = 2, c1 + c2x = A(0) (u_1 + v_1 x) and c3 + c4x = u_2 + v_2 x).
+  # Compute the arrays u and v below, for every child of every internal node, indexed like topology.child_index.
   @staticmethod
-  def compute_c4(k):
-    assert(k.left != None)
-    assert(k.right != None)
-    return (k.right.beta[0] / k.A[0])
+  def compute_u_v(topology, gamma, A, beta, i):
+    assert(i >= 1)
+    children = topology.child_index
+    parents = topology.parent[children]
+    A_0 = A[parents, 0]
+    # sum over j = 1 to i - 1 of beta_child(i - j) A(j)
+    summation = numpy.einsum("kj,kj->k", beta[children, 1:i][:, ::-1], A[parents, 1:i])
+    return (1 - gamma[children, i]/A_0 + summation / A_0, beta[children, 0] / A_0)
 
   # Rewrite equation 8/16 as p + qx + (c1 + c2x)(c3 + c4x) = 0
   # In the canonical ax^2 + bx + c = 0 format, this turns into
@@ -247,8 +427,10 @@ class DelayTomographyMle(object):
   def compute_canonical_quadratic_equation(p, q, c1, c2, c3, c4):
     return (c2*c4, q + c2*c3 + c4*c1, p + c1*c3)
 
-  # Apply closed form solution to solve quadratic equation.
+  # Apply closed form solution to solve quadratic equations (elementwise on arrays of coefficients),
+  # with NaN solutions for equations without two distinct real ones (see solve).
   @staticmethod
   def compute_quadratic_solutions(a, b, c):
-    assert(b*b - 4 * a * c > 0)
-    return ((-b + math.sqrt(b*b - 4*a*c))/(2*a), (-b - math.sqrt(b*b - 4*a*c)) / (2*a))
+    discriminant = b*b - 4 * a * c
+    root = numpy.sqrt(numpy.where(discriminant > 0, discriminant, math.nan))
+    return ((-b + root)/(2*a), (-b - root) / (2*a))
@@ -1,51 +1,193 @@
 #!~/Desktop/virtualenvironment/bin/python3
 
+import argparse
 import sys
-import math
 import numpy
 from tree import Tree
+from array_tree import ArrayTree
+from topology_file import LinkTable
 from delay_mle import DelayTomographyMle
+from delay_histogram import DelayHistogram
+from probe_trace import trace_writer
+from bootstrap import percentile_interval
+import instrumentation
+from instrumentation import phase
 
-# seed random number generator
-numpy.random.seed(1)
-
-# Cmdline args
-if (len(sys.argv) < 6):
-  print("Usage: " , sys.argv[0], " depth mean_delay delay_type error_tolerance num_probes")
-  sys.exit(1)
-else:
-  depth = int(sys.argv[1])
-  assert(depth > 1)
-  mean_delay = float(sys.argv[2])
+PROBE_BATCH_SIZE = 100000 # Number of multicast probes generated at a time
+
+# Simulate num_probes multicast probes on a tree of the given depth and run the delay estimator on them.
+# Returns i_max, the tree's description, a list of (node id, inferred delay distribution alpha) in preorder, and intervals.
+# With array_tree, the tree is an ArrayTree (see array_tree.py), whose per-node state lives in arrays.
+# With a LinkTable (links, see topology_file.py), the tree is an ArrayTree of its topology and link parameters (with mean_delay
+# and delay_type filling in unset ones), depth and fanout are ignored, and nodes are listed by their names.
+# With record set, the probes' end-to-end delays are recorded there as a delay trace (see probe_trace.py, and replay_delay_trace).
+# With tail_quantile, bins end where every node's delays reach that quantile, leaving the rest to a tail (1 - sum(alpha)), and the
+# histograms' memory is bounded too; with max_bins, bins are merged so there are at most max_bins of them (see estimate_tail).
+# With num_replicates, the estimator is also rerun on that many bootstrap resamples of the probes (see bootstrap.py), drawn from
+# their own Generator, for confidence intervals on every alpha; intervals is then a list of (node label, lower confidence
+# limits, upper confidence limits) like alphas (and None otherwise, or if no replicate passes the sanity checks).
+def run_delay_experiment(depth, mean_delay, delay_type, epsilon, num_probes, seed = 1, fanout = 2, array_tree = False, links = None, \
+                         record = None, tail_quantile = None, max_bins = None, num_replicates = None):
+  assert(depth > 1 or links != None)
   assert(mean_delay > 0)
-  delay_type = sys.argv[3]
   assert(delay_type in ["geometric", "pareto", "uniform"])
-  epsilon = float(sys.argv[4])
   assert(epsilon > 0)
-  num_probes = int(sys.argv[5])
   assert(num_probes > 100)
 
-# Create tree
-mcast_tree = Tree(depth, "delay", mean_delay, delay_type)
-
-# multicast estimator setup
-max_y = -1
-receivers = mcast_tree.receivers()
-DelayTomographyMle.create_Y_and_root(mcast_tree, num_probes)
-for i in range(0, num_probes):
-  outcome = mcast_tree.send_multicast_probe_with_delay()
-  assert(len(receivers) == len(outcome))
-  for j in range(0, len(receivers)):
-    receivers[j].Y[i] = outcome[j]
-    if (outcome[j] > max_y):
-      max_y = outcome[j]
-
-# run multicast estimator
-bin_width = 1
-i_max = math.ceil((max_y * 1.0) / bin_width)
-print("i_max is", i_max)
-DelayTomographyMle.create_estimator(mcast_tree, i_max = i_max, n = num_probes)
-DelayTomographyMle.main(mcast_tree, q = bin_width, i_max = i_max, n = num_probes, epsilon = epsilon)
-print("inferred probabilities for tree", mcast_tree)
-for node in mcast_tree.nodes():
-  print(node.id, node.alpha)
+  # seed random number generators
+  rng = numpy.random.default_rng(seed)
+  bootstrap_rng = numpy.random.default_rng([seed, 1])
+  if (array_tree or links != None):
+    return run_array_delay_experiment(depth, mean_delay, delay_type, epsilon, num_probes, fanout, rng, links, record, tail_quantile, \
+                                      max_bins, num_replicates, bootstrap_rng)
+
+  # Create tree
+  with phase("tree_construction"):
+    mcast_tree = Tree(depth, "delay", mean_delay, delay_type, rng, fanout)
+
+  # multicast estimator setup: probes are streamed in batches into per-node histograms of subtree minimum delays,
+  # so memory doesn't grow with num_probes
+  bin_width = 1
+  DelayTomographyMle.create_root(mcast_tree)
+  DelayTomographyMle.create_streaming_estimator(mcast_tree, bin_width, DelayHistogram.tail_quantile(tail_quantile, max_bins))
+  if (num_replicates != None):
+    DelayTomographyMle.create_bootstrap_estimator(mcast_tree, bin_width, num_probes, num_replicates, bootstrap_rng)
+  topology = mcast_tree.topology()
+  with trace_writer(record, "delay", topology, link_params = numpy.full(topology.num_nodes, float(mean_delay)), depth = depth, \
+                    fanout = fanout, delay_type = delay_type, num_probes = num_probes, seed = seed) as trace:
+    for start in range(0, num_probes, PROBE_BATCH_SIZE):
+      with phase("probes"):
+        outcomes = mcast_tree.send_multicast_probe_with_delay_batch(min(PROBE_BATCH_SIZE, num_probes - start))
+      if (trace != None):
+        trace.append(outcomes)
+      DelayTomographyMle.update_histogram(mcast_tree, outcomes)
+      if (num_replicates != None):
+        DelayTomographyMle.update_bootstrap(mcast_tree, outcomes)
+
+  # run multicast estimator
+  (i_max, (gamma, A, beta, alpha), intervals) = estimate_tail(mcast_tree, epsilon, tail_quantile, max_bins, num_replicates != None)
+  DelayTomographyMle.set_estimates(mcast_tree, gamma, A, beta, alpha)
+  labels = [node.id for node in mcast_tree.nodes()]
+  return (i_max, str(mcast_tree), list(zip(labels, [node.alpha for node in mcast_tree.nodes()])), label_intervals(labels, intervals))
+
+def run_array_delay_experiment(depth, mean_delay, delay_type, epsilon, num_probes, fanout, rng, links = None, record = None, \
+                               tail_quantile = None, max_bins = None, num_replicates = None, bootstrap_rng = None):
+  with phase("tree_construction"):
+    if (links == None):
+      mcast_tree = ArrayTree.complete(depth, "delay", mean_delay, delay_type, rng, fanout)
+    else:
+      mcast_tree = ArrayTree.from_links(links, "delay", mean_delay, delay_type, rng)
+
+  # stream probes into the estimator in batches sized to the tree
+  bin_width = 1
+  DelayTomographyMle.create_streaming_estimator(mcast_tree, bin_width, DelayHistogram.tail_quantile(tail_quantile, max_bins))
+  if (num_replicates != None):
+    DelayTomographyMle.create_bootstrap_estimator(mcast_tree, bin_width, num_probes, num_replicates, bootstrap_rng)
+  batch = mcast_tree.probes_per_batch()
+  with trace_writer(record, "delay", mcast_tree.topology(), ids = mcast_tree.ids, names = mcast_tree.names, \
+                    link_params = mcast_tree.delay_links.mean_delays, depth = depth, fanout = fanout, num_probes = num_probes) as trace:
+    for start in range(0, num_probes, batch):
+      with phase("probes"):
+        outcomes = mcast_tree.send_multicast_probe_with_delay_batch(min(batch, num_probes - start))
+      if (trace != None):
+        trace.append(outcomes)
+      DelayTomographyMle.update_histogram(mcast_tree, outcomes)
+      if (num_replicates != None):
+        DelayTomographyMle.update_bootstrap(mcast_tree, outcomes)
+
+  # run multicast estimator
+  (i_max, (gamma, A, beta, alpha), intervals) = estimate_tail(mcast_tree, epsilon, tail_quantile, max_bins, num_replicates != None)
+  labels = (mcast_tree.ids if (mcast_tree.names is None) else mcast_tree.names).tolist()
+  return (i_max, str(mcast_tree), list(zip(labels, alpha.tolist())), label_intervals(labels, intervals))
+
+# Run the streaming estimator on the bins tree.delay_histogram.binning picks for tail_quantile and max_bins (by default,
+# every bin up to the largest delay seen; with max_bins only, up to DEFAULT_TAIL_QUANTILE), so that its time and memory are
+# bounded by max_bins, not by the largest delay.
+# Bins are merged on a uniform grid, since the estimator adds up link delays by adding up bin numbers; delays beyond
+# i_max are left to a tail, whose mass on a link is 1 - sum of its alpha.
+# With bootstrap, the tree's bootstrap replicates (see DelayTomographyMle.create_bootstrap_estimator) are estimated on the same bins.
+# Returns i_max, compute_streaming_estimate's result, and the lower and upper confidence limits of alpha (None without bootstrap,
+# or if no replicate passes the sanity checks).
+def estimate_tail(tree, epsilon, tail_quantile = None, max_bins = None, bootstrap = False):
+  (i_max, factor) = tree.delay_histogram.binning(tail_quantile, max_bins)
+  print("i_max is", i_max)
+  if (factor > 1):
+    print("bin width is", factor * tree.delay_histogram.q)
+  estimate = DelayTomographyMle.compute_streaming_estimate(tree, i_max, epsilon, factor)
+  intervals = None
+  if (bootstrap):
+    alphas = DelayTomographyMle.compute_bootstrap_estimate(tree, i_max, epsilon, factor)
+    print("bootstrap replicates passing the sanity checks:", len(alphas), "of", tree.bootstrap_weights.num_replicates)
+    intervals = percentile_interval(alphas) if (len(alphas) > 0) else None
+  return (i_max, estimate, intervals)
+
+# estimate_tail's confidence limits as a list of (node label, lower limits, upper limits), or None
+def label_intervals(labels, intervals):
+  return None if (intervals == None) else list(zip(labels, intervals[0].tolist(), intervals[1].tolist()))
+
+# Rerun the delay estimator on a delay trace (see probe_trace.py), e.g., one recorded by run_delay_experiment or captured
+# elsewhere, with another epsilon, bin width or binning (see estimate_tail), streaming it from disk in chunks of chunk probes.
+# With num_replicates, bootstrap resamples of the trace (drawn from a Generator seeded with [seed, 1]) give confidence intervals.
+# Returns i_max, a list of (node label, inferred delay distribution alpha) in topology order and intervals, like run_delay_experiment.
+def replay_delay_trace(trace, epsilon, bin_width = 1, chunk = None, tail_quantile = None, max_bins = None, num_replicates = None, \
+                       seed = 0):
+  assert(trace.kind == "delay")
+  assert(epsilon > 0)
+  DelayTomographyMle.create_streaming_estimator(trace, bin_width, DelayHistogram.tail_quantile(tail_quantile, max_bins))
+  if (num_replicates != None):
+    DelayTomographyMle.create_bootstrap_estimator(trace, bin_width, trace.num_probes, num_replicates, numpy.random.default_rng([seed, 1]))
+  for outcomes in trace.chunks(chunk):
+    DelayTomographyMle.update_histogram(trace, outcomes)
+    if (num_replicates != None):
+      DelayTomographyMle.update_bootstrap(trace, outcomes)
+  (i_max, (gamma, A, beta, alpha), intervals) = estimate_tail(trace, epsilon, tail_quantile, max_bins, num_replicates != None)
+  labels = trace.labels().tolist()
+  return (i_max, list(zip(labels, alpha.tolist())), label_intervals(labels, intervals))
+
+# with show_tail, every node's line ends with its tail mass beyond i_max (1 - sum(alpha));
+# with intervals (see run_delay_experiment), every node's confidence limits follow
+def format_result(tree_description, alphas, show_tail = False, intervals = None):
+  lines = ["inferred probabilities for tree " + tree_description]
+  for (node_id, alpha) in alphas:
+    lines += [str(node_id) + " " + str(alpha) + ((" tail " + str(1 - sum(alpha))) if show_tail else "")]
+  if (intervals != None):
+    lines += ["bootstrap confidence intervals"]
+    for (node_id, lower, upper) in intervals:
+      lines += [str(node_id) + " lower conf. int " + str(lower), str(node_id) + " upper conf. int " + str(upper)]
+  return "\n".join(lines)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("depth", type = int)
+  parser.add_argument("mean_delay", type = float)
+  parser.add_argument("delay_type")
+  parser.add_argument("epsilon", type = float, help = "error tolerance of the estimator's sanity checks")
+  parser.add_argument("num_probes", type = int)
+  parser.add_argument("fanout", type = int, nargs = "?", default = 2, help = "number of children of every internal node")
+  parser.add_argument("--array-tree", action = "store_true", help = "keep per-node state in arrays, for very large trees")
+  parser.add_argument("--topology", help = "edge-list topology file (see topology_file.py) to simulate instead of a complete tree; " + \
+                                           "its unset link parameters default to mean_delay and delay_type, and depth and fanout are ignored")
+  parser.add_argument("--tail-quantile", type = float, help = "cut the estimator's bins at this quantile of the delays (see estimate_tail)")
+  parser.add_argument("--max-bins", type = int, help = "merge the histogram's bins so that the estimator gets at most this many " + \
+                                                       "(up to the 0.99 quantile without --tail-quantile)")
+  parser.add_argument("--bootstrap", type = int, metavar = "REPLICATES", help = "get confidence intervals from this many bootstrap " + \
+                                                                              "resamples of the probes (see bootstrap.py)")
+  parser.add_argument("--record", metavar = "TRACE", help = "record the multicast probes to the delay trace TRACE " + \
+                                                           "(see probe_trace.py, which also replays it)")
+  parser.add_argument("--instrument", metavar = "REPORT", help = "write the time spent in every phase to REPORT (JSON)")
+  parser.add_argument("--instrument-memory", action = "store_true", help = "also record the memory every phase allocates (slower)")
+  parser.add_argument("--profile", metavar = "STATS", help = "write cProfile stats to STATS")
+  args = parser.parse_args()
+
+  links = LinkTable.load(args.topology) if (args.topology != None) else None
+  with instrumentation.recording(args.instrument_memory, enabled = (args.instrument != None)) as recorder, \
+       instrumentation.profiling(args.profile):
+    (i_max, tree_description, alphas, intervals) = run_delay_experiment(args.depth, args.mean_delay, args.delay_type, args.epsilon, \
+                                                                        args.num_probes, fanout = args.fanout, \
+                                                                        array_tree = args.array_tree, links = links, \
+                                                                        record = args.record, tail_quantile = args.tail_quantile, \
+                                                                        max_bins = args.max_bins, num_replicates = args.bootstrap)
+  if (recorder != None):
+    instrumentation.write_report(args.instrument, recorder.report(), arguments = sys.argv[1:], i_max = i_max)
+  print(format_result(tree_description, alphas, show_tail = (args.tail_quantile != None or args.max_bins != None), \
+                      intervals = intervals))
@@ -0,0 +1,134 @@
+import contextlib
+import cProfile
+import functools
+import json
+import time
+import tracemalloc
+
+# Opt-in instrumentation of where a run spends its time and memory.
+# Code marks its phases with
+#   with instrumentation.phase("probes"): ...
+# or marks whole functions with the @instrumented("name") decorator. Phases nest, and a phase entered inside another one
+# is recorded under "outer/inner". Nothing is recorded unless a Recorder is active (see recording): then every phase
+# accumulates its number of calls and wall time and, if the recorder tracks memory, the memory it allocated (via tracemalloc,
+# which numpy arrays count towards). Without an active recorder a phase costs a global lookup and a function call.
+#
+# A recorder's report() is a JSON-friendly dict, and reports from other processes (e.g., trials run in a pool) can be
+# merged into a recorder. For a function-level view, profiling() runs a block under cProfile and dumps its stats.
+
+_recorder = None # the active Recorder, if any
+
+class Recorder(object):
+  def __init__(self, track_memory = False):
+    self.track_memory = track_memory
+    # phase path -> {"calls", "seconds"} plus, when tracking memory, "retained_bytes" (still allocated when the phase ended,
+    # summed over calls) and "peak_bytes" (the most allocated at once during any call), in the order phases were first entered
+    self.phases = dict()
+    self.open_phases = [] # stack of [path, start time, traced memory at start, peak traced memory so far]
+
+  def enter(self, name):
+    path = (self.open_phases[-1][0] + "/" + name) if (len(self.open_phases) > 0) else name
+    opened = [path, None, 0, 0]
+    if (self.track_memory):
+      # the peak is reset for the new phase, so pass the peak so far on to the phases that are already open
+      self.note_peak()
+      tracemalloc.reset_peak()
+      opened[2] = opened[3] = tracemalloc.get_traced_memory()[0]
+    self.open_phases += [opened]
+    opened[1] = time.perf_counter()
+
+  def exit(self):
+    end = time.perf_counter()
+    if (self.track_memory):
+      self.note_peak()
+    (path, start, start_memory, peak) = self.open_phases.pop()
+    stats = self.phases.setdefault(path, {"calls" : 0, "seconds" : 0.0})
+    stats["calls"] += 1
+    stats["seconds"] += end - start
+    if (self.track_memory):
+      stats["retained_bytes"] = stats.get("retained_bytes", 0) + tracemalloc.get_traced_memory()[0] - start_memory
+      stats["peak_bytes"] = max(stats.get("peak_bytes", 0), peak - start_memory)
+
+  def note_peak(self):
+    peak = tracemalloc.get_traced_memory()[1]
+    for opened in self.open_phases:
+      opened[3] = max(opened[3], peak)
+
+  # add the phases of another recorder's report, e.g., from a trial run in another process
+  def merge(self, report):
+    for (path, other) in report["phases"].items():
+      stats = self.phases.setdefault(path, {"calls" : 0, "seconds" : 0.0})
+      for (field, value) in other.items():
+        stats[field] = max(stats.get(field, 0), value) if (field == "peak_bytes") else (stats.get(field, 0) + value)
+
+  def report(self):
+    return {"track_memory" : self.track_memory, "phases" : {path : dict(stats) for (path, stats) in self.phases.items()}}
+
+class Phase(object):
+  def __init__(self, recorder, name):
+    self.recorder = recorder
+    self.name = name
+
+  def __enter__(self):
+    self.recorder.enter(self.name)
+
+  def __exit__(self, exception_type, exception, trace):
+    self.recorder.exit()
+
+NO_PHASE = contextlib.nullcontext()
+
+# context manager for a phase called name (doing nothing unless a recorder is active)
+def phase(name):
+  return Phase(_recorder, name) if (_recorder != None) else NO_PHASE
+
+# decorator that runs every call of a function as a phase called name
+def instrumented(name):
+  def decorate(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if (_recorder == None):
+        return function(*args, **kwargs)
+      with Phase(_recorder, name):
+        return function(*args, **kwargs)
+    return wrapper
+  return decorate
+
+# Record phases while the block runs, yielding the Recorder (or, if not enabled, yield None and record nothing).
+# tracemalloc is started for the block if track_memory is set and it isn't already running.
+@contextlib.contextmanager
+def recording(track_memory = False, enabled = True):
+  global _recorder
+  if (not enabled):
+    yield None
+    return
+  (previous, recorder) = (_recorder, Recorder(track_memory))
+  start_tracing = track_memory and not tracemalloc.is_tracing()
+  if (start_tracing):
+    tracemalloc.start()
+  _recorder = recorder
+  try:
+    yield recorder
+  finally:
+    _recorder = previous
+    if (start_tracing):
+      tracemalloc.stop()
+
+# Run the block under cProfile and dump its stats to path (for pstats or snakeviz); does nothing if path is None.
+# Only the calling process is profiled.
+@contextlib.contextmanager
+def profiling(path):
+  if (path == None):
+    yield
+    return
+  profiler = cProfile.Profile()
+  profiler.enable()
+  try:
+    yield
+  finally:
+    profiler.disable()
+    profiler.dump_stats(path)
+
+# write a report (plus any other fields, e.g., the run's parameters and results) as JSON
+def write_report(path, report, **fields):
+  with open(path, "w") as report_file:
+    json.dump(dict(fields, **report), report_file, indent = 1)
@@ -3,15 +3,26 @@ import numpy
 LOW_ESCAPE_PROBABILITY = 0.001 # Low probability of escaping a state in the Gilbert-Elliot model
 
 class LossDistribution:
-  def __init__(self, t_loss_prob, t_loss_type):
+  # rng is the numpy.random.Generator to draw from (a fresh, unseeded one if None)
+  def __init__(self, t_loss_prob, t_loss_type, rng = None):
     assert(t_loss_type in ["bernoulli", "gilbert_elliot"])
     assert(t_loss_prob > 0)
     assert(t_loss_prob < 1)
+    self.rng = rng if (rng != None) else numpy.random.default_rng()
     self.incoming_loss_prob = t_loss_prob
     self.loss_type = t_loss_type
     if (t_loss_type == "gilbert_elliot"):
       # steady-state probability of being in "bad" is the same as self.incoming_loss_prob
-      self.link_state = "bad" if (numpy.random.random() < self.incoming_loss_prob) else "good"
+      self.link_state = "bad" if (self.rng.random() < self.incoming_loss_prob) else "good"
+      self.set_loss_prob(t_loss_prob)
+
+  # Change the loss probability of the link, e.g., halfway through a run, to model time-varying links.
+  # For Gilbert-Elliot, the chain keeps its current state and only the escape probabilities change.
+  def set_loss_prob(self, t_loss_prob):
+    assert(t_loss_prob > 0)
+    assert(t_loss_prob < 1)
+    self.incoming_loss_prob = t_loss_prob
+    if (self.loss_type == "gilbert_elliot"):
       self.prob_escape_good = LOW_ESCAPE_PROBABILITY
       self.prob_escape_bad = (self.prob_escape_good / self.incoming_loss_prob) - self.prob_escape_good
       assert((self.prob_escape_bad > 0) and (self.prob_escape_bad < 1))
@@ -21,16 +32,124 @@ class LossDistribution:
   def state_transition(self):
     if (self.loss_type == "gilbert_elliot"):
       if (self.link_state == "good"):
-        self.link_state = "bad" if (numpy.random.random() < self.prob_escape_good) else "good"
+        self.link_state = "bad" if (self.rng.random() < self.prob_escape_good) else "good"
       else:
         assert(self.link_state == "bad")
-        self.link_state = "good" if (numpy.random.random() < self.prob_escape_bad) else "bad"
+        self.link_state = "good" if (self.rng.random() < self.prob_escape_bad) else "bad"
 
   # deliver probe?
   def deliver_probe(self):
     if (self.loss_type == "bernoulli"):
-      delivered = not (numpy.random.random() < self.incoming_loss_prob)
+      delivered = not (self.rng.random() < self.incoming_loss_prob)
     else:
       assert(self.loss_type == "gilbert_elliot")
       delivered = (self.link_state == "good")
     return delivered
+
+  # deliver a batch of num_probes probes, one per tick.
+  # For Gilbert-Elliot, the chain is advanced once before every probe,
+  # exactly like calling state_transition() followed by deliver_probe() per probe.
+  # Returns a boolean numpy array with one entry per probe.
+  def deliver_probes(self, num_probes):
+    return LossDistribution.deliver_probes_on_links([self], num_probes, self.rng)[:, 0]
+
+  # Batch version of deliver_probes for many links at once, drawing from the Generator rng.
+  # Returns a (num_probes x len(loss_dists)) boolean matrix of delivery outcomes.
+  @staticmethod
+  def deliver_probes_on_links(loss_dists, num_probes, rng):
+    links = LossLinks([loss_dist.incoming_loss_prob for loss_dist in loss_dists], \
+                      [loss_dist.loss_type == "gilbert_elliot" for loss_dist in loss_dists], \
+                      [getattr(loss_dist, "link_state", "good") == "bad" for loss_dist in loss_dists])
+    delivered = links.deliver_probes(num_probes, rng)
+    # leave every link_state at its state after the last probe so per-tick and batch use can be mixed
+    for (loss_dist, bad) in zip(loss_dists, links.bad.tolist()):
+      if (loss_dist.loss_type == "gilbert_elliot"):
+        loss_dist.link_state = "bad" if bad else "good"
+    return delivered
+
+LOSS_TYPES = ["bernoulli", "gilbert_elliot"]
+
+# Array counterpart of LossDistribution: the parameters and Gilbert-Elliot states of many links in contiguous arrays
+# indexed by link, so that large trees don't need one LossDistribution object per link.
+# loss_probs holds every link's loss probability, gilbert_elliot is True for Gilbert-Elliot links (False for Bernoulli),
+# and bad holds the current Gilbert-Elliot states (True for "bad", ignored for Bernoulli links).
+class LossLinks(object):
+  def __init__(self, loss_probs, gilbert_elliot, bad):
+    self.gilbert_elliot = numpy.array(gilbert_elliot, dtype = bool)
+    self.bad = numpy.array(bad, dtype = bool) & self.gilbert_elliot
+    assert(self.bad.shape == self.gilbert_elliot.shape)
+    self.set_loss_probs(loss_probs)
+
+  # links of the given loss probabilities and types ("bernoulli" or "gilbert_elliot", one per link or one for all),
+  # with every Gilbert-Elliot chain started in its steady state
+  @staticmethod
+  def create(num_links, loss_probs, loss_types, rng):
+    loss_probs = numpy.broadcast_to(numpy.asarray(loss_probs, dtype = float), (num_links,))
+    loss_types = numpy.broadcast_to(numpy.asarray(loss_types), (num_links,))
+    assert(numpy.all(numpy.isin(loss_types, LOSS_TYPES)))
+    gilbert_elliot = (loss_types == "gilbert_elliot")
+    # steady-state probability of being in "bad" is the same as the loss probability
+    bad = gilbert_elliot & (rng.random(num_links) < loss_probs)
+    return LossLinks(loss_probs, gilbert_elliot, bad)
+
+  def __len__(self):
+    return len(self.gilbert_elliot)
+
+  # Change the loss probabilities of all links (a scalar or one per link), like LossDistribution.set_loss_prob
+  def set_loss_probs(self, loss_probs):
+    self.loss_probs = numpy.array(numpy.broadcast_to(numpy.asarray(loss_probs, dtype = float), self.gilbert_elliot.shape))
+    assert(numpy.all(self.loss_probs > 0))
+    assert(numpy.all(self.loss_probs < 1))
+    self.prob_escape_good = numpy.full(len(self), LOW_ESCAPE_PROBABILITY)
+    self.prob_escape_bad = (self.prob_escape_good / self.loss_probs) - self.prob_escape_good
+    ge_escape_bad = self.prob_escape_bad[self.gilbert_elliot]
+    assert(numpy.all((ge_escape_bad > 0) & (ge_escape_bad < 1)))
+
+  # Deliver num_probes probes on every link, one per tick, drawing from the Generator rng.
+  # Gilbert-Elliot chains are advanced once before every probe and left in their state after the last one.
+  # Returns a (num_probes x len(self)) boolean matrix of delivery outcomes.
+  def deliver_probes(self, num_probes, rng):
+    delivered = numpy.empty((num_probes, len(self)), dtype = bool)
+    bernoulli = numpy.flatnonzero(~self.gilbert_elliot)
+    gilbert_elliot = numpy.flatnonzero(self.gilbert_elliot)
+    if (len(bernoulli) > 0):
+      delivered[:, bernoulli] = rng.random((num_probes, len(bernoulli))) >= self.loss_probs[bernoulli]
+    if (len(gilbert_elliot) > 0):
+      bad = LossLinks.state_trajectories(self.bad[gilbert_elliot], self.prob_escape_good[gilbert_elliot], \
+                                         self.prob_escape_bad[gilbert_elliot], num_probes, rng)
+      delivered[:, gilbert_elliot] = ~bad
+      if (num_probes > 0):
+        self.bad[gilbert_elliot] = bad[-1]
+    return delivered
+
+  # Generate the Gilbert-Elliot link states for the next num_steps ticks of many links at once,
+  # given their current states (start_bad) and escape probabilities.
+  # Rather than flipping a coin on every tick, sample the geometric number of ticks the chain sojourns in each state
+  # (about 1/LOW_ESCAPE_PROBABILITY ticks in "good") and expand those runs into a boolean array.
+  # Returns a (num_steps x len(start_bad)) boolean matrix that is True where the link is "bad".
+  @staticmethod
+  def state_trajectories(start_bad, prob_escape_good, prob_escape_bad, num_steps, rng):
+    num_links = len(start_bad)
+
+    # The chain leaves its current state at tick G ~ Geometric(escape probability),
+    # so the state flips at ticks G0, G0 + G1, G0 + G1 + G2, ..., alternating between the two escape probabilities.
+    # Sample sojourns in blocks (sized from the mean cycle length) until every link's flips cover num_steps ticks.
+    mean_cycle = numpy.min(1.0 / prob_escape_good + 1.0 / prob_escape_bad, initial = numpy.inf)
+    block = 2 * (int(1.5 * num_steps / mean_cycle) // 2) + 16 # even, so that blocks keep the alternation
+    flip_ticks = numpy.zeros((num_links, 0), dtype = numpy.int64)
+    covered = numpy.zeros(num_links, dtype = numpy.int64)
+    while (num_links > 0 and numpy.min(covered) < num_steps):
+      first = numpy.where(start_bad, prob_escape_bad, prob_escape_good)[:, None]
+      second = numpy.where(start_bad, prob_escape_good, prob_escape_bad)[:, None]
+      escape_probs = numpy.where(numpy.arange(block) % 2 == 0, first, second)
+      sojourns = rng.geometric(escape_probs)
+      flip_ticks = numpy.hstack((flip_ticks, covered[:, None] + numpy.cumsum(sojourns, axis = 1)))
+      covered = flip_ticks[:, -1]
+
+    # Mark every flip that happens within num_steps ticks, then a running xor expands the runs
+    toggles = numpy.zeros((num_steps, num_links), dtype = bool)
+    (links, runs) = numpy.nonzero(flip_ticks <= num_steps)
+    toggles[flip_ticks[links, runs] - 1, links] = True
+    if (num_steps == 0):
+      return toggles
+    return numpy.logical_xor.accumulate(toggles, axis = 0) ^ start_bad
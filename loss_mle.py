@@ -1,3 +1,11 @@
+from bit_trace import BitTrace
+from probe_counter import ProbeCounter
+from bootstrap import BootstrapWeights
+import minc_solver
+from instrumentation import instrumented
+import numpy
+from array_tree import BATCH_ENTRIES
+
 # max likelihood estimator from https://ieeexplore.ieee.org/document/796384/
 # "Multicast-based inference of network-internal loss characteristics"
 class LossTomographyMle(object):
@@ -5,79 +13,179 @@ class LossTomographyMle(object):
   def create_estimator(tree):
     # create the Y, gamma, and A for each node
     # we use capital Y and A for consistency with equation 24 of the paper
+    # Y is a bit-packed trace of per-probe outcomes (see bit_trace.py)
     all_nodes = tree.nodes()
     for node in all_nodes:
-      node.Y = []
+      node.Y = BitTrace()
       node.gamma = 0.0
       node.A = 0.0
 
   @staticmethod
+  @instrumented("update_Y")
   def update_Y(tree, probe):
     # update the receiver Ys alone to probe
     for receiver in tree.receivers():
-      receiver.Y += [probe[receiver.id]]
+      receiver.Y.append(probe[receiver.id])
+
+  @staticmethod
+  @instrumented("update_Y")
+  def update_Y_batch(tree, outcomes):
+    # update the receiver Ys with a (num_probes x num_receivers) outcome matrix,
+    # as returned by Tree.send_multicast_probe_batch (columns follow tree.receivers())
+    receivers = tree.receivers()
+    assert(outcomes.shape[1] == len(receivers))
+    for j in range(0, len(receivers)):
+      receivers[j].Y.extend(outcomes[:, j])
 
   @staticmethod
+  @instrumented("compute_gamma")
   def compute_gamma(tree):
-    # Leaf node, update gamma incrementally using latest Y
-    if (tree.left == None and tree.right == None):
-      assert(len(tree.Y) > 0)
-      tree.gamma = sum(tree.Y)/len(tree.Y)
-      return tree.Y
-    else: 
-      # process left and right branches of tree
-      Y_left  = LossTomographyMle.compute_gamma(tree.left)
-      Y_right = LossTomographyMle.compute_gamma(tree.right)
-
-      # logic or the left and right together
-      assert(len(Y_left) == len(Y_right))
-      for i in range(0, len(Y_left)):
-        tree.Y += [Y_left[i] or Y_right[i]]
-
-      # compute gamma for resulting tree
-      tree.gamma = sum(tree.Y)/len(tree.Y)
-      return tree.Y
+    # Walk the nodes in reverse preorder so that children are processed before their parents
+    all_nodes = tree.nodes()
+    for node in reversed(all_nodes):
+      # Leaf node, update gamma incrementally using latest Y
+      if (node.children() == []):
+        assert(len(node.Y) > 0)
+      else:
+        # logic or the children together, a word at a time
+        node.Y = BitTrace.union([child.Y for child in node.children()])
+
+      # compute gamma for resulting tree by counting the 1s
+      node.gamma = node.Y.count()/len(node.Y)
+    return tree.Y
+
+  # Streaming mode: gamma only needs, for every node k, the number of probes that reached at least one receiver under k.
+  # Those counters can be maintained as probes arrive, so the estimator uses O(nodes) memory however many probes it sees,
+  # and the current estimates can be computed at any point with compute_streaming_gamma followed by compute_mle.
+  # With window or decay set, the counters only cover the last window probes or decay exponentially
+  # (see probe_counter.py), so the estimates track links whose loss rates change over time.
+  @staticmethod
+  def create_streaming_estimator(tree, window = None, decay = None):
+    tree.reached_counter = ProbeCounter(tree.topology().num_nodes, window, decay) # indexed by topology index
+
+  @staticmethod
+  @instrumented("update_counts")
+  def update_counts(tree, outcomes):
+    # fold a (num_probes x num_receivers) outcome matrix (or a single probe's row) into the counters
+    outcomes = numpy.atleast_2d(numpy.asarray(outcomes, dtype = bool))
+    tree.reached_counter.add(tree.topology().reduce_up(outcomes, numpy.logical_or))
+
+  @staticmethod
+  @instrumented("compute_gamma")
+  def compute_streaming_gamma(tree):
+    # the streaming counterpart of compute_gamma
+    all_nodes = tree.nodes()
+    gammas = tree.reached_counter.rates()
+    for k in range(0, len(all_nodes)):
+      all_nodes[k].gamma = gammas[k]
+
+  # Bootstrap mode (see bootstrap.py): alongside the streaming counters, num_replicates resamples of the num_probes probes
+  # the tree will see are counted as probes arrive, as one (num_replicates x num_nodes) matrix of resampled counts,
+  # and compute_bootstrap_mle then estimates all replicates at once.
+  @staticmethod
+  def create_bootstrap_estimator(tree, num_probes, num_replicates, rng):
+    tree.bootstrap_weights = BootstrapWeights(num_probes, num_replicates, rng)
+    tree.bootstrap_reached = numpy.zeros((num_replicates, tree.topology().num_nodes))
+
+  @staticmethod
+  @instrumented("update_bootstrap")
+  def update_bootstrap(tree, outcomes):
+    # fold a (num_probes x num_receivers) outcome matrix into every replicate's counters with a matrix product per chunk,
+    # with chunks sized so that the resampling counts stay within BATCH_ENTRIES (replicate, probe) entries
+    outcomes = numpy.atleast_2d(numpy.asarray(outcomes, dtype = bool))
+    reached = tree.topology().reduce_up(outcomes, numpy.logical_or)
+    chunk = max(1, BATCH_ENTRIES // tree.bootstrap_weights.num_replicates)
+    for start in range(0, reached.shape[0], chunk):
+      rows = reached[start : start + chunk]
+      tree.bootstrap_reached += tree.bootstrap_weights.next(rows.shape[0]) @ rows.astype(float)
+
+  # compute_mle_arrays on every replicate at once, once the tree has seen all its probes.
+  # Returns the (num_replicates x num_nodes) matrix of alpha of the replicates that pass both sanity checks
+  # (without reporting the ones that don't).
+  @staticmethod
+  @instrumented("bootstrap_mle")
+  def compute_bootstrap_mle(tree, total_A):
+    topology = tree.topology()
+    gammas = tree.bootstrap_weights.rates(tree.bootstrap_reached)
+    gammas = gammas[~numpy.any(LossTomographyMle.gamma_failures(topology, gammas)[0], axis = 1)]
+    A = minc_solver.solve_minc_on_topology(topology, gammas)
+    parent_A = numpy.where(topology.parent >= 0, A[:, numpy.maximum(topology.parent, 0)], total_A)
+    alphas = A * 1.0 / parent_A
+    return alphas[~numpy.any(LossTomographyMle.alpha_failures(alphas), axis = 1)]
 
   @staticmethod
   def compute_mle(tree, total_A):
-    # For a binary tree, solvefor in Figure 7 has a closed form solution, which is plugged in below (ab/(a+b-c))
-    # In general, we need to solve it numerically.
-    if (tree.left == None and tree.right == None):
-      tree.A = tree.gamma # Treat this as though the product is 0 per the paper
-    else:
-      assert (tree.left.gamma + tree.right.gamma - tree.gamma != 0)
-      assert (abs(tree.left.gamma + tree.right.gamma - tree.gamma) >= 1e-10)
-      # closed form solution for binary trees
-      tree.A = (tree.left.gamma * tree.right.gamma * 1.0) / (tree.left.gamma + tree.right.gamma - tree.gamma)
-    tree.alpha = tree.A * 1.0 / total_A
-    if (tree.left != None and tree.right != None):
-      LossTomographyMle.compute_mle(tree.left,  tree.A)
-      LossTomographyMle.compute_mle(tree.right, tree.A)
+    all_nodes = tree.nodes()
+    gamma = numpy.array([node.gamma for node in all_nodes])
+    (A, alpha) = LossTomographyMle.compute_mle_arrays(tree.topology(), gamma, total_A)
+    for (node, node_A, node_alpha) in zip(all_nodes, A.tolist(), alpha.tolist()):
+      node.A = node_A
+      node.alpha = node_alpha
 
   @staticmethod
   # Check conditions i and iv from 5.1 of http://nickduffield.net/download/papers/minctoit.pdf
   def pre_sanity_check(root):
-    for node in root.nodes():
-      if node.gamma == 0: # condition i
-        print("Condition i: node.gamma is", node.gamma)
-        return False
-      elif ((node.left != None) and (node.right != None)): # condition iv
-        if (node.left.gamma + node.right.gamma - node.gamma == 0):
-          print("Condition iv: node.left.gamma, node.right.gamma, node.gamma", node.left.gamma, node.right.gamma, node.gamma)
-          return False
-        elif (abs(node.left.gamma + node.right.gamma - node.gamma) < 1e-10):
-          print("Condition iv' (floating point error): node.left.gamma, node.right.gamma, node.gamma", node.left.gamma, node.right.gamma, node.gamma)
-          return False
-    return True
+    return LossTomographyMle.check_gamma(root.topology(), numpy.array([node.gamma for node in root.nodes()]))
 
   @staticmethod
   # Check conditions ii and iii from 5.1 of http://nickduffield.net/download/papers/minctoit.pdf
   def post_sanity_check(root):
-    for node in root.nodes():
-      if node != root:
-        if (node.alpha <= 0) or (node.alpha >= 1): # condition ii/iii
-          print("Condition ii/iii: node.alpha is", node.alpha)
-          return False
-    return True
+    return LossTomographyMle.check_alpha(numpy.array([node.alpha for node in root.nodes()]))
+
+  # The estimator on per-node arrays indexed by topology index, for trees whose per-node state lives in arrays
+  # (see array_tree.py). The streaming counters give gamma directly: tree.reached_counter.rates().
+  # Returns the arrays A and alpha.
+  @staticmethod
+  @instrumented("compute_mle")
+  def compute_mle_arrays(topology, gamma, total_A):
+    # solvefor in Figure 7 is solved for all nodes at once (see minc_solver.py): binary nodes use its
+    # closed form solution (ab/(a+b-c)), and wider nodes a vectorized bisection.
+    internal = numpy.flatnonzero(~topology.is_leaf)
+    child_sums = numpy.add.reduceat(gamma[topology.child_index], topology.child_start[internal])
+    assert (numpy.all(numpy.abs(child_sums - gamma[internal]) >= 1e-10))
+    A = minc_solver.solve_minc_on_topology(topology, gamma)
+    parent_A = numpy.where(topology.parent >= 0, A[numpy.maximum(topology.parent, 0)], total_A)
+    return (A, A * 1.0 / parent_A)
 
+  # Conditions i and iv of pre_sanity_check for every node, on gammas indexed by topology index along their last axis.
+  # Returns the failures and every node's excess (the sum of its children's gammas minus its own; 0 for leaves).
+  @staticmethod
+  def gamma_failures(topology, gamma):
+    internal = numpy.flatnonzero(~topology.is_leaf)
+    excess = numpy.zeros(gamma.shape)
+    excess[..., internal] = numpy.add.reduceat(gamma[..., topology.child_index], topology.child_start[internal], axis = -1) - \
+                            gamma[..., internal]
+    failed = (gamma == 0) | (~topology.is_leaf & (numpy.abs(excess) < 1e-10)) | (excess < 0)
+    return (failed, excess)
+
+  # pre_sanity_check on an array of gammas in topology order, reporting the first node (in preorder) that fails
+  @staticmethod
+  @instrumented("sanity_check")
+  def check_gamma(topology, gamma):
+    (failed, excess) = LossTomographyMle.gamma_failures(topology, gamma)
+    if (not numpy.any(failed)):
+      return True
+    k = numpy.argmax(failed)
+    child_gammas = gamma[topology.children(k)].tolist()
+    if (gamma[k] == 0): # condition i
+      print("Condition i: node.gamma is", gamma[k])
+    elif (excess[k] <= 0): # condition iv
+      print("Condition iv: child gammas, node.gamma", *child_gammas, gamma[k])
+    else:
+      print("Condition iv' (floating point error): child gammas, node.gamma", *child_gammas, gamma[k])
+    return False
 
+  # conditions ii and iii of post_sanity_check for every non-root node, on alphas indexed by topology index along their last axis
+  @staticmethod
+  def alpha_failures(alpha):
+    return (alpha[..., 1:] <= 0) | (alpha[..., 1:] >= 1)
+
+  # post_sanity_check on an array of alphas in topology order (the root, index 0, isn't checked)
+  @staticmethod
+  @instrumented("sanity_check")
+  def check_alpha(alpha):
+    failed = LossTomographyMle.alpha_failures(alpha) # condition ii/iii
+    if (numpy.any(failed)):
+      print("Condition ii/iii: node.alpha is", alpha[1 + numpy.argmax(failed)])
+      return False
+    return True
@@ -0,0 +1,106 @@
+import math
+import numpy
+from topology import Topology
+
+# Solvers for the per-node equations of the multicast (MINC) estimators on trees of arbitrary fanout.
+# Every function solves the equations of many nodes at once. Per-child quantities are flat arrays
+# grouped by node, so that the children of the m-th node are entries starts[m] : starts[m + 1]
+# (the layout of Topology's CSR child index), and products over children are a single multiply.reduceat.
+
+MAX_BISECTION_STEPS = 200 # far more than the ~60 halvings it takes for a bracket to hit floating point resolution
+
+# product of values over every group of children
+def group_product(values, starts):
+  return numpy.multiply.reduceat(values, starts[:-1])
+
+# Bisection on every element at once: given f(lo) > 0 >= f(hi) elementwise, shrink the brackets
+# until they can't be split any further and return their midpoints.
+def bisect(f, lo, hi):
+  lo = numpy.array(lo, dtype = float)
+  hi = numpy.array(hi, dtype = float)
+  for step in range(0, MAX_BISECTION_STEPS):
+    mid = (lo + hi) / 2
+    open_brackets = (mid > lo) & (mid < hi)
+    if (not numpy.any(open_brackets)):
+      break
+    positive = (f(mid) > 0) & open_brackets
+    lo = numpy.where(positive, mid, lo)
+    hi = numpy.where(positive | ~open_brackets, hi, mid)
+  return (lo + hi) / 2
+
+# Solve 1 - gamma_k/A = prod_j (1 - gamma_j/A) for A at every internal node k, where j ranges over k's children
+# (equation 24 of the loss paper, and the i = 0 step of the delay estimator).
+# Binary nodes use the closed form gamma_l gamma_r / (gamma_l + gamma_r - gamma_k). For wider nodes the equation
+# is solved for x = 1/A: f(x) = 1 - gamma_k x - prod_j (1 - gamma_j x) is 0 at x = 0, positive just above 0
+# whenever sum_j gamma_j > gamma_k, and <= 0 at x = 1/max_j gamma_j (as gamma_k >= gamma_j),
+# which brackets the non-trivial root.
+def solve_minc(gamma, child_gamma, starts):
+  gamma = numpy.asarray(gamma, dtype = float)
+  child_gamma = numpy.asarray(child_gamma, dtype = float)
+  fanout = numpy.diff(starts)
+  assert(numpy.all(fanout >= 2))
+  child_sum = numpy.add.reduceat(child_gamma, starts[:-1])
+  A = numpy.empty(len(gamma))
+
+  binary = (fanout == 2)
+  if (numpy.any(binary)):
+    left = child_gamma[starts[:-1][binary]]
+    right = child_gamma[starts[:-1][binary] + 1]
+    assert(numpy.all(left + right - gamma[binary] != 0))
+    A[binary] = (left * right * 1.0) / (left + right - gamma[binary])
+
+  wide = numpy.flatnonzero(~binary)
+  if (len(wide) > 0):
+    assert(numpy.all(child_sum[wide] > gamma[wide]))
+    wide_starts = numpy.concatenate(([0], numpy.cumsum(fanout[wide])))
+    wide_child_gamma = child_gamma[Topology.ranges(starts[wide], starts[wide + 1])]
+    child_max = numpy.maximum.reduceat(wide_child_gamma, wide_starts[:-1])
+    f = lambda x: 1 - gamma[wide] * x - group_product(1 - wide_child_gamma * numpy.repeat(x, fanout[wide]), wide_starts)
+    A[wide] = 1.0 / bisect(f, numpy.zeros(len(wide)), 1.0 / child_max)
+  return A
+
+# solve_minc for every node of a topology, given gamma indexed by topology index along its last axis
+# (e.g., a matrix of bootstrap replicates, one per row, all solved at once).
+# Leaves have A = gamma (the product over no children is taken to be 0, per the paper).
+def solve_minc_on_topology(topology, gamma):
+  gamma = numpy.asarray(gamma, dtype = float)
+  A = gamma.copy()
+  internal = numpy.flatnonzero(~topology.is_leaf)
+  if (len(internal) > 0):
+    rows = gamma.reshape(-1, topology.num_nodes)
+    num_children = len(topology.child_index)
+    # the children of internal nodes, in increasing node order, are exactly the CSR child index,
+    # and every row's children follow the previous row's
+    starts = (topology.child_start[internal] + (num_children * numpy.arange(0, rows.shape[0]))[:, numpy.newaxis]).ravel()
+    starts = numpy.append(starts, num_children * rows.shape[0])
+    solved = solve_minc(rows[:, internal].ravel(), rows[:, topology.child_index].ravel(), starts)
+    A.reshape(-1, topology.num_nodes)[:, internal] = solved.reshape(rows.shape[0], len(internal))
+  return A
+
+# Coefficients (highest power first) of prod_j (u[m, j] + v[m, j] x) for every row m of u and v
+def product_polynomial(u, v):
+  (num_rows, degree) = u.shape
+  coefficients = numpy.ones((num_rows, 1))
+  for j in range(0, degree):
+    shifted = numpy.zeros((num_rows, coefficients.shape[1] + 1))
+    shifted[:, :-1] += coefficients * v[:, j:j + 1]
+    shifted[:, 1:] += coefficients * u[:, j:j + 1]
+    coefficients = shifted
+  return coefficients
+
+# Second largest real root of every row of a (num_rows x (degree + 1)) coefficient matrix (highest power first),
+# from the eigenvalues of all companion matrices at once. For a quadratic with a positive leading coefficient
+# this is the smaller root, i.e., the one the delay estimator picks in the binary case.
+# Rows with fewer than two real roots (e.g., from noisy gammas) get NaN, for the delay estimator's sanity checks to report.
+def second_largest_real_roots(coefficients, tolerance = 1e-9):
+  coefficients = numpy.atleast_2d(numpy.asarray(coefficients, dtype = float))
+  (num_rows, degree) = (coefficients.shape[0], coefficients.shape[1] - 1)
+  assert(degree >= 2)
+  assert(numpy.all(coefficients[:, 0] != 0))
+  companion = numpy.zeros((num_rows, degree, degree))
+  companion[:, 0, :] = -coefficients[:, 1:] / coefficients[:, :1]
+  companion[:, numpy.arange(1, degree), numpy.arange(0, degree - 1)] = 1
+  roots = numpy.linalg.eigvals(companion)
+  real = numpy.abs(roots.imag) <= tolerance * (1 + numpy.abs(roots.real))
+  real_roots = numpy.sort(numpy.where(real, roots.real, -numpy.inf), axis = 1)
+  return numpy.where(numpy.count_nonzero(real, axis = 1) >= 2, real_roots[:, -2], math.nan)
@@ -0,0 +1,61 @@
+import numpy
+
+# Per-column counts of per-probe 0/1 indicators (e.g., "probe reached some receiver under node k", "probe lost on link k").
+# Three modes:
+#  - cumulative (default): counts over every probe seen so far.
+#  - sliding window (window = W): counts over the last W probes only, kept in a W-row ring buffer.
+#  - exponentially decayed (decay = d): every probe's weight shrinks by a factor (1 - d) per newer probe.
+# In every mode, counts / total is the current rate per column, and adding a probe costs O(columns)
+# regardless of how many probes came before, so estimates can track time-varying links with a bounded working set.
+class ProbeCounter(object):
+  def __init__(self, num_columns, window = None, decay = None):
+    assert(window == None or decay == None)
+    self.window = window
+    self.decay = decay
+    if (window != None):
+      assert(window >= 1)
+      self.ring = numpy.zeros((window, num_columns), dtype = bool)
+      self.ring_pos = 0 # next row of the ring to overwrite
+      self.counts = numpy.zeros(num_columns, dtype = numpy.int64)
+      self.total = 0
+    elif (decay != None):
+      assert(decay > 0 and decay < 1)
+      self.counts = numpy.zeros(num_columns)
+      self.total = 0.0 # total weight, so that early estimates aren't biased towards 0
+    else:
+      self.counts = numpy.zeros(num_columns, dtype = numpy.int64)
+      self.total = 0
+
+  # add a (num_probes x num_columns) matrix of indicators, oldest probe first
+  def add(self, rows):
+    rows = numpy.atleast_2d(numpy.asarray(rows, dtype = bool))
+    num_probes = rows.shape[0]
+    if (self.window != None):
+      if (num_probes >= self.window):
+        # only the newest window probes survive
+        self.ring[:] = rows[num_probes - self.window:]
+        self.ring_pos = 0
+        self.counts = numpy.count_nonzero(self.ring, axis = 0).astype(numpy.int64)
+        self.total = self.window
+      else:
+        slots = (self.ring_pos + numpy.arange(num_probes)) % self.window
+        # slots already holding a probe are evicted
+        num_evicted = max(0, self.total + num_probes - self.window)
+        self.counts -= numpy.count_nonzero(self.ring[slots[num_probes - num_evicted:]], axis = 0)
+        self.ring[slots] = rows
+        self.counts += numpy.count_nonzero(rows, axis = 0)
+        self.ring_pos = (self.ring_pos + num_probes) % self.window
+        self.total = min(self.window, self.total + num_probes)
+    elif (self.decay != None):
+      # a probe that is r probes older than the newest one has weight (1 - decay)^r
+      weights = self.decay * (1 - self.decay) ** numpy.arange(num_probes - 1, -1, -1)
+      shrink = (1 - self.decay) ** num_probes
+      self.counts = shrink * self.counts + weights @ rows
+      self.total = shrink * self.total + numpy.sum(weights)
+    else:
+      self.counts += numpy.count_nonzero(rows, axis = 0)
+      self.total += num_probes
+
+  def rates(self):
+    assert(self.total > 0)
+    return self.counts / self.total
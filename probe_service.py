@@ -0,0 +1,440 @@
+#! /usr/local/bin/python3
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import time
+import numpy
+from tree import Tree
+from topology import Topology
+from topology_file import LinkTable
+from loss_mle import LossTomographyMle
+from delay_mle import DelayTomographyMle
+
+# A long-running service that estimates link loss rates or delay distributions from live probe reports,
+# and a simulator client that sends it the reports of probes on a Tree.
+#
+# Receivers report on a datagram socket (UDP, or a Unix datagram socket), with any number of reports per datagram, each a
+# REPORT_DTYPE record: the probe's sequence number, the receiver's node id (as Tree and ArrayTree number nodes, i.e.,
+# postorder rank + 1) and a value: 1 (delivered) or 0 (lost) for loss, or the probe's one-way delay for delay.
+# Reports of a probe can arrive in any order and interleaved with other probes'; a ReorderBuffer collects them and
+# releases probes in sequence order, once every receiver has reported or when the probe falls out of its window.
+# Released probes are fed to the streaming estimators (see loss_mle.py and delay_mle.py) in batches.
+#
+# Clients query the service on a stream socket (TCP on the UDP port, or the Unix socket path + ".query"):
+# every request line ("stats", "estimates", "drain" to release every probe held, or "reset" to forget every probe)
+# gets one JSON line back. Estimates are computed off the event loop, on a snapshot of the estimator's counts,
+# so ingestion doesn't stall while they are computed.
+#
+#   python3 probe_service.py serve loss --depth 4 --udp 127.0.0.1:9000
+#   python3 probe_service.py simulate loss 4 0.05 bernoulli 100000 --udp 127.0.0.1:9000
+
+REPORT_DTYPE = numpy.dtype([("seq", "<u8"), ("receiver", "<u4"), ("value", "<f8")]) # 20 bytes per report
+REPORTS_PER_DATAGRAM = 64 # reports the simulator packs into a datagram (1280 bytes, under typical MTUs)
+REORDER_WINDOW = 1024 # probes the service waits on for missing reports
+MAX_JUMP_WINDOWS = 4 # reorder windows a report may be ahead of the next probe to release before it is dropped (see ReorderBuffer)
+FLUSH_PROBES = 4096 # released probes that are fed to the estimator at once
+FLUSH_INTERVAL = 0.1 # seconds between feeds of released probes to the estimator when fewer arrive
+RECEIVE_BUFFER_BYTES = 1 << 23 # socket receive buffer requested by the service, to absorb bursts
+
+# Collects the reports of probes that may arrive out of order and releases complete probes in sequence order.
+# Probes with sequence numbers next_seq .. next_seq + window - 1 are held in a ring of window rows (one column per receiver),
+# along with how many receivers have reported each of them, so that finding complete probes doesn't scan the whole ring.
+# The probe at next_seq is released as soon as every receiver has reported it, and is forced out (incomplete) when a report
+# for a probe window or more sequence numbers later arrives; reports for probes already released are counted as late and dropped.
+# Sequence numbers that were skipped entirely are released as probes with no reports, but only up to max_jump of them at once:
+# reports max_jump or more sequence numbers ahead of next_seq are counted as ahead and dropped, so that a single stray
+# report can't release millions of empty probes (a client that restarts its sequence numbers should reset the service).
+class ReorderBuffer(object):
+  def __init__(self, num_receivers, window = REORDER_WINDOW, max_jump = None):
+    assert(window >= 1)
+    self.window = window
+    self.max_jump = (MAX_JUMP_WINDOWS * window) if (max_jump == None) else max_jump
+    assert(self.max_jump >= window)
+    self.num_receivers = num_receivers
+    self.values = numpy.zeros((window, num_receivers))
+    self.reported = numpy.zeros((window, num_receivers), dtype = bool)
+    self.num_reported = numpy.zeros(window, dtype = numpy.int64) # receivers that reported the probe in every slot
+    self.next_seq = 0
+    self.late = 0 # reports dropped because their probe had been released
+    self.ahead = 0 # reports dropped because their probe was max_jump or more probes ahead
+    self.incomplete = 0 # probes released before every receiver reported
+
+  # Add reports (arrays of sequence numbers, receiver columns and values) and return the released probes, in sequence order,
+  # as a (num_released x num_receivers) matrix of values and a matrix of which receivers reported them.
+  def add(self, seqs, columns, values):
+    released = []
+    seqs = numpy.asarray(seqs, dtype = numpy.int64)
+    accepted = (seqs < self.next_seq + self.max_jump)
+    self.ahead += len(seqs) - numpy.count_nonzero(accepted)
+    (seqs, columns, values) = (seqs[accepted], columns[accepted], values[accepted])
+    beyond = (seqs >= self.next_seq + self.window)
+    self.write(seqs[~beyond], columns[~beyond], values[~beyond])
+    if (numpy.any(beyond)):
+      # make room for the latest probe, then add the reports that still fit
+      released += [self.release(int(numpy.max(seqs[beyond])) - self.window + 1 - self.next_seq)]
+      self.write(seqs[beyond], columns[beyond], values[beyond])
+    released += [self.release(self.complete_run())]
+    return (numpy.concatenate([values for (values, reported) in released]),
+            numpy.concatenate([reported for (values, reported) in released]))
+
+  def write(self, seqs, columns, values):
+    current = (seqs >= self.next_seq)
+    self.late += len(seqs) - numpy.count_nonzero(current)
+    (slots, columns) = (seqs[current] % self.window, columns[current])
+    self.values[slots, columns] = values[current]
+    # count every (probe, receiver) pair once, however many times it is reported
+    first = numpy.unique((slots * self.num_receivers) + columns, return_index = True)[1]
+    new = first[~self.reported[slots[first], columns[first]]]
+    self.num_reported += numpy.bincount(slots[new], minlength = self.window)
+    self.reported[slots, columns] = True
+
+  # number of probes from next_seq on that every receiver has reported
+  def complete_run(self):
+    if (self.num_reported[self.next_seq % self.window] < self.num_receivers):
+      return 0
+    complete = (self.num_reported[(self.next_seq + numpy.arange(0, self.window)) % self.window] == self.num_receivers)
+    return self.window if numpy.all(complete) else int(numpy.argmin(complete))
+
+  # release the next num_probes probes, whether or not they are complete
+  def release(self, num_probes):
+    buffered = min(num_probes, self.window)
+    slots = (self.next_seq + numpy.arange(0, buffered)) % self.window
+    values = numpy.vstack((self.values[slots], numpy.zeros((num_probes - buffered, self.num_receivers))))
+    reported = numpy.vstack((self.reported[slots], numpy.zeros((num_probes - buffered, self.num_receivers), dtype = bool)))
+    self.incomplete += num_probes - numpy.count_nonzero(self.num_reported[slots] == self.num_receivers)
+    self.reported[slots] = False
+    self.num_reported[slots] = 0
+    self.next_seq += num_probes
+    return (values, reported)
+
+  # release every probe up to the latest one reported, e.g., once the reports have stopped
+  def drain(self):
+    reported = numpy.flatnonzero(self.num_reported[(self.next_seq + numpy.arange(0, self.window)) % self.window] > 0)
+    return self.release(int(reported[-1]) + 1 if (len(reported) > 0) else 0)
+
+# The estimator state of the service: it has a topology() like a tree, so the streaming estimators can run on it.
+# Released probes are queued and folded into the estimator in batches. For loss, receivers that didn't report a probe
+# count as not having received it; for delay, probes that some receiver didn't report are dropped.
+class LiveEstimator(object):
+  def __init__(self, kind, topology, labels, bin_width = 1, epsilon = 0.5, window = None, decay = None):
+    assert(kind in ["loss", "delay"])
+    self.kind = kind
+    self._topology = topology
+    self.labels = labels
+    self.epsilon = epsilon
+    (self.bin_width, self.window, self.decay) = (bin_width, window, decay)
+    self.reset()
+
+  # forget every probe, e.g., when a client starts over
+  def reset(self):
+    if (self.kind == "loss"):
+      LossTomographyMle.create_streaming_estimator(self, self.window, self.decay)
+    else:
+      DelayTomographyMle.create_streaming_estimator(self, self.bin_width)
+    self.pending = []
+    self.num_pending = 0
+    self.num_probes = 0 # probes folded into the estimator
+    self.dropped = 0 # incomplete delay probes
+
+  def topology(self):
+    return self._topology
+
+  def add(self, values, reported):
+    if (self.kind == "loss"):
+      rows = reported & (values != 0)
+    else:
+      complete = numpy.all(reported, axis = 1)
+      self.dropped += len(complete) - numpy.count_nonzero(complete)
+      rows = values[complete]
+    if (len(rows) > 0):
+      self.pending += [rows]
+      self.num_pending += len(rows)
+    if (self.num_pending >= FLUSH_PROBES):
+      self.flush()
+
+  def flush(self):
+    if (self.num_pending == 0):
+      return
+    rows = numpy.concatenate(self.pending)
+    (self.pending, self.num_pending) = ([], 0)
+    if (self.kind == "loss"):
+      LossTomographyMle.update_counts(self, rows)
+    else:
+      DelayTomographyMle.update_histogram(self, rows)
+    self.num_probes += len(rows)
+
+  # a copy of what the estimates are computed from, so that they can be computed while probes keep arriving
+  def snapshot(self):
+    self.flush()
+    if (self.kind == "loss"):
+      return self.reached_counter.rates() if (self.reached_counter.total > 0) else None
+    if (self.delay_histogram.total == 0):
+      return None
+    i_max = self.delay_histogram.i_max()
+    return (i_max, self.delay_histogram.cdf(i_max))
+
+  # per-link estimates from a snapshot, as a JSON-friendly dict (run in an executor)
+  def estimates(self, snapshot):
+    topology = self._topology
+    if (snapshot is None):
+      return {"error" : "no probes yet"}
+    if (self.kind == "loss"):
+      gamma = snapshot
+      if (LossTomographyMle.check_gamma(topology, gamma) == False):
+        return {"error" : "pre sanity check failed"}
+      (A, alpha) = LossTomographyMle.compute_mle_arrays(topology, gamma, 1.0)
+      if (LossTomographyMle.check_alpha(alpha) == False):
+        return {"error" : "post sanity check failed"}
+      return {"loss" : dict(zip(self.labels[1:], (1 - alpha[1:]).tolist()))}
+    (i_max, gamma) = snapshot
+    if (numpy.any(DelayTomographyMle.gamma_failures(topology, gamma))):
+      return {"error" : "pre sanity check failed"}
+    (A, beta, alpha) = DelayTomographyMle.solve(topology, gamma, i_max)
+    if (numpy.any(DelayTomographyMle.beta_failures(beta)) or \
+        numpy.any(DelayTomographyMle.sanity_failures(gamma, A, beta, alpha, self.epsilon))):
+      return {"error" : "post sanity check failed"}
+    return {"i_max" : i_max, "alpha" : dict(zip(self.labels, alpha.tolist()))}
+
+class ReportProtocol(asyncio.DatagramProtocol):
+  def __init__(self, service):
+    self.service = service
+
+  def datagram_received(self, data, address):
+    self.service.receive(data)
+
+class ProbeService(object):
+  # receiver_ids: the node id of every receiver, in topology().leaf_order
+  def __init__(self, estimator, receiver_ids, reorder_window = REORDER_WINDOW):
+    self.estimator = estimator
+    self.reorder_window = reorder_window
+    self.buffer = ReorderBuffer(len(receiver_ids), reorder_window)
+    self.column = numpy.full(int(numpy.max(receiver_ids)) + 1, -1, dtype = numpy.int64) # receiver id -> column
+    self.column[receiver_ids] = numpy.arange(0, len(receiver_ids))
+    self.reports = 0
+    self.invalid = 0 # reports from unknown receivers, or datagrams of a size that isn't a whole number of reports
+    self.started = None # time of the first report
+
+  def receive(self, data):
+    if (self.started == None):
+      self.started = time.monotonic()
+    if (len(data) % REPORT_DTYPE.itemsize != 0):
+      self.invalid += 1
+      return
+    reports = numpy.frombuffer(data, dtype = REPORT_DTYPE)
+    receivers = reports["receiver"].astype(numpy.int64)
+    columns = numpy.where(receivers < len(self.column), self.column[numpy.minimum(receivers, len(self.column) - 1)], -1)
+    known = (columns >= 0)
+    self.reports += len(reports)
+    self.invalid += len(reports) - numpy.count_nonzero(known)
+    self.estimator.add(*self.buffer.add(reports["seq"][known], columns[known], reports["value"][known]))
+
+  def stats(self):
+    counts = {"reports" : self.reports, "probes" : self.estimator.num_probes + self.estimator.num_pending,
+              "next_seq" : self.buffer.next_seq, "late" : self.buffer.late, "ahead" : self.buffer.ahead,
+              "incomplete" : self.buffer.incomplete,
+              "dropped" : self.estimator.dropped, "invalid" : self.invalid}
+    return dict({name : int(count) for (name, count) in counts.items()},
+                reports_per_second = (self.reports / max(time.monotonic() - self.started, 1e-9)) if (self.started != None) else 0.0)
+
+  async def handle_query(self, reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+      while True:
+        line = await reader.readline()
+        if (len(line) == 0):
+          break
+        request = line.decode("utf-8").strip()
+        if (request == "stats"):
+          response = self.stats()
+        elif (request == "estimates"):
+          snapshot = self.estimator.snapshot()
+          response = dict(await loop.run_in_executor(None, self.estimator.estimates, snapshot), probes = self.estimator.num_probes)
+        elif (request == "drain"):
+          self.estimator.add(*self.buffer.drain())
+          response = self.stats()
+        elif (request == "reset"):
+          # start over from sequence number 0 with no probes, e.g., for another run of a client
+          self.buffer = ReorderBuffer(self.buffer.num_receivers, self.reorder_window)
+          self.estimator.reset()
+          (self.reports, self.invalid, self.started) = (0, 0, None)
+          response = self.stats()
+        else:
+          response = {"error" : "unknown request " + request}
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+        await writer.drain()
+    finally:
+      writer.close()
+
+  async def flush_periodically(self):
+    while True:
+      await asyncio.sleep(FLUSH_INTERVAL)
+      self.estimator.flush()
+
+# (family, datagram address, query address) of a --udp host:port or --unix path option
+def parse_address(udp, unix):
+  assert((udp == None) != (unix == None))
+  if (udp != None):
+    (host, port) = udp.rsplit(":", 1)
+    return (socket.AF_INET, (host, int(port)), (host, int(port)))
+  return (socket.AF_UNIX, unix, unix + ".query")
+
+async def open_query(family, query_address):
+  if (family == socket.AF_UNIX):
+    return await asyncio.open_unix_connection(query_address)
+  return await asyncio.open_connection(*query_address)
+
+async def query(reader, writer, request):
+  writer.write((request + "\n").encode("utf-8"))
+  await writer.drain()
+  return json.loads(await reader.readline())
+
+async def serve(service, family, address, query_address):
+  loop = asyncio.get_running_loop()
+  if (family == socket.AF_UNIX):
+    for path in [address, query_address]:
+      if (os.path.exists(path)):
+        os.unlink(path)
+  sock = socket.socket(family, socket.SOCK_DGRAM)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
+  sock.bind(address)
+  (transport, protocol) = await loop.create_datagram_endpoint(lambda: ReportProtocol(service), sock = sock)
+  if (family == socket.AF_UNIX):
+    server = await asyncio.start_unix_server(service.handle_query, query_address)
+  else:
+    server = await asyncio.start_server(service.handle_query, *query_address)
+  print("serving", service.estimator.kind, "reports on", address, "and queries on", query_address, flush = True)
+  flusher = asyncio.ensure_future(service.flush_periodically())
+  # run until interrupted or terminated
+  stopped = loop.create_future()
+  for signal_number in [signal.SIGINT, signal.SIGTERM]:
+    loop.add_signal_handler(signal_number, lambda: stopped.done() or stopped.set_result(None))
+  try:
+    await stopped
+  finally:
+    flusher.cancel()
+    server.close()
+    transport.close()
+    if (family == socket.AF_UNIX):
+      for path in [address, query_address]:
+        if (os.path.exists(path)):
+          os.unlink(path)
+
+# Send the reports of num_probes probes on a Tree of the given depth to a service, at most rate reports per second
+# (as fast as possible if rate is None). With shuffle, reports are shuffled within groups of shuffle probes, so that
+# they arrive out of order. With reset, the service first forgets earlier probes (sequence numbers start at 0 every run,
+# so without it, the reports of a second run against the same service are dropped as late).
+# Then wait for the service to process them and return its stats, estimates and the number of this run's reports
+# it dropped as late or too far ahead (which, if nonzero, means the estimates don't just reflect this run).
+async def simulate(expt_type, depth, mean_delay_or_loss, dist_type, num_probes, family, address, query_address, fanout = 2, seed = 0, \
+                   rate = None, shuffle = None, batch = 1000, reset = False):
+  rng = numpy.random.default_rng(seed)
+  shuffle_rng = numpy.random.default_rng([seed, 1]) # a stream of its own, so that shuffling doesn't change the probes
+  tree = Tree(depth, expt_type, mean_delay_or_loss, dist_type, rng, fanout)
+  if (expt_type == "delay"):
+    DelayTomographyMle.create_root(tree) # so that probes are delayed on the root's incoming link too
+  receiver_ids = numpy.array([node.id for node in tree.receivers()])
+  num_receivers = len(receiver_ids)
+  (reader, writer) = await open_query(family, query_address)
+  initial = await query(reader, writer, "reset" if (reset) else "stats")
+  sock = socket.socket(family, socket.SOCK_DGRAM)
+  sock.connect(address)
+  sent = 0
+  started = time.monotonic()
+  for start in range(0, num_probes, batch):
+    size = min(batch, num_probes - start)
+    if (expt_type == "loss"):
+      outcomes = tree.send_multicast_probe_batch(size)
+    else:
+      outcomes = tree.send_multicast_probe_with_delay_batch(size)
+    reports = numpy.empty(size * num_receivers, dtype = REPORT_DTYPE)
+    reports["seq"] = numpy.repeat(numpy.arange(start, start + size), num_receivers)
+    reports["receiver"] = numpy.tile(receiver_ids, size)
+    reports["value"] = outcomes.ravel()
+    if (shuffle != None):
+      for group in range(0, len(reports), shuffle * num_receivers):
+        reports[group : group + shuffle * num_receivers] = shuffle_rng.permutation(reports[group : group + shuffle * num_receivers])
+    for offset in range(0, len(reports), REPORTS_PER_DATAGRAM):
+      sock.send(reports[offset : offset + REPORTS_PER_DATAGRAM].tobytes())
+      sent += min(REPORTS_PER_DATAGRAM, len(reports) - offset)
+      if (rate != None and sent > rate * (time.monotonic() - started)):
+        await asyncio.sleep(sent / rate - (time.monotonic() - started))
+  sock.close()
+  elapsed = time.monotonic() - started
+
+  # wait until the service stops making progress on the reports, then release whatever it still holds
+  stats = await query(reader, writer, "stats")
+  while (stats["next_seq"] < num_probes):
+    await asyncio.sleep(FLUSH_INTERVAL)
+    (previous, stats) = (stats, await query(reader, writer, "stats"))
+    if (stats["reports"] == previous["reports"]):
+      stats = await query(reader, writer, "drain")
+      break
+  estimates = await query(reader, writer, "estimates")
+  writer.close()
+  dropped = (stats["late"] - initial["late"]) + (stats["ahead"] - initial["ahead"])
+  return (sent / max(elapsed, 1e-9), stats, estimates, dropped)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  commands = parser.add_subparsers(dest = "command", required = True)
+  server = commands.add_parser("serve", help = "run the service")
+  server.add_argument("expt_type", choices = ["loss", "delay"])
+  server.add_argument("--depth", type = int, help = "serve a complete tree of this depth")
+  server.add_argument("--fanout", type = int, default = 2, help = "number of children of every internal node")
+  server.add_argument("--topology", help = "edge-list topology file (see topology_file.py) to serve instead of a complete tree")
+  server.add_argument("--reorder-window", type = int, default = REORDER_WINDOW, help = "probes to wait on for missing reports")
+  server.add_argument("--window", type = int, help = "loss estimates over the last WINDOW probes only (see probe_counter.py)")
+  server.add_argument("--decay", type = float, help = "loss estimates with exponentially decaying probe weights")
+  server.add_argument("--bin-width", type = float, default = 1, help = "delay bin width")
+  server.add_argument("--epsilon", type = float, default = 0.5, help = "error tolerance of the delay estimator's sanity check")
+  client = commands.add_parser("simulate", help = "send the reports of probes on a simulated Tree to a running service")
+  client.add_argument("expt_type", choices = ["loss", "delay"])
+  client.add_argument("depth", type = int)
+  client.add_argument("mean_delay_or_loss", type = float, help = "mean_delay/loss_prob")
+  client.add_argument("dist_type")
+  client.add_argument("num_probes", type = int)
+  client.add_argument("--fanout", type = int, default = 2, help = "number of children of every internal node")
+  client.add_argument("--seed", type = int, default = 0)
+  client.add_argument("--rate", type = float, help = "reports per second (as fast as possible by default)")
+  client.add_argument("--shuffle", type = int, help = "shuffle reports within groups of SHUFFLE probes")
+  client.add_argument("--reset", action = "store_true", help = "make the service forget earlier probes first")
+  for command in [server, client]:
+    command.add_argument("--udp", metavar = "HOST:PORT", help = "UDP address for reports (queries go to TCP on the same port)")
+    command.add_argument("--unix", metavar = "PATH", help = "Unix datagram socket for reports (queries go to PATH.query)")
+  args = parser.parse_args()
+  if ((args.udp == None) == (args.unix == None)):
+    parser.error("give one of --udp and --unix")
+  (family, address, query_address) = parse_address(args.udp, args.unix)
+
+  if (args.command == "serve"):
+    if (args.topology != None):
+      links = LinkTable.load(args.topology)
+      (topology, labels) = (links.topology, [str(name) for name in links.names])
+    else:
+      if (args.depth == None):
+        parser.error("give one of --depth and --topology")
+      topology = Topology.complete(args.depth, args.fanout)
+      labels = (topology.postorder_rank() + 1).tolist()
+    ids = topology.postorder_rank() + 1
+    estimator = LiveEstimator(args.expt_type, topology, labels, args.bin_width, args.epsilon, args.window, args.decay)
+    service = ProbeService(estimator, ids[topology.leaf_order], args.reorder_window)
+    asyncio.run(serve(service, family, address, query_address))
+  else:
+    (rate, stats, estimates, dropped) = asyncio.run(simulate(args.expt_type, args.depth, args.mean_delay_or_loss, args.dist_type, \
+                                                             args.num_probes, family, address, query_address, args.fanout, args.seed, \
+                                                             args.rate, args.shuffle, reset = args.reset))
+    print("sent", round(rate), "reports per second; service stats:", json.dumps(stats))
+    if (dropped > 0):
+      print("warning:", dropped, "reports of this run were dropped as late or too far ahead, so the estimates are not just this run's",
+            "(rerun with --reset to make the service forget earlier probes)")
+    if ("error" in estimates):
+      print("no estimates:", estimates["error"])
+    elif (args.expt_type == "loss"):
+      print("\n".join([str(label) + " " + str(loss) for (label, loss) in estimates["loss"].items()]))
+    else:
+      print("i_max is", estimates["i_max"])
+      print("\n".join([str(label) + " " + str(alpha) for (label, alpha) in estimates["alpha"].items()]))
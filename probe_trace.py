@@ -0,0 +1,158 @@
+#! /usr/local/bin/python3
+
+import argparse
+import contextlib
+import json
+import math
+import numpy
+from topology import Topology
+from array_tree import BATCH_ENTRIES
+
+# Probe traces: the receiver outcomes of multicast probes (loss: delivered or not, delay: end-to-end delays) plus the tree
+# they were sent down, recorded to a file so that estimators can be rerun (e.g., with another epsilon or bin width)
+# without simulating probes again, or run on traces captured elsewhere.
+#
+# File layout:
+#   bytes 0-63: magic "MCTRACE1", then the offset and length of the metadata as little-endian uint64s, zero padded
+#   then one row per probe, with one column per receiver in topology().leaf_order:
+#     loss: the outcomes as bits (numpy.packbits, 1 = delivered), ceil(num_receivers / 8) bytes per probe
+#     delay: the delays as little-endian float64s
+#   then the metadata, as UTF-8 JSON: kind ("loss" or "delay"), num_probes, num_receivers, the tree as a preorder parent
+#   array (see topology.py), optionally node ids or names and every node's incoming link parameter (loss probability
+#   or mean delay, null where unknown) in topology order, and the parameters of the run that produced the trace.
+# The metadata goes last so that probes can be appended as they are generated.
+#
+# ProbeTrace memory-maps the rows and hands them out in chunks, so a trace is never loaded into RAM all at once.
+# A ProbeTrace has a topology() like a tree, so it can stand in for one in the estimators' streaming mode, e.g.,
+#   LossTomographyMle.create_streaming_estimator(trace)
+#   for outcomes in trace.chunks():
+#     LossTomographyMle.update_counts(trace, outcomes)
+# To replay a trace and print its estimates:
+#   python3 probe_trace.py trace [--epsilon e] [--bin-width q] [--tail-quantile p] [--max-bins n] [--bootstrap replicates [--seed s]]
+
+MAGIC = b"MCTRACE1"
+HEADER_BYTES = 64
+KINDS = ["loss", "delay"]
+
+class ProbeTraceWriter(object):
+  def __init__(self, path, kind, topology, ids = None, names = None, link_params = None, **params):
+    assert(kind in KINDS)
+    self.path = path
+    self.file = open(path, "wb")
+    self.file.write(bytes(HEADER_BYTES))
+    self.metadata = {"kind" : kind, "num_probes" : 0, "num_receivers" : int(topology.num_receivers),
+                     "parent" : topology.parent.tolist(), "params" : params}
+    if (ids is not None):
+      self.metadata["ids"] = numpy.asarray(ids).tolist()
+    if (names is not None):
+      self.metadata["names"] = [str(name) for name in names]
+    if (link_params is not None):
+      self.metadata["link_params"] = [None if math.isnan(value) else value \
+                                      for value in numpy.asarray(link_params, dtype = float).tolist()]
+
+  # append a (num_probes x num_receivers) outcome matrix, e.g., from a tree's batch probe methods
+  def append(self, outcomes):
+    outcomes = numpy.atleast_2d(outcomes)
+    assert(outcomes.shape[1] == self.metadata["num_receivers"])
+    if (self.metadata["kind"] == "loss"):
+      rows = numpy.packbits(outcomes.astype(bool), axis = 1)
+    else:
+      rows = numpy.ascontiguousarray(outcomes, dtype = "<f8")
+    self.file.write(rows.tobytes())
+    self.metadata["num_probes"] += outcomes.shape[0]
+
+  def close(self):
+    offset = self.file.tell()
+    encoded = json.dumps(self.metadata).encode("utf-8")
+    self.file.write(encoded)
+    self.file.seek(0)
+    self.file.write(MAGIC + numpy.array([offset, len(encoded)], dtype = "<u8").tobytes())
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  # On an exception (e.g., an aborted trial), the file is closed without its header and metadata,
+  # so that ProbeTrace rejects it rather than replaying a truncated trace as if it were complete.
+  def __exit__(self, exception_type, exception, trace):
+    if (exception_type == None):
+      self.close()
+    else:
+      self.file.close()
+
+# context manager for a ProbeTraceWriter to path (yielding None, and recording nothing, if path is None)
+def trace_writer(path, kind, topology, **kwargs):
+  return ProbeTraceWriter(path, kind, topology, **kwargs) if (path != None) else contextlib.nullcontext()
+
+class ProbeTrace(object):
+  def __init__(self, path):
+    with open(path, "rb") as trace_file:
+      header = trace_file.read(HEADER_BYTES)
+      if (len(header) < HEADER_BYTES or header[:len(MAGIC)] != MAGIC):
+        raise ValueError(path + " is not a probe trace (or wasn't closed)")
+      (offset, length) = numpy.frombuffer(header[len(MAGIC) : len(MAGIC) + 16], dtype = "<u8").tolist()
+      trace_file.seek(offset)
+      self.metadata = json.loads(trace_file.read(length).decode("utf-8"))
+    self.path = path
+    self.kind = self.metadata["kind"]
+    self.num_probes = self.metadata["num_probes"]
+    self.num_receivers = self.metadata["num_receivers"]
+    self._topology = Topology(self.metadata["parent"])
+    assert(self._topology.num_receivers == self.num_receivers)
+    self.ids = numpy.array(self.metadata["ids"]) if ("ids" in self.metadata) else self._topology.postorder_rank() + 1
+    self.names = numpy.array(self.metadata["names"]) if ("names" in self.metadata) else None
+    self.link_params = numpy.array([math.nan if value == None else value for value in self.metadata["link_params"]]) \
+                       if ("link_params" in self.metadata) else None
+    (dtype, width) = (numpy.uint8, (self.num_receivers + 7) // 8) if (self.kind == "loss") else ("<f8", self.num_receivers)
+    if (self.num_probes > 0):
+      self.rows = numpy.memmap(path, dtype = dtype, mode = "r", offset = HEADER_BYTES, shape = (self.num_probes, width))
+    else:
+      self.rows = numpy.zeros((0, width), dtype = dtype)
+
+  def topology(self):
+    return self._topology
+
+  # node labels for printing estimates: names if the trace has them, ids otherwise
+  def labels(self):
+    return self.names if (self.names is not None) else self.ids
+
+  # Yield the outcomes in (num_probes x num_receivers) chunks (boolean for loss, float for delay),
+  # by default sized like ArrayTree's probe batches, so that the estimators' per-node work stays within BATCH_ENTRIES.
+  def chunks(self, num_probes = None):
+    if (num_probes == None):
+      num_probes = max(1, BATCH_ENTRIES // self._topology.num_nodes)
+    for start in range(0, self.num_probes, num_probes):
+      rows = self.rows[start : start + num_probes]
+      if (self.kind == "loss"):
+        yield numpy.unpackbits(rows, axis = 1, count = self.num_receivers).astype(bool)
+      else:
+        yield numpy.array(rows, dtype = float)
+
+if __name__ == "__main__":
+  # imported here, since the drivers import this module to record traces
+  import simulation
+  import delay_tomography
+  parser = argparse.ArgumentParser()
+  parser.add_argument("trace")
+  parser.add_argument("--epsilon", type = float, default = 0.5, help = "error tolerance of the delay estimator's sanity check")
+  parser.add_argument("--bin-width", type = float, default = 1, help = "delay bin width")
+  parser.add_argument("--chunk", type = int, help = "probes per chunk fed to the estimator")
+  parser.add_argument("--tail-quantile", type = float, help = "end the delay bins at this quantile, leaving the rest to a tail")
+  parser.add_argument("--max-bins", type = int, help = "merge delay bins so there are at most this many " + \
+                                                         "(up to the 0.99 quantile without --tail-quantile)")
+  parser.add_argument("--bootstrap", type = int, metavar = "REPLICATES", help = "confidence intervals from this many bootstrap " + \
+                                                                              "resamples of the trace (see bootstrap.py)")
+  parser.add_argument("--seed", type = int, default = 0, help = "seed of the bootstrap resamples")
+  args = parser.parse_args()
+  trace = ProbeTrace(args.trace)
+  print(trace.kind, "trace of", trace.num_probes, "probes to", trace.num_receivers, "receivers, recorded with", trace.metadata["params"])
+  if (trace.kind == "loss" and args.bootstrap != None):
+    estimates = simulation.bootstrap_loss_trace(trace, args.bootstrap, args.seed, args.chunk)
+    print(simulation.format_bootstrap(trace.labels().tolist(), args.bootstrap, *estimates))
+  elif (trace.kind == "loss"):
+    print(simulation.format_replay(trace, *simulation.replay_loss_trace(trace, args.chunk)))
+  else:
+    (i_max, alphas, intervals) = delay_tomography.replay_delay_trace(trace, args.epsilon, args.bin_width, args.chunk, args.tail_quantile, \
+                                                                     args.max_bins, args.bootstrap, args.seed)
+    print(delay_tomography.format_result(args.trace, alphas, show_tail = (args.tail_quantile != None or args.max_bins != None), \
+                                         intervals = intervals))
@@ -0,0 +1,95 @@
+#! /usr/local/bin/python3
+
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+# Structured store for sweep records (see sweep.py), one row per configuration in an SQLite file.
+# A row is keyed by a hash of the full configuration (including its seed), so a sweep can skip configurations
+# that are already in the store: rerunning a finished sweep or resuming a crashed one only runs what is missing.
+# Every record is committed as soon as it is added, so a crash loses at most the configurations that were running.
+#
+# Besides the record itself (as JSON), every row has the experiment type and status in their own columns,
+# so all records of one experiment load in a single query (records) or export to one CSV file (export_csv):
+#   python3 result_store.py results.sqlite results.csv [loss|delay]
+
+# JSON encoding of the numpy scalars and arrays that records may contain
+def to_builtin(value):
+  if (hasattr(value, "tolist")):
+    return value.tolist()
+  raise TypeError("Cannot store " + repr(value))
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results") # where the run scripts keep their stores
+
+class ResultStore(object):
+  def __init__(self, path):
+    self.path = path
+    self.connection = sqlite3.connect(path)
+    self.connection.execute("CREATE TABLE IF NOT EXISTS results " + \
+                            "(key TEXT PRIMARY KEY, expt TEXT NOT NULL, status TEXT NOT NULL, record TEXT NOT NULL)")
+    self.connection.commit()
+
+  # Hash of a configuration: sha256 of its canonical JSON encoding (sorted keys, no whitespace),
+  # so two configurations get the same key exactly when they have the same parameters and values.
+  @staticmethod
+  def config_key(config):
+    encoded = json.dumps(config, sort_keys = True, separators = (",", ":"), default = to_builtin)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+  def __contains__(self, config):
+    return self.get(config) != None
+
+  def __len__(self):
+    return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+  # the stored record of a configuration, or None if it hasn't been computed
+  def get(self, config):
+    row = self.connection.execute("SELECT record FROM results WHERE key = ?", (ResultStore.config_key(config),)).fetchone()
+    return json.loads(row[0]) if (row != None) else None
+
+  # add (or replace) the record of config
+  def put(self, config, record):
+    self.connection.execute("INSERT OR REPLACE INTO results (key, expt, status, record) VALUES (?, ?, ?, ?)", \
+                            (ResultStore.config_key(config), config["expt"], record["status"], \
+                             json.dumps(record, default = to_builtin)))
+    self.connection.commit()
+
+  # all records, optionally only those of one experiment type and/or status, in the order they were added
+  def records(self, expt = None, status = None):
+    query = "SELECT record FROM results WHERE (? IS NULL OR expt = ?) AND (? IS NULL OR status = ?) ORDER BY rowid"
+    return [json.loads(row[0]) for row in self.connection.execute(query, (expt, expt, status, status))]
+
+  # Write records as CSV, one column per record field (the union over all records, missing fields left empty).
+  # Fields that aren't scalars (e.g., a delay record's alphas) are written as JSON.
+  def export_csv(self, csv_path, expt = None, status = None):
+    records = self.records(expt, status)
+    fields = []
+    for record in records:
+      fields += [field for field in record.keys() if field not in fields]
+    with open(csv_path, "w", newline = "") as csv_file:
+      writer = csv.DictWriter(csv_file, fieldnames = fields)
+      writer.writeheader()
+      for record in records:
+        writer.writerow({field : (json.dumps(value) if isinstance(value, (list, dict)) else value) \
+                         for (field, value) in record.items()})
+    return len(records)
+
+  def close(self):
+    self.connection.close()
+
+# the store called name (e.g., "loss_expt1_hi-loss") in RESULTS_DIR, created if needed
+def open_results(name):
+  os.makedirs(RESULTS_DIR, exist_ok = True)
+  return ResultStore(os.path.join(RESULTS_DIR, name + ".sqlite"))
+
+if __name__ == "__main__":
+  if (len(sys.argv) < 3):
+    print("Usage: ", sys.argv[0], " store_path csv_path [expt]")
+    sys.exit(1)
+  store = ResultStore(sys.argv[1])
+  num_records = store.export_csv(sys.argv[2], sys.argv[3] if (len(sys.argv) > 3) else None)
+  store.close()
+  print("wrote", num_records, "records to", sys.argv[2])
@@ -1,43 +1,29 @@
-import subprocess
 import sys
-
-# Program wrapper
-# Takes a command line of program arguements,
-# executes it, and prints something out whether it succeeds or fails
-def program_wrapper(program, t_stdout = subprocess.PIPE, t_stderr = subprocess.PIPE):
-  """ Wrapper for second experiment - incrementally run the loss rates over intervals of
-      1000 (1000-10000) for bernoulli and intervals of 10,000 (10,000-100,000) for Gilbert-
-      Elliot. """
-  sp = subprocess.Popen(program, stdout = t_stdout, stderr = t_stderr)
-  out, err = sp.communicate()
-  if (sp.returncode != 0):
-    print(" ".join(program), " failed with stdout:")
-    print(out)
-    print("stderr:")
-    print(err)
-    sys.exit(sp.returncode)
-  else :
-    print(" ".join(program), " succeeded with stdout:")
-    print(out.decode("utf-8"))
-    sys.stdout.flush()
-    return (out, err)
+import sweep
+from result_store import open_results
 
 if (sys.argv[1] == "hi-loss"):
   loss_rates = [30]             # <== CHANGE THIS TO GRAPH A DIFFERENT LOSS PROB
 else:
   loss_rates = [1]              # <== CHANGE THIS TO GRAPH A DIFFERENT LOSS PROB
 
-for loss in loss_rates:
-  for num_samples in [100, 200, 300, 400, 500, 600, 700, 800, 900, 1000]:
-    for depth in [5]:
-      cmd1 = ["./simulation.py", str(depth), "loss", str(loss/100.0), "bernoulli", str(num_samples), "100"]
-      program_wrapper(cmd1)
-      print("===========================================================================================")
+# Run all configurations on a pool of workers (one per core) and print them in the order of the loops below.
+# Records are saved in results/, and configurations already there are not rerun.
+configs = sweep.expand_grid({"expt"               : ["loss"],
+                             "mean_delay_or_loss" : [loss/100.0 for loss in loss_rates],
+                             "num_probes"         : [100, 200, 300, 400, 500, 600, 700, 800, 900, 1000],
+                             "depth"              : [5],
+                             "dist_type"          : ["bernoulli"],
+                             "num_trials"         : [100]})
+for record in sweep.run_sweep(configs, store = open_results("loss_expt4_" + sys.argv[1])):
+  sweep.print_record(record)
 
 
-#for loss in loss_rates:
-#  for num_samples in [100, 200, 300, 400, 500, 600, 700, 800, 900, 1000]:
-#    for depth in [5]:
-#      cmd2 = ["./simulation.py", str(depth), "loss", str(loss/100.0), "gilbert_elliot", str(num_samples), "100"]
-#      program_wrapper(cmd2)
-#      print("===========================================================================================")
+#configs = sweep.expand_grid({"expt"               : ["loss"],
+#                             "mean_delay_or_loss" : [loss/100.0 for loss in loss_rates],
+#                             "num_probes"         : [100, 200, 300, 400, 500, 600, 700, 800, 900, 1000],
+#                             "depth"              : [5],
+#                             "dist_type"          : ["gilbert_elliot"],
+#                             "num_trials"         : [100]})
+#for record in sweep.run_sweep(configs, store = open_results("loss_expt4_" + sys.argv[1])):
+#  sweep.print_record(record)
@@ -1,35 +1,21 @@
-import subprocess
+import os
 import sys
-
-# Program wrapper
-# Takes a command line of program arguements,
-# executes it, and prints something out whether it succeeds or fails
-def program_wrapper(program, t_stdout = subprocess.PIPE, t_stderr = subprocess.PIPE):
-  sp = subprocess.Popen(program, stdout = t_stdout, stderr = t_stderr)
-  out, err = sp.communicate()
-  if (sp.returncode != 0):
-    print(" ".join(program), " failed with stdout:")
-    print(out)
-    print("stderr:")
-    print(err)
-    sys.exit(sp.returncode)
-  else :
-    print(" ".join(program), " succeeded with stdout:")
-    print(out.decode("utf-8"))
-    sys.stdout.flush()
-    return (out, err)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sweep
+from result_store import open_results
 
 if (sys.argv[1] == "hi-loss"):
   loss_rates = range(10, 50, 10)
 else:
   loss_rates = range(1, 11, 1)
 
-for loss in loss_rates:
-  for num_samples in [100, 1000, 10000, 100000]:
-    for depth in [3, 4, 5]:
-      cmd1 = ["./tomography.py", str(depth), str(loss/100.0), "bernoulli", str(num_samples), "100"]
-      cmd2 = ["./tomography.py", str(depth), str(loss/100.0), "gilbert_elliot", str(num_samples), "100"]
-      program_wrapper(cmd1)
-      print("===========================================================================================")
-      program_wrapper(cmd2)
-      print("===========================================================================================")
+# Run all configurations on a pool of workers (one per core) and print them in the order of the loops below.
+# Records are saved in results/, and configurations already there are not rerun.
+configs = sweep.expand_grid({"expt"               : ["loss"],
+                             "mean_delay_or_loss" : [loss/100.0 for loss in loss_rates],
+                             "num_probes"         : [100, 1000, 10000, 100000],
+                             "depth"              : [3, 4, 5],
+                             "dist_type"          : ["bernoulli", "gilbert_elliot"],
+                             "num_trials"         : [100]})
+for record in sweep.run_sweep(configs, store = open_results("loss_expt1_" + sys.argv[1])):
+  sweep.print_record(record)
@@ -0,0 +1,32 @@
+import math
+
+Z_95 = 1.96 # two-sided 95% normal quantile
+
+# Mean and variance of a stream of values, updated in constant time per value (Welford's algorithm),
+# so that a confidence interval can be checked after every trial without going over all earlier ones.
+# The variance is the population variance, like numpy.std's default (see simulation.confidence_interval).
+class RunningStats(object):
+  def __init__(self, values = ()):
+    self.count = 0
+    self.mean = 0.0
+    self.sum_squares = 0.0 # sum of squared deviations from the mean
+    for value in values:
+      self.add(value)
+
+  def add(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.sum_squares += delta * (value - self.mean)
+
+  def variance(self):
+    return (self.sum_squares / self.count) if (self.count > 0) else math.nan
+
+  # half-width of the confidence interval around the mean (infinite until there are values)
+  def half_width(self, z = Z_95):
+    return (z * math.sqrt(self.variance()) / math.sqrt(self.count)) if (self.count > 0) else math.inf
+
+  # (mean, lower, upper) like simulation.confidence_interval
+  def interval(self, z = Z_95):
+    half_width = self.half_width(z)
+    return (self.mean, self.mean - half_width, self.mean + half_width)
@@ -1,92 +1,416 @@
 #! /usr/local/bin/python3
 
+import argparse
+import collections
+import contextlib
+import io
 import math
-import numpy
+import multiprocessing
 import sys
+import numpy
 from statistics import mean
 from tree import Tree
+from array_tree import ArrayTree
+from topology_file import LinkTable
 from loss_mle import LossTomographyMle
+from running_stats import RunningStats
+from probe_trace import trace_writer
+from bootstrap import percentile_interval
+import instrumentation
+from instrumentation import phase
 
-if len(sys.argv) != 7:
-  print("Usage: ", sys.argv[0], " depth expt_type mean_delay/loss_prob dist_type num_probes num_trials ")
-  exit(1)
-else:
-  depth = int(sys.argv[1])
-  expt_type = sys.argv[2]
-  mean_delay_or_loss = float(sys.argv[3])
-  dist_type = sys.argv[4]
-  num_probes = int(sys.argv[5])
-  num_trials = int(sys.argv[6])
-
-# Error at each run from tomography and true error
-mean_tomography_errors = []
-mean_true_errors = []
-
-for i in range(1, num_trials + 1):
-  # seed random number generator
-  numpy.random.seed(i)
+PROBE_BATCH_SIZE = 100000 # Number of multicast probes generated and streamed into the estimator at a time
+MIN_TRIALS = 10 # fewest trials whose confidence intervals are trusted to stop a run early (see run_simulation)
 
+# Run one trial of the in-network and the multicast tomography approaches.
+# All randomness comes from a Generator seeded with seed_seq, so a trial's result doesn't depend on which
+# process runs it or on what ran before it.
+# With instrument set (to the options of instrumentation.recording), the trial's phases are recorded as well.
+# With record_path set, the multicast probes' receiver outcomes are recorded there as a loss trace (see probe_trace.py).
+# With common_random_numbers set, the multicast arm draws from its own Generator seeded like the in-network arm's,
+# so both arms build the same links and see the same per-link loss realizations (and Gilbert-Elliot state trajectories),
+# which makes the difference between their errors much less noisy than with independent arms.
+# Returns (mean tomography error or None if the sanity checks failed, mean in-network error, printed output,
+# instrumentation report or None).
+def run_trial(trial_args):
+  (depth, expt_type, mean_delay_or_loss, dist_type, num_probes, seed_seq, fanout, array_tree, links, instrument, record_path, \
+   common_random_numbers) = trial_args
+  log = io.StringIO()
+  with contextlib.redirect_stdout(log), \
+       instrumentation.recording(enabled = (instrument != None), **(instrument or {})) as recorder:
+    rng = numpy.random.default_rng(seed_seq)
+    mcast_rng = numpy.random.default_rng(seed_seq) if (common_random_numbers) else None
+    if (array_tree or links != None):
+      (mean_tomography_error, mean_true_error) = run_array_trial(depth, expt_type, mean_delay_or_loss, dist_type, num_probes, \
+                                                                 fanout, rng, links, record_path, mcast_rng)
+    else:
+      (mean_tomography_error, mean_true_error) = run_tree_trial(depth, expt_type, mean_delay_or_loss, dist_type, num_probes, \
+                                                                fanout, rng, record_path, mcast_rng)
+  return (mean_tomography_error, mean_true_error, log.getvalue(), recorder.report() if (recorder != None) else None)
+
+# The multicast tree draws from mcast_rng if given (see run_trial's common_random_numbers), from rng otherwise.
+def run_tree_trial(depth, expt_type, mean_delay_or_loss, dist_type, num_probes, fanout, rng, record_path = None, mcast_rng = None):
   # in network approach
-  in_network_tree = Tree(depth, expt_type, mean_delay_or_loss, dist_type)
-  for i in range(0, num_probes):
-    for node in in_network_tree.nodes():
-      node.tick()
-    in_network_tree.send_independent_probes()
+  with phase("tree_construction"):
+    in_network_tree = Tree(depth, expt_type, mean_delay_or_loss, dist_type, rng, fanout)
+  # probes go out in the multicast arm's batches, which bounds memory and, with common random numbers,
+  # makes both arms draw the same values
+  for start in range(0, num_probes, PROBE_BATCH_SIZE):
+    with phase("in_network_probes"):
+      in_network_tree.send_independent_probe_batch(min(PROBE_BATCH_SIZE, num_probes - start))
 
   # Compute mean errors for in network approach
   node_true_errors = []
   for node in in_network_tree.nodes():
     if node != in_network_tree:
       node_true_errors += [round(100.0 * abs(node.true_loss - float(mean_delay_or_loss)) / float(mean_delay_or_loss), 5)]
-
-  mean_true_errors += [mean(node_true_errors)]
-  std_dev_true_errors = numpy.std(mean_true_errors)
-  confidence_true_errors = (std_dev_true_errors * 1.96) / math.sqrt(len(mean_true_errors))
-  true_lower_conf = mean(mean_true_errors) - confidence_true_errors
-  true_upper_conf = mean(mean_true_errors) + confidence_true_errors
+  mean_true_error = mean(node_true_errors)
 
   # multicast tomography based approach
-  mcast_tree = Tree(depth, expt_type, mean_delay_or_loss, dist_type)
-  probe = dict() # To store results of probes keyed by receiver ID
-  for receiver in mcast_tree.receivers():
-    probe[receiver.id] = 0
-  LossTomographyMle.create_estimator(mcast_tree)
-  for i in range(0, num_probes):
-    for node in mcast_tree.nodes():
-      node.tick()
-    outcome = mcast_tree.send_multicast_probe()
-    for rx_tuple in outcome:
-      probe[rx_tuple[0]] = 1 if rx_tuple[1] else 0
-    LossTomographyMle.update_Y(mcast_tree, probe)
+  with phase("tree_construction"):
+    mcast_tree = Tree(depth, expt_type, mean_delay_or_loss, dist_type, rng if (mcast_rng == None) else mcast_rng, fanout)
+  LossTomographyMle.create_streaming_estimator(mcast_tree)
+  topology = mcast_tree.topology()
+  link_params = numpy.append(math.nan, numpy.full(topology.num_nodes - 1, float(mean_delay_or_loss)))
+  # send probes in batches (this also ticks every link once per probe),
+  # streaming them into the estimator's counters so that memory doesn't grow with num_probes
+  with trace_writer(record_path, "loss", topology, link_params = link_params, depth = depth, fanout = fanout, \
+                    dist_type = dist_type, num_probes = num_probes) as trace:
+    for start in range(0, num_probes, PROBE_BATCH_SIZE):
+      with phase("multicast_probes"):
+        outcomes = mcast_tree.send_multicast_probe_batch(min(PROBE_BATCH_SIZE, num_probes - start))
+      if (trace != None):
+        trace.append(outcomes)
+      LossTomographyMle.update_counts(mcast_tree, outcomes)
 
   # Now compute MLE
-  LossTomographyMle.compute_gamma(mcast_tree)
+  mean_tomography_error = None
+  LossTomographyMle.compute_streaming_gamma(mcast_tree)
   if (LossTomographyMle.pre_sanity_check(mcast_tree) == False):
     print("Pre sanity check failed. Skipping this trial.\n")
-    continue
-  LossTomographyMle.compute_mle(mcast_tree, 1.0)
-  if (LossTomographyMle.post_sanity_check(mcast_tree) == False):
-    print("Post sanity check failed. Skipping this trial.\n")
-    continue
-
-  # Compute mean errors for tomography
-  node_tomography_errors = []
-  for node in mcast_tree.nodes():
-    if node != mcast_tree:
-      node_tomography_errors += [round(100.0 * abs(1 - node.alpha - float(mean_delay_or_loss)) / float(mean_delay_or_loss), 5)]
-
-  mean_tomography_errors += [mean(node_tomography_errors)]
-  std_dev_tomography_errors = numpy.std(mean_tomography_errors)
-  confidence_tomography = (std_dev_tomography_errors * 1.96) / math.sqrt(len(mean_tomography_errors))
-  tomography_lower_conf = mean(mean_tomography_errors) - confidence_tomography
-  tomography_upper_conf = mean(mean_tomography_errors) + confidence_tomography
-
-# print out average of mean errors
-print("Depth =", depth, "expt_type =", expt_type, "mean_delay_or_loss =", mean_delay_or_loss, "dist_type =", dist_type, \
-      "num_probes =", num_probes, "num_trials =", num_trials,
-      "\navg. tomography error = ", round(mean(mean_tomography_errors), 5) if len(mean_tomography_errors) > 0 else "undef",\
-      "%,", len(mean_tomography_errors), "trials", round(tomography_lower_conf, 5) if len(mean_tomography_errors) > 0 else "undef", "lower conf. int", round(tomography_upper_conf, 5) if len(mean_tomography_errors) > 0 else "undef", "upper conf. int"\
-      "\navg. in-network error = ", round(mean(mean_true_errors), 5),\
-      "%,", len(mean_true_errors), "trials", round(true_lower_conf, 5) if len(mean_true_errors) > 0 else "undef", "lower conf. int", round(true_upper_conf, 5) if len(mean_true_errors) > 0 else "undef", "upper conf. int")
-      
-# std_dev * 1.96 / (srt successful_trials)
+  else:
+    LossTomographyMle.compute_mle(mcast_tree, 1.0)
+    if (LossTomographyMle.post_sanity_check(mcast_tree) == False):
+      print("Post sanity check failed. Skipping this trial.\n")
+    else:
+      # Compute mean errors for tomography
+      node_tomography_errors = []
+      for node in mcast_tree.nodes():
+        if node != mcast_tree:
+          node_tomography_errors += [round(100.0 * abs(1 - node.alpha - float(mean_delay_or_loss)) / float(mean_delay_or_loss), 5)]
+      mean_tomography_error = mean(node_tomography_errors)
+  return (mean_tomography_error, mean_true_error)
+
+# One trial like run_trial's, but on ArrayTrees (see array_tree.py), whose per-node state lives in arrays,
+# for trees too large to have one Tree object per node. Probes are sent in batches sized to the tree.
+# ArrayTrees draw their links differently from Trees, so the errors differ from run_trial's for the same seed.
+# Given a LinkTable (see topology_file.py), the trees have its topology and link parameters instead of being complete trees,
+# with mean_delay_or_loss and dist_type filling in unset parameters. Errors are relative to every link's own loss probability.
+# Both arms send probes in the same batches, so with mcast_rng seeded like rng they make the same draws.
+def run_array_trial(depth, expt_type, mean_delay_or_loss, dist_type, num_probes, fanout, rng, links = None, record_path = None, \
+                    mcast_rng = None):
+  new_tree = lambda rng: ArrayTree.complete(depth, expt_type, mean_delay_or_loss, dist_type, rng, fanout) if (links == None) \
+                         else ArrayTree.from_links(links, expt_type, mean_delay_or_loss, dist_type, rng)
+
+  # in network approach
+  with phase("tree_construction"):
+    in_network_tree = new_tree(rng)
+  loss = in_network_tree.loss_links.loss_probs
+  batch = in_network_tree.probes_per_batch()
+  for start in range(0, num_probes, batch):
+    with phase("in_network_probes"):
+      in_network_tree.send_independent_probe_batch(min(batch, num_probes - start))
+  mean_true_error = float(numpy.mean(numpy.round(100.0 * numpy.abs(in_network_tree.true_loss[1:] - loss) / loss, 5)))
+
+  # multicast tomography based approach
+  with phase("tree_construction"):
+    mcast_tree = new_tree(rng if (mcast_rng == None) else mcast_rng)
+  topology = mcast_tree.topology()
+  LossTomographyMle.create_streaming_estimator(mcast_tree)
+  with trace_writer(record_path, "loss", topology, ids = mcast_tree.ids, names = mcast_tree.names, \
+                    link_params = numpy.append(math.nan, mcast_tree.loss_links.loss_probs), depth = depth, fanout = fanout, \
+                    dist_type = dist_type, num_probes = num_probes) as trace:
+    for start in range(0, num_probes, batch):
+      with phase("multicast_probes"):
+        outcomes = mcast_tree.send_multicast_probe_batch(min(batch, num_probes - start))
+      if (trace != None):
+        trace.append(outcomes)
+      LossTomographyMle.update_counts(mcast_tree, outcomes)
+
+  # Now compute MLE
+  mean_tomography_error = None
+  gamma = mcast_tree.reached_counter.rates()
+  if (LossTomographyMle.check_gamma(topology, gamma) == False):
+    print("Pre sanity check failed. Skipping this trial.\n")
+  else:
+    (A, alpha) = LossTomographyMle.compute_mle_arrays(topology, gamma, 1.0)
+    if (LossTomographyMle.check_alpha(alpha) == False):
+      print("Post sanity check failed. Skipping this trial.\n")
+    else:
+      mean_tomography_error = float(numpy.mean(numpy.round(100.0 * numpy.abs(1 - alpha[1:] - loss) / loss, 5)))
+  return (mean_tomography_error, mean_true_error)
+
+# Run num_trials independent trials on num_workers processes.
+# Trial i draws from the i-th child of SeedSequence(seed), and results (and whatever the trials print) are
+# collected in trial order, so the output is identical regardless of num_workers.
+# With a LinkTable (links, see topology_file.py), trials run on ArrayTrees of its topology and depth and fanout are ignored.
+# Given an instrumentation.Recorder, every trial records its phases (wherever it runs) and they are merged into recorder.
+# With target_half_width, num_trials is only a cap: the run stops after the first trial at which the 95% confidence intervals
+# of both the tomography and in-network errors are at most target_half_width wide on either side of their means, and each
+# covers at least min_trials errors (an interval of a single error has zero width, e.g., when the sanity checks fail on
+# most trials). Which trial that is doesn't depend on num_workers either.
+# With record set, trial i records its multicast probes to the loss trace record + "." + str(i) (see probe_trace.py).
+# With common_random_numbers, both arms of every trial see the same link realizations (see run_trial), and target_half_width
+# applies to the confidence interval of the paired differences instead, the quantity the coupling makes precise.
+# Returns the lists of mean tomography errors (successful trials only), mean in-network errors, and the paired differences
+# (tomography error - in-network error) of the successful trials.
+def run_simulation(depth, expt_type, mean_delay_or_loss, dist_type, num_probes, num_trials, num_workers = 1, seed = 0, fanout = 2, \
+                   array_tree = False, links = None, recorder = None, target_half_width = None, min_trials = MIN_TRIALS, \
+                   record = None, common_random_numbers = False):
+  # children of the seed sequence are spawned as trials start, which gives the same seeds as spawning them all at once
+  seed_sequence = numpy.random.SeedSequence(seed)
+  instrument = {"track_memory" : recorder.track_memory} if (recorder != None) else None
+  trial_args = ((depth, expt_type, mean_delay_or_loss, dist_type, num_probes, seed_sequence.spawn(1)[0], fanout, array_tree, links, \
+                 instrument, (record + "." + str(trial)) if (record != None) else None, common_random_numbers) \
+                for trial in range(0, num_trials))
+
+  # Error at each run from tomography and true error
+  mean_tomography_errors = []
+  mean_true_errors = []
+  error_differences = []
+  (tomography_stats, true_stats, difference_stats) = (RunningStats(), RunningStats(), RunningStats())
+  pool = multiprocessing.Pool(num_workers) if (num_workers > 1) else None
+  stopped = False
+  try:
+    results = imap_window(pool, run_trial, trial_args, 2 * num_workers) if (pool != None) else map(run_trial, trial_args)
+    for (mean_tomography_error, mean_true_error, log, report) in results:
+      print(log, end = "")
+      if (recorder != None):
+        recorder.merge(report)
+      mean_true_errors += [mean_true_error]
+      true_stats.add(mean_true_error)
+      if (mean_tomography_error != None):
+        mean_tomography_errors += [mean_tomography_error]
+        tomography_stats.add(mean_tomography_error)
+        error_differences += [mean_tomography_error - mean_true_error]
+        difference_stats.add(mean_tomography_error - mean_true_error)
+      stats = [difference_stats] if (common_random_numbers) else [tomography_stats, true_stats]
+      if (target_half_width != None and all([(s.count >= min_trials and s.half_width() <= target_half_width) for s in stats])):
+        stopped = True
+        break
+  finally:
+    if (pool != None):
+      # trials still running after an early stop aren't needed
+      if (stopped):
+        pool.terminate()
+      else:
+        pool.close()
+      pool.join()
+  return (mean_tomography_errors, mean_true_errors, error_differences)
+
+# Like pool.imap, but only submits tasks as results are consumed, keeping at most window tasks in flight,
+# so that a consumer that stops early doesn't leave the pool with all remaining tasks queued.
+def imap_window(pool, function, iterable, window):
+  pending = collections.deque()
+  for args in iterable:
+    pending.append(pool.apply_async(function, (args,)))
+    if (len(pending) >= window):
+      yield pending.popleft().get()
+  while (len(pending) > 0):
+    yield pending.popleft().get()
+
+# Rerun the multicast estimator on a loss trace (see probe_trace.py), e.g., one recorded by run_simulation's record option
+# or captured elsewhere, streaming it from disk in chunks of chunk probes.
+# Returns alpha in topology order and the mean tomography error against the trace's link loss probabilities
+# (over the links it has them for), or None for either if the sanity checks failed or it has no link parameters.
+def replay_loss_trace(trace, chunk = None):
+  assert(trace.kind == "loss")
+  topology = trace.topology()
+  LossTomographyMle.create_streaming_estimator(trace)
+  for outcomes in trace.chunks(chunk):
+    LossTomographyMle.update_counts(trace, outcomes)
+  gamma = trace.reached_counter.rates()
+  if (LossTomographyMle.check_gamma(topology, gamma) == False):
+    print("Pre sanity check failed.")
+    return (None, None)
+  (A, alpha) = LossTomographyMle.compute_mle_arrays(topology, gamma, 1.0)
+  if (LossTomographyMle.check_alpha(alpha) == False):
+    print("Post sanity check failed.")
+    return (None, None)
+  mean_tomography_error = None
+  if (trace.link_params is not None):
+    loss = trace.link_params[1:]
+    known = ~numpy.isnan(loss)
+    if (numpy.any(known)):
+      mean_tomography_error = float(numpy.mean(numpy.round(100.0 * numpy.abs(1 - alpha[1:][known] - loss[known]) / loss[known], 5)))
+  return (alpha, mean_tomography_error)
+
+# Bootstrap confidence intervals from a single run, instead of num_trials independent ones: one multicast tree gets num_probes
+# probes, and the estimator is rerun on num_replicates resamples of them (see bootstrap.py), all at once.
+# The tree is a Tree, or an ArrayTree with array_tree or a LinkTable (links), like run_trial's multicast arm.
+# Resamples draw from their own Generator, so the probes are the same whatever num_replicates is.
+# Returns the node labels (ids, or names from links) in topology order and bootstrap_loss_estimates' result.
+def run_bootstrap(depth, expt_type, mean_delay_or_loss, dist_type, num_probes, num_replicates, seed = 0, fanout = 2, \
+                  array_tree = False, links = None):
+  rng = numpy.random.default_rng(seed)
+  with phase("tree_construction"):
+    if (array_tree or links != None):
+      mcast_tree = ArrayTree.complete(depth, expt_type, mean_delay_or_loss, dist_type, rng, fanout) if (links == None) \
+                   else ArrayTree.from_links(links, expt_type, mean_delay_or_loss, dist_type, rng)
+      (loss, batch) = (mcast_tree.loss_links.loss_probs, mcast_tree.probes_per_batch())
+    else:
+      mcast_tree = Tree(depth, expt_type, mean_delay_or_loss, dist_type, rng, fanout)
+      (loss, batch) = (numpy.full(mcast_tree.topology().num_nodes - 1, float(mean_delay_or_loss)), PROBE_BATCH_SIZE)
+  LossTomographyMle.create_streaming_estimator(mcast_tree)
+  LossTomographyMle.create_bootstrap_estimator(mcast_tree, num_probes, num_replicates, numpy.random.default_rng([seed, 1]))
+  for start in range(0, num_probes, batch):
+    with phase("multicast_probes"):
+      outcomes = mcast_tree.send_multicast_probe_batch(min(batch, num_probes - start))
+    LossTomographyMle.update_counts(mcast_tree, outcomes)
+    LossTomographyMle.update_bootstrap(mcast_tree, outcomes)
+  labels = mcast_tree.names if (getattr(mcast_tree, "names", None) is not None) else mcast_tree.topology().postorder_rank() + 1
+  return (labels.tolist(), bootstrap_loss_estimates(mcast_tree, loss))
+
+# Bootstrap a loss trace (see probe_trace.py) like run_bootstrap, streaming it from disk in chunks of chunk probes.
+# Errors are against the trace's link loss probabilities, if it has all of them.
+def bootstrap_loss_trace(trace, num_replicates, seed = 0, chunk = None):
+  assert(trace.kind == "loss")
+  LossTomographyMle.create_streaming_estimator(trace)
+  LossTomographyMle.create_bootstrap_estimator(trace, trace.num_probes, num_replicates, numpy.random.default_rng([seed, 1]))
+  for outcomes in trace.chunks(chunk):
+    LossTomographyMle.update_counts(trace, outcomes)
+    LossTomographyMle.update_bootstrap(trace, outcomes)
+  known = (trace.link_params is not None) and not numpy.any(numpy.isnan(trace.link_params[1:]))
+  return bootstrap_loss_estimates(trace, trace.link_params[1:] if (known) else None)
+
+# The estimates of a tree (or trace) whose probes all went through update_counts and update_bootstrap, given every link's
+# loss probability (in topology order, without the root's) to measure errors against, or None.
+# Returns (alpha, the lower and upper confidence limits of every node's loss probability, the mean tomography error,
+# the fraction of links whose confidence interval covers their loss probability, the number of replicates that passed
+# the sanity checks), with None for whatever is undefined: everything if the sanity checks fail on all the probes,
+# the intervals if they fail on every replicate, and the error and coverage without link loss probabilities.
+def bootstrap_loss_estimates(tree, loss):
+  topology = tree.topology()
+  gamma = tree.reached_counter.rates()
+  if (LossTomographyMle.check_gamma(topology, gamma) == False):
+    print("Pre sanity check failed.")
+    return (None, None, None, None, None, 0)
+  (A, alpha) = LossTomographyMle.compute_mle_arrays(topology, gamma, 1.0)
+  if (LossTomographyMle.check_alpha(alpha) == False):
+    print("Post sanity check failed.")
+    return (None, None, None, None, None, 0)
+  alphas = LossTomographyMle.compute_bootstrap_mle(tree, 1.0)
+  (loss_lower, loss_upper) = percentile_interval(1 - alphas) if (len(alphas) > 0) else (None, None)
+  (mean_tomography_error, coverage) = (None, None)
+  if (loss is not None):
+    mean_tomography_error = float(numpy.mean(numpy.round(100.0 * numpy.abs(1 - alpha[1:] - loss) / loss, 5)))
+    if (len(alphas) > 0):
+      coverage = float(numpy.mean((loss_lower[1:] <= loss) & (loss <= loss_upper[1:])))
+  return (alpha, loss_lower, loss_upper, mean_tomography_error, coverage, len(alphas))
+
+# labels are the node labels in topology order, e.g., a trace's labels() or an ArrayTree's ids or names
+def format_bootstrap(labels, num_replicates, alpha, loss_lower, loss_upper, mean_tomography_error, coverage, num_valid_replicates):
+  lines = ["inferred loss probabilities (with bootstrap conf. int.) from " + str(num_valid_replicates) + " of " + str(num_replicates) + \
+           " replicates"]
+  if (alpha is not None):
+    for k in range(0, len(alpha)):
+      interval = [round(float(loss_lower[k]), 5), round(float(loss_upper[k]), 5)] if (loss_lower is not None) else ["undef", "undef"]
+      lines += [" ".join([str(x) for x in [labels[k], 1 - alpha[k], interval[0], "lower conf. int", interval[1], "upper conf. int"]])]
+  lines += ["avg. tomography error = " + (str(round(mean_tomography_error, 5)) + "%" if (mean_tomography_error != None) else "undef")]
+  if (coverage != None):
+    lines += ["links covered by their conf. int = " + str(round(100.0 * coverage, 5)) + "%"]
+  return "\n".join(lines)
+
+def format_replay(trace, alpha, mean_tomography_error):
+  lines = ["inferred loss probabilities for trace " + trace.path]
+  if (alpha is not None):
+    lines += [str(label) + " " + str(1 - node_alpha) for (label, node_alpha) in zip(trace.labels().tolist(), alpha.tolist())]
+  lines += ["avg. tomography error = " + (str(round(mean_tomography_error, 5)) + "%" if (mean_tomography_error != None) else "undef")]
+  return "\n".join(lines)
+
+# mean and 95% confidence interval (std_dev * 1.96 / sqrt(successful_trials)) of a list of errors
+def confidence_interval(errors):
+  assert(len(errors) > 0)
+  confidence = (numpy.std(errors) * 1.96) / math.sqrt(len(errors))
+  return (mean(errors), mean(errors) - confidence, mean(errors) + confidence)
+
+# error_differences, if given, are the paired differences returned by run_simulation, which are only worth a line of their own
+# with common random numbers (and leaving it out otherwise keeps the three lines the graphing scripts parse)
+def format_summary(depth, expt_type, mean_delay_or_loss, dist_type, num_probes, num_trials, mean_tomography_errors, mean_true_errors, \
+                   error_differences = None):
+  if (len(mean_tomography_errors) > 0):
+    (tomography_error, tomography_lower_conf, tomography_upper_conf) = [round(x, 5) for x in confidence_interval(mean_tomography_errors)]
+  else:
+    (tomography_error, tomography_lower_conf, tomography_upper_conf) = ("undef", "undef", "undef")
+  (true_error, true_lower_conf, true_upper_conf) = [round(x, 5) for x in confidence_interval(mean_true_errors)]
+  summary = " ".join([str(x) for x in \
+         ["Depth =", depth, "expt_type =", expt_type, "mean_delay_or_loss =", mean_delay_or_loss, "dist_type =", dist_type,
+          "num_probes =", num_probes, "num_trials =", num_trials,
+          "\navg. tomography error = ", tomography_error, "%,", len(mean_tomography_errors), "trials",
+          tomography_lower_conf, "lower conf. int", tomography_upper_conf, "upper conf. int"
+          "\navg. in-network error = ", true_error, "%,", len(mean_true_errors), "trials",
+          true_lower_conf, "lower conf. int", true_upper_conf, "upper conf. int"]])
+  if (error_differences != None and len(error_differences) > 0):
+    (difference, difference_lower_conf, difference_upper_conf) = [round(x, 5) for x in confidence_interval(error_differences)]
+    summary += " ".join([str(x) for x in \
+               ["\navg. paired difference (tomography - in-network) = ", difference, "%,", len(error_differences), "trials",
+                difference_lower_conf, "lower conf. int", difference_upper_conf, "upper conf. int"]])
+  return summary
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("depth", type = int)
+  parser.add_argument("expt_type")
+  parser.add_argument("mean_delay_or_loss", type = float, help = "mean_delay/loss_prob")
+  parser.add_argument("dist_type")
+  parser.add_argument("num_probes", type = int)
+  parser.add_argument("num_trials", type = int, help = "number of trials (the most trials with --target-half-width)")
+  parser.add_argument("--workers", type = int, default = 1, help = "number of worker processes to run trials on")
+  parser.add_argument("--seed", type = int, default = 0, help = "root seed that per-trial seeds are derived from")
+  parser.add_argument("--fanout", type = int, default = 2, help = "number of children of every internal node")
+  parser.add_argument("--array-tree", action = "store_true", help = "keep per-node state in arrays, for very large trees")
+  parser.add_argument("--topology", help = "edge-list topology file (see topology_file.py) to simulate instead of a complete tree; " + \
+                                           "its unset link parameters default to mean_delay_or_loss and dist_type, and depth is ignored")
+  parser.add_argument("--target-half-width", type = float, help = "stop once both 95%% confidence intervals are at most this " + \
+                                                                  "many percentage points wide on either side of their means")
+  parser.add_argument("--min-trials", type = int, default = MIN_TRIALS, help = "fewest trials to run with --target-half-width")
+  parser.add_argument("--common-random-numbers", action = "store_true", help = "give both arms of every trial the same link " + \
+                                                                             "realizations, which makes their paired difference " + \
+                                                                             "(and --target-half-width, which then applies to it) tighter")
+  parser.add_argument("--bootstrap", type = int, metavar = "REPLICATES", help = "instead of num_trials trials, run one and get " + \
+                                                                              "confidence intervals from this many bootstrap " + \
+                                                                              "resamples of its probes (see bootstrap.py)")
+  parser.add_argument("--record", metavar = "PREFIX", help = "record every trial's multicast probes to the loss trace " + \
+                                                            "PREFIX.<trial> (see probe_trace.py, which also replays them)")
+  parser.add_argument("--instrument", metavar = "REPORT", help = "write the time spent in every phase of the trials to REPORT (JSON)")
+  parser.add_argument("--instrument-memory", action = "store_true", help = "also record the memory every phase allocates (slower)")
+  parser.add_argument("--profile", metavar = "STATS", help = "write cProfile stats of this process to STATS " + \
+                                                            "(trials run by --workers > 1 aren't included)")
+  args = parser.parse_args()
+
+  links = LinkTable.load(args.topology) if (args.topology != None) else None
+  if (args.bootstrap != None):
+    # one run in this process, recorded like a trial
+    with instrumentation.recording(args.instrument_memory, enabled = (args.instrument != None)) as recorder, \
+         instrumentation.profiling(args.profile):
+      (labels, estimates) = run_bootstrap(args.depth, args.expt_type, args.mean_delay_or_loss, args.dist_type, args.num_probes, \
+                                          args.bootstrap, args.seed, args.fanout, args.array_tree, links)
+    if (recorder != None):
+      instrumentation.write_report(args.instrument, recorder.report(), arguments = vars(args))
+    print(format_bootstrap(labels, args.bootstrap, *estimates))
+    sys.exit(0)
+  recorder = instrumentation.Recorder(args.instrument_memory) if (args.instrument != None) else None
+  with instrumentation.profiling(args.profile):
+    (mean_tomography_errors, mean_true_errors, error_differences) = \
+        run_simulation(args.depth, args.expt_type, args.mean_delay_or_loss, args.dist_type, args.num_probes, args.num_trials, \
+                       args.workers, args.seed, args.fanout, args.array_tree, links, recorder, args.target_half_width, args.min_trials, \
+                       args.record, args.common_random_numbers)
+  # paired differences are only reported with common random numbers, which is what makes them meaningful
+  differences = {"error_differences" : error_differences} if (args.common_random_numbers) else {}
+  if (recorder != None):
+    instrumentation.write_report(args.instrument, recorder.report(), arguments = vars(args), \
+                                 mean_tomography_errors = mean_tomography_errors, mean_true_errors = mean_true_errors, **differences)
+
+  # print out average of mean errors
+  print(format_summary(args.depth, args.expt_type, args.mean_delay_or_loss, args.dist_type, args.num_probes, args.num_trials, \
+                       mean_tomography_errors, mean_true_errors, differences.get("error_differences")))
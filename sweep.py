@@ -0,0 +1,185 @@
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+import sys
+import traceback
+import simulation
+import delay_tomography
+
+# Parameter sweeps over loss (simulation.py) and delay (delay_tomography.py) experiments.
+# Every configuration is a dict; configurations run as library calls in a pool of worker processes,
+# so the interpreter, numpy and the estimators are loaded once per worker instead of once per configuration.
+#
+# Loss configurations have keys
+#   expt = "loss", depth, mean_delay_or_loss, dist_type, num_probes, num_trials and optionally seed, fanout, array_tree
+#   and target_half_width and min_trials (which make num_trials a cap, see simulation.run_simulation) and common_random_numbers
+# and delay configurations have keys
+#   expt = "delay", depth, mean_delay, delay_type, epsilon, num_probes and optionally seed, fanout, array_tree
+#   and tail_quantile and max_bins (see delay_tomography.estimate_tail) and bootstrap, a number of bootstrap replicates for
+#   confidence intervals on every alpha (see bootstrap.py).
+# Loss configurations with bootstrap (a number of replicates) run a single trial and take confidence intervals from bootstrap
+# resamples of its probes instead (see simulation.run_bootstrap); num_trials, target_half_width, min_trials and
+# common_random_numbers are then ignored.
+# Each configuration produces a record: the configuration plus its results, whatever it printed ("log"),
+# and "status" ("ok" or "failed", with the exception in "error").
+# Given a ResultStore (see result_store.py), a sweep saves every record as soon as it is done
+# and reuses the stored records of configurations that already succeeded, so it can be rerun or resumed cheaply.
+
+DEFAULT_SEED = {"loss" : 0, "delay" : 1} # seed of configurations that don't set one
+
+# expand a dict of parameter name -> list of values into a list of configurations,
+# varying the last parameter fastest (like nested for loops in the order of the dict)
+def expand_grid(grid):
+  names = list(grid.keys())
+  return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+# rough relative cost of a configuration, used to start the most expensive configurations first
+def estimated_cost(config):
+  trials = config["num_trials"] if (config["expt"] == "loss" and "bootstrap" not in config) else 1
+  return config["num_probes"] * trials * (config.get("fanout", 2) ** config["depth"])
+
+# config with its seed filled in, i.e., everything that determines its results
+def full_config(config):
+  config = dict(config)
+  config.setdefault("seed", DEFAULT_SEED[config["expt"]])
+  return config
+
+def run_config(config):
+  config = full_config(config)
+  record = dict(config)
+  log = io.StringIO()
+  try:
+    with contextlib.redirect_stdout(log):
+      if (config["expt"] == "loss" and "bootstrap" in config):
+        (labels, estimates) = simulation.run_bootstrap(config["depth"], "loss", config["mean_delay_or_loss"], config["dist_type"], \
+                                                       config["num_probes"], config["bootstrap"], config["seed"], config.get("fanout", 2), \
+                                                       config.get("array_tree", False))
+        (alpha, loss_lower, loss_upper, record["tomography_error"], record["coverage"], record["bootstrap_replicates"]) = estimates
+        if (alpha is not None):
+          record["losses"] = [[label, 1 - node_alpha] for (label, node_alpha) in zip(labels, alpha.tolist())]
+        if (loss_lower is not None):
+          record["loss_intervals"] = [[label, lower, upper] for (label, lower, upper) in zip(labels, loss_lower.tolist(), loss_upper.tolist())]
+        record["summary"] = simulation.format_bootstrap(labels, config["bootstrap"], *estimates)
+      elif (config["expt"] == "loss"):
+        (mean_tomography_errors, mean_true_errors, error_differences) = \
+            simulation.run_simulation(config["depth"], "loss", config["mean_delay_or_loss"], config["dist_type"], config["num_probes"], \
+                                      config["num_trials"], 1, config["seed"], config.get("fanout", 2), config.get("array_tree", False), \
+                                      target_half_width = config.get("target_half_width"), \
+                                      min_trials = config.get("min_trials", simulation.MIN_TRIALS), \
+                                      common_random_numbers = config.get("common_random_numbers", False))
+        record["tomography_trials"] = len(mean_tomography_errors)
+        if (len(mean_tomography_errors) > 0):
+          (record["tomography_error"], record["tomography_lower_conf"], record["tomography_upper_conf"]) = \
+              simulation.confidence_interval(mean_tomography_errors)
+        record["in_network_trials"] = len(mean_true_errors)
+        (record["in_network_error"], record["in_network_lower_conf"], record["in_network_upper_conf"]) = \
+            simulation.confidence_interval(mean_true_errors)
+        if (not config.get("common_random_numbers", False)):
+          error_differences = None # not recorded or printed, like simulation.py without --common-random-numbers
+        elif (len(error_differences) > 0):
+          (record["error_difference"], record["error_difference_lower_conf"], record["error_difference_upper_conf"]) = \
+              simulation.confidence_interval(error_differences)
+        record["summary"] = simulation.format_summary(config["depth"], "loss", config["mean_delay_or_loss"], config["dist_type"], \
+                                                      config["num_probes"], config["num_trials"], mean_tomography_errors, mean_true_errors, \
+                                                      error_differences)
+      else:
+        assert(config["expt"] == "delay")
+        (i_max, tree_description, alphas, intervals) = delay_tomography.run_delay_experiment(config["depth"], config["mean_delay"], \
+                                                                                  config["delay_type"], config["epsilon"], \
+                                                                                  config["num_probes"], config["seed"], \
+                                                                                  config.get("fanout", 2), config.get("array_tree", False), \
+                                                                                  tail_quantile = config.get("tail_quantile"), \
+                                                                                  max_bins = config.get("max_bins"), \
+                                                                                  num_replicates = config.get("bootstrap"))
+        record["i_max"] = i_max
+        record["alphas"] = [[node_id, alpha] for (node_id, alpha) in alphas]
+        if (intervals != None):
+          record["alpha_intervals"] = [[node_id, lower, upper] for (node_id, lower, upper) in intervals]
+        record["summary"] = delay_tomography.format_result(tree_description, alphas, \
+                                                           show_tail = ("tail_quantile" in config or "max_bins" in config), \
+                                                           intervals = intervals)
+    record["status"] = "ok"
+  except Exception:
+    record["status"] = "failed"
+    record["error"] = traceback.format_exc()
+  record["log"] = log.getvalue()
+  return record
+
+def run_indexed_config(indexed_config):
+  (index, config) = indexed_config
+  return (index, run_config(config))
+
+# Run all configurations on num_workers processes (all cores by default) and yield (index, record) pairs
+# as configurations finish, where index is the configuration's position in configs.
+# With a store, configurations that already succeeded are yielded straight from it (first) instead of being run,
+# and every newly computed record is added to it.
+def run_sweep_unordered(configs, num_workers = None, store = None):
+  if (num_workers == None):
+    num_workers = os.cpu_count()
+  pending = []
+  for i in range(0, len(configs)):
+    record = store.get(full_config(configs[i])) if (store != None) else None
+    if (record != None and record["status"] == "ok"):
+      yield (i, record)
+    else:
+      pending += [i]
+  # start the most expensive configurations first so that the pool doesn't end up waiting on a single straggler
+  order = sorted(pending, key = lambda i: -estimated_cost(configs[i]))
+  indexed_configs = [(i, configs[i]) for i in order]
+  pool = multiprocessing.Pool(num_workers) if (num_workers > 1 and len(indexed_configs) > 1) else None
+  try:
+    results = pool.imap_unordered(run_indexed_config, indexed_configs) if (pool != None) \
+              else map(run_indexed_config, indexed_configs)
+    for (index, record) in results:
+      if (store != None):
+        store.put(full_config(configs[index]), record)
+      yield (index, record)
+  finally:
+    if (pool != None):
+      pool.terminate()
+      pool.join()
+
+# Run all configurations and yield their records in the order of configs, each as soon as it and all configurations
+# before it are done.
+def run_sweep(configs, num_workers = None, store = None):
+  done = dict()
+  next_index = 0
+  for (index, record) in run_sweep_unordered(configs, num_workers, store):
+    done[index] = record
+    while (next_index in done):
+      yield done.pop(next_index)
+      next_index += 1
+
+# the command line that runs a configuration on its own
+def command_line(config):
+  if (config["expt"] == "loss"):
+    options = (["--fanout", config["fanout"]] if ("fanout" in config) else []) + \
+              (["--array-tree"] if config.get("array_tree", False) else []) + \
+              (["--target-half-width", config["target_half_width"]] if ("target_half_width" in config) else []) + \
+              (["--min-trials", config["min_trials"]] if ("min_trials" in config) else []) + \
+              (["--common-random-numbers"] if config.get("common_random_numbers", False) else []) + \
+              (["--bootstrap", config["bootstrap"]] if ("bootstrap" in config) else [])
+    return " ".join([str(x) for x in ["./simulation.py", config["depth"], "loss", config["mean_delay_or_loss"], config["dist_type"], \
+                                      config["num_probes"], config["num_trials"]] + options])
+  else:
+    options = ([config["fanout"]] if ("fanout" in config) else []) + (["--array-tree"] if config.get("array_tree", False) else []) + \
+              (["--tail-quantile", config["tail_quantile"]] if ("tail_quantile" in config) else []) + \
+              (["--max-bins", config["max_bins"]] if ("max_bins" in config) else []) + \
+              (["--bootstrap", config["bootstrap"]] if ("bootstrap" in config) else [])
+    return " ".join([str(x) for x in ["python3 delay_tomography.py", config["depth"], config["mean_delay"], config["delay_type"], \
+                                      config["epsilon"], config["num_probes"]] + options])
+
+# print a record the way the old one-process-per-configuration run scripts did, so the graphing scripts can still parse it
+def print_record(record):
+  if (record["status"] == "ok"):
+    print(command_line(record), " succeeded with stdout:")
+    print(record["log"] + record["summary"])
+  else:
+    print(command_line(record), " failed with stdout:")
+    print(record["log"])
+    print("stderr:")
+    print(record["error"])
+  print("===========================================================================================")
+  sys.stdout.flush()
@@ -0,0 +1,165 @@
+import numpy
+
+# Array-backed description of the shape of a tree, so that traversals become index walks
+# instead of recursive calls that rebuild lists of nodes.
+#
+# Nodes are numbered 0 .. num_nodes - 1 in preorder: the root is 0 and every parent comes before its children.
+# Children are stored CSR style: the children of node k are child_index[child_start[k] : child_start[k + 1]].
+# Leaves (receivers) are also kept in preorder (leaf_order), so the receivers under node k
+# are the contiguous range leaf_order[leaf_start[k] : leaf_end[k]].
+# levels[d] holds the nodes at depth d, grouped by parent in the order of levels[d - 1].
+class Topology(object):
+  def __init__(self, parent):
+    parent = numpy.asarray(parent, dtype = numpy.int64)
+    assert(len(parent) >= 1)
+    assert(parent[0] == -1)
+    assert(numpy.all(parent[1:] >= 0) and numpy.all(parent[1:] < numpy.arange(1, len(parent)))) # preorder
+    self.parent = parent
+    self.num_nodes = len(parent)
+
+    # CSR child index; a stable sort keeps siblings in preorder
+    num_children = numpy.bincount(parent[1:], minlength = self.num_nodes)
+    self.child_start = numpy.concatenate(([0], numpy.cumsum(num_children)))
+    self.child_index = numpy.argsort(parent[1:], kind = "stable") + 1
+    self.is_leaf = (num_children == 0)
+
+    # level order (breadth first), built one level at a time
+    self.levels = []
+    self.depth = numpy.zeros(self.num_nodes, dtype = numpy.int64)
+    frontier = numpy.array([0], dtype = numpy.int64)
+    while (len(frontier) > 0):
+      self.depth[frontier] = len(self.levels)
+      self.levels += [frontier]
+      frontier = self.child_index[Topology.ranges(self.child_start[frontier], self.child_start[frontier + 1])]
+    self.level_order = numpy.concatenate(self.levels)
+
+    # subtree sizes bottom up, which in preorder give the extent of every subtree
+    subtree_size = numpy.ones(self.num_nodes, dtype = numpy.int64)
+    for level in reversed(self.levels[1:]):
+      numpy.add.at(subtree_size, parent[level], subtree_size[level])
+    self.subtree_size = subtree_size
+
+    # leaves in preorder and per-node leaf ranges
+    self.leaf_order = numpy.flatnonzero(self.is_leaf)
+    self.num_receivers = len(self.leaf_order)
+    leaves_before = numpy.concatenate(([0], numpy.cumsum(self.is_leaf)))
+    self.leaf_start = leaves_before[:-1]
+    self.leaf_end = leaves_before[numpy.arange(self.num_nodes) + subtree_size]
+
+  # Topology of the complete tree of the given depth (a single node for depth 1) in which every internal node
+  # has fanout children, built one level at a time from the sizes of its subtrees.
+  @staticmethod
+  def complete(depth, fanout):
+    assert(depth >= 1)
+    assert(fanout >= 1)
+    # a subtree rooted at depth d has subtree_sizes[d] nodes, and in preorder the c-th child of node k
+    # comes right after k and the c subtrees of its older siblings
+    subtree_sizes = [sum([fanout ** e for e in range(0, depth - d)]) for d in range(0, depth)]
+    parent = numpy.empty(subtree_sizes[0], dtype = numpy.int64)
+    parent[0] = -1
+    level = numpy.array([0], dtype = numpy.int64)
+    for d in range(1, depth):
+      parents = numpy.repeat(level, fanout)
+      level = parents + 1 + numpy.tile(numpy.arange(fanout, dtype = numpy.int64), len(level)) * subtree_sizes[d]
+      parent[level] = parents
+    return Topology(parent)
+
+  # Topology of a tree given as a parent array in any order (parent[i] is the index of i's parent, -1 for the root),
+  # e.g., the order of a topology file, with siblings kept in the order of their indices.
+  # Returns the topology and order, where order[k] is the input index of topology node k.
+  @staticmethod
+  def from_parents(parent):
+    parent = numpy.asarray(parent, dtype = numpy.int64)
+    num_nodes = len(parent)
+    roots = numpy.flatnonzero(parent == -1)
+    assert(len(roots) == 1)
+    assert(numpy.all((parent >= -1) & (parent < num_nodes)))
+
+    # children grouped by parent (siblings in index order), then the levels of the tree one at a time
+    others = numpy.flatnonzero(parent != -1)
+    by_parent = others[numpy.argsort(parent[others], kind = "stable")]
+    child_start = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(parent[others], minlength = num_nodes))))
+    levels = []
+    frontier = roots
+    while (len(frontier) > 0):
+      levels += [frontier]
+      frontier = by_parent[Topology.ranges(child_start[frontier], child_start[frontier + 1])]
+    if (sum([len(level) for level in levels]) != num_nodes):
+      raise ValueError("not a tree: " + str(num_nodes - sum([len(level) for level in levels])) + \
+                       " nodes are on cycles that don't reach the root")
+
+    subtree_size = numpy.ones(num_nodes, dtype = numpy.int64)
+    for level in reversed(levels[1:]):
+      numpy.add.at(subtree_size, parent[level], subtree_size[level])
+
+    # Like in complete, a child comes right after its parent and the subtrees of its older siblings in preorder.
+    # Every level is grouped by parent, so the older siblings' subtree sizes are a running sum within each group.
+    position = numpy.zeros(num_nodes, dtype = numpy.int64)
+    for level in levels[1:]:
+      older = numpy.cumsum(subtree_size[level]) - subtree_size[level]
+      first = numpy.flatnonzero(numpy.concatenate(([True], parent[level][1:] != parent[level][:-1])))
+      older -= numpy.repeat(older[first], numpy.diff(numpy.append(first, len(level))))
+      position[level] = position[parent[level]] + 1 + older
+    order = numpy.empty(num_nodes, dtype = numpy.int64)
+    order[position] = numpy.arange(num_nodes)
+    preorder_parent = numpy.where(parent[order] >= 0, position[parent[order]], -1)
+    return (Topology(preorder_parent), order)
+
+  # rank of every node in postorder (children left to right, then their parent), the order in which
+  # a recursive construction finishes nodes
+  def postorder_rank(self):
+    return numpy.arange(self.num_nodes, dtype = numpy.int64) - self.depth + self.subtree_size - 1
+
+  # concatenation of range(starts[i], ends[i]) for all i, without a Python loop
+  @staticmethod
+  def ranges(starts, ends):
+    lengths = ends - starts
+    total = numpy.sum(lengths)
+    if (total == 0):
+      return numpy.zeros(0, dtype = numpy.int64)
+    offsets = numpy.repeat(ends - numpy.cumsum(lengths), lengths)
+    return numpy.arange(total, dtype = numpy.int64) + offsets
+
+  # Build the topology of a Tree object (treating tree as the root, whatever its parent is).
+  # Returns the topology and the list of Tree nodes indexed by topology index.
+  @staticmethod
+  def from_tree(tree):
+    node_list = []
+    parent = []
+    stack = [(tree, -1)]
+    while (len(stack) > 0):
+      (node, parent_index) = stack.pop()
+      parent += [parent_index]
+      node_list += [node]
+      for child in reversed(node.children()):
+        stack += [(child, len(node_list) - 1)]
+    return (Topology(parent), node_list)
+
+  def children(self, k):
+    return self.child_index[self.child_start[k] : self.child_start[k + 1]]
+
+  # Push values down the tree in place: values[..., k] = op(values[..., k], values[..., parent(k)]) for every
+  # non-root k, parents first. The last axis of values is indexed by node.
+  # E.g., numpy.logical_and propagates drops and numpy.add accumulates path delays.
+  def accumulate_down(self, values, op):
+    for level in self.levels[1:]:
+      values[..., level] = op(values[..., level], values[..., self.parent[level]])
+    return values
+
+  # Reduce per-receiver values up the tree: the result has one column per node, holding
+  # op reduced over all receivers under that node. The last axis of leaf_values follows leaf_order.
+  # E.g., numpy.logical_or gives "some receiver under k got the probe", numpy.minimum the subtree minimum.
+  def reduce_up(self, leaf_values, op):
+    leaf_values = numpy.asarray(leaf_values)
+    assert(leaf_values.shape[-1] == self.num_receivers)
+    values = numpy.empty(leaf_values.shape[:-1] + (self.num_nodes,), dtype = leaf_values.dtype)
+    values[..., self.leaf_order] = leaf_values
+    for d in range(len(self.levels) - 2, -1, -1):
+      internal = self.levels[d][~self.is_leaf[self.levels[d]]]
+      if (len(internal) == 0):
+        continue
+      # levels[d + 1] is grouped by parent in the order of levels[d], so the children of each internal node
+      # form one contiguous run of the next level
+      groups = numpy.concatenate(([0], numpy.cumsum(self.child_start[internal + 1] - self.child_start[internal])[:-1]))
+      values[..., internal] = op.reduceat(values[..., self.levels[d + 1]], groups, axis = -1)
+    return values
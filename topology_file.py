@@ -0,0 +1,113 @@
+import numpy
+from topology           import Topology
+from loss_distribution  import LOSS_TYPES
+from delay_distribution import DELAY_TYPES
+
+# Multicast trees read from edge-list files, for topologies other than complete trees (see Topology.complete).
+#
+# A topology file has one link per line:
+#   parent child [loss_prob loss_type [mean_delay delay_type]]
+# Node names are any tokens without whitespace, "-" leaves a parameter unset and "#" starts a comment.
+# The root is the one node that is never a child. A line whose parent is "-" sets the root's incoming link,
+# which only delay experiments use (every node of an ArrayTree, the root included, delays probes on its incoming link).
+# Siblings keep the order of their lines.
+#
+# Probes can go down any tree, but both estimators need every internal node to have at least two children:
+# a node with a single child can't be told apart from the link below it, so such chains should be merged into one link.
+
+# A loaded topology file: the tree's Topology plus the parameters of every node's incoming link,
+# all indexed by topology index. Unset parameters are NaN (loss_probs, mean_delays) or "" (loss_types, delay_types).
+class LinkTable(object):
+  def __init__(self, topology, names, loss_probs, loss_types, mean_delays, delay_types):
+    self.topology = topology
+    self.names = names
+    self.loss_probs = loss_probs
+    self.loss_types = loss_types
+    self.mean_delays = mean_delays
+    self.delay_types = delay_types
+
+  @staticmethod
+  def load(path):
+    # gather the columns of all links, then resolve names and parameters with array operations
+    (lines, columns) = ([], [])
+    with open(path) as topology_file:
+      for (line_number, line) in enumerate(topology_file, 1):
+        fields = (line.split("#", 1)[0] if ("#" in line) else line).split()
+        if (len(fields) == 0):
+          continue
+        if (len(fields) not in [2, 4, 6]):
+          raise ValueError(path + ":" + str(line_number) + ": expected parent child [loss_prob loss_type [mean_delay delay_type]]")
+        lines += [line_number]
+        columns += [fields + ["-"] * (6 - len(fields))]
+    if (len(columns) == 0):
+      raise ValueError(path + ": no links")
+    lines = numpy.array(lines)
+    (parents, children, loss_probs, loss_types, mean_delays, delay_types) = numpy.array(columns).T
+    where = lambda i: path + ":" + str(lines[i]) + ": "
+
+    # Children are numbered in the order of their lines (so siblings keep that order), and the root last if it has no line
+    if (numpy.any(children == "-")):
+      raise ValueError(where(numpy.flatnonzero(children == "-")[0]) + "child can't be -")
+    by_name = numpy.argsort(children, kind = "stable")
+    repeated = numpy.flatnonzero(children[by_name][1:] == children[by_name][:-1])
+    if (len(repeated) > 0):
+      (first, second) = (by_name[repeated[0]], by_name[repeated[0] + 1])
+      raise ValueError(where(second) + "node " + children[second] + " already has an incoming link (line " + str(lines[first]) + ")")
+    found = numpy.minimum(numpy.searchsorted(children[by_name], parents), len(children) - 1)
+    known = (children[by_name][found] == parents)
+    roots = list(children[parents == "-"]) + list(numpy.unique(parents[~known & (parents != "-")]))
+    if (len(roots) != 1):
+      raise ValueError(path + ": expected one root (a node that is never a child), found " + str(len(roots)) + \
+                       ((": " + " ".join(roots[:10])) if (len(roots) > 0) else ""))
+    parent = numpy.where(known, by_name[found], len(children))
+    parent[parents == "-"] = -1
+    names = children
+    if (not numpy.any(parents == "-")):
+      (parent, names) = (numpy.append(parent, -1), numpy.append(children, roots[0]))
+    (topology, order) = Topology.from_parents(parent)
+
+    # link parameters in topology order, with the root's link unset unless it has a line
+    values = [LinkTable.parse_values(column, where) for column in [loss_probs, mean_delays]]
+    types = [LinkTable.parse_types(column, valid_types, where) for (column, valid_types) in \
+             [(loss_types, LOSS_TYPES), (delay_types, DELAY_TYPES)]]
+    if (len(names) > len(children)):
+      values = [numpy.append(column, numpy.nan) for column in values]
+      types = [numpy.append(column, "") for column in types]
+    return LinkTable(topology, names[order], values[0][order], types[0][order], values[1][order], types[1][order])
+
+  # numbers of a column of fields, NaN where a field is "-"
+  @staticmethod
+  def parse_values(column, where):
+    try:
+      return numpy.where(column == "-", "nan", column).astype(float)
+    except ValueError:
+      for i in range(0, len(column)):
+        try:
+          float(column[i])
+        except ValueError:
+          if (column[i] != "-"):
+            raise ValueError(where(i) + "bad number " + column[i])
+      raise
+
+  # types of a column of fields, "" where a field is "-"
+  @staticmethod
+  def parse_types(column, valid_types, where):
+    unknown = numpy.flatnonzero(~numpy.isin(column, valid_types + ["-"]))
+    if (len(unknown) > 0):
+      raise ValueError(where(unknown[0]) + "unknown type " + column[unknown[0]] + ", expected one of " + ", ".join(valid_types))
+    return numpy.where(column == "-", "", column)
+
+  # The parameters of every node's incoming link for an experiment of type expt_type ("loss" or "delay"),
+  # with unset values and types filled in from default_value and default_type.
+  # Returns (values, types) indexed by topology index. For loss experiments the root's entries are unused.
+  def parameters(self, expt_type, default_value = None, default_type = None):
+    assert(expt_type in ["delay", "loss"])
+    (values, types) = (self.loss_probs, self.loss_types) if (expt_type == "loss") else (self.mean_delays, self.delay_types)
+    values = numpy.where(numpy.isnan(values), numpy.nan if (default_value == None) else default_value, values)
+    types = numpy.where(types == "", "" if (default_type == None) else default_type, types)
+    first = 1 if (expt_type == "loss") else 0
+    unset = numpy.flatnonzero(numpy.isnan(values[first:]) | (types[first:] == "")) + first
+    if (len(unset) > 0):
+      raise ValueError("no " + expt_type + " parameters (and no defaults) for the link into node " + str(self.names[unset[0]]) + \
+                       " and " + str(len(unset) - 1) + " other links")
+    return (values, types)
@@ -0,0 +1,72 @@
+#! /usr/local/bin/python3
+
+# Compare how well the tomography and in-network approaches track a change in link loss rates.
+# Every link's loss probability switches from loss_before to loss_after after change_at probes,
+# and both approaches use a sliding-window or exponentially decayed estimator (see probe_counter.py)
+# that is queried every report_every probes.
+
+import numpy
+import sys
+from statistics import mean
+from tree import Tree
+from loss_mle import LossTomographyMle
+
+if len(sys.argv) != 10:
+  print("Usage: ", sys.argv[0], " depth dist_type loss_before loss_after change_at num_probes window/decay window_size/decay_rate report_every")
+  exit(1)
+else:
+  depth = int(sys.argv[1])
+  dist_type = sys.argv[2]
+  loss_before = float(sys.argv[3])
+  loss_after = float(sys.argv[4])
+  change_at = int(sys.argv[5])
+  num_probes = int(sys.argv[6])
+  estimator_type = sys.argv[7]
+  assert(estimator_type in ["window", "decay"])
+  window = int(sys.argv[8]) if (estimator_type == "window") else None
+  decay = float(sys.argv[8]) if (estimator_type == "decay") else None
+  report_every = int(sys.argv[9])
+
+# seed random number generator
+rng = numpy.random.default_rng(1)
+
+in_network_tree = Tree(depth, "loss", loss_before, dist_type, rng)
+in_network_tree.create_loss_tracker(window, decay)
+mcast_tree = Tree(depth, "loss", loss_before, dist_type, rng)
+LossTomographyMle.create_streaming_estimator(mcast_tree, window, decay)
+
+print("Depth =", depth, "dist_type =", dist_type, "loss_before =", loss_before, "loss_after =", loss_after, \
+      "change_at =", change_at, "num_probes =", num_probes, estimator_type, "=", sys.argv[8])
+
+probes_sent = 0
+while (probes_sent < num_probes):
+  # never let a batch straddle the change
+  batch_end = min(probes_sent + report_every, num_probes)
+  if (probes_sent < change_at and batch_end > change_at):
+    batch_end = change_at
+  num_batch_probes = batch_end - probes_sent
+  in_network_tree.send_independent_probe_batch(num_batch_probes)
+  LossTomographyMle.update_counts(mcast_tree, mcast_tree.send_multicast_probe_batch(num_batch_probes))
+  probes_sent = batch_end
+  if (probes_sent == change_at):
+    in_network_tree.set_loss_prob(loss_after)
+    mcast_tree.set_loss_prob(loss_after)
+  if (probes_sent % report_every != 0 and probes_sent != num_probes):
+    continue
+
+  # Errors are relative to the loss probability that was in force for the probe just sent
+  true_loss = loss_before if (probes_sent <= change_at) else loss_after
+  in_network_error = mean([round(100.0 * abs(node.recent_loss - true_loss) / true_loss, 5) \
+                           for node in in_network_tree.nodes() if node != in_network_tree])
+  LossTomographyMle.compute_streaming_gamma(mcast_tree)
+  if (LossTomographyMle.pre_sanity_check(mcast_tree) == False):
+    tomography_error = "undef"
+  else:
+    LossTomographyMle.compute_mle(mcast_tree, 1.0)
+    if (LossTomographyMle.post_sanity_check(mcast_tree) == False):
+      tomography_error = "undef"
+    else:
+      tomography_error = round(mean([round(100.0 * abs(1 - node.alpha - true_loss) / true_loss, 5) \
+                                     for node in mcast_tree.nodes() if node != mcast_tree]), 5)
+  print("probes =", probes_sent, "true loss =", true_loss, "tomography error =", tomography_error, "%,", \
+        "in-network error =", round(in_network_error, 5), "%")
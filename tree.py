@@ -1,143 +1,188 @@
 from loss_distribution  import LossDistribution
 from delay_distribution import DelayDistribution
+from topology           import Topology
+from probe_counter      import ProbeCounter
 import numpy
 
-# generate new IDs for nodes
-def new_id():
-  if not hasattr(new_id, "counter"):
-    new_id.counter = 0
-  new_id.counter += 1
-  return new_id.counter
-
+# A tree of Python objects, one per node, each with its own loss or delay distribution.
+# This is convenient for small trees; see array_tree.py for trees too large for one object per node.
 class Tree:
-  def initialize_tree(self, expt_type, mean_delay_or_loss, dist_type):
-    self.id = new_id()
+  def initialize_tree(self, expt_type, mean_delay_or_loss, dist_type, rng, node_id):
+    self.id = node_id
+    self.rng = rng
     self.parent = None # This will be fixed once the parent is constructed (see below)
     self.true_loss = 0.0
     self.num_packets_incoming = 0
     assert(expt_type in ["delay", "loss"])
     if (expt_type == "loss"): 
-      self.loss_dist  = LossDistribution(mean_delay_or_loss, dist_type) 
+      self.loss_dist  = LossDistribution(mean_delay_or_loss, dist_type, rng)
     else:
-      self.delay_dist = DelayDistribution(mean_delay_or_loss, dist_type)
+      self.delay_dist = DelayDistribution(mean_delay_or_loss, dist_type, rng)
 
   def children(self):
-    if (self.left == None and self.right == None):
-      return []
-    else:
-      assert(self.left != None and self.right != None)
-      return [self.left, self.right]
+    return self.child_nodes
 
   def tick(self):
     # Anything that needs to run periodically on every probe/tick
     self.loss_dist.state_transition()
  
-  # construct tree of depth depth
-  def __init__(self, depth, expt_type, mean_delay_or_loss, dist_type):
+  # construct tree of depth depth, where every internal node has fanout children (a binary tree by default)
+  # All randomness in the tree (every link's distribution and the batch probe methods) comes from
+  # the numpy.random.Generator rng, so that independent trees can be simulated reproducibly in parallel.
+  # A fresh, unseeded Generator is used if rng is None.
+  def __init__(self, depth, expt_type, mean_delay_or_loss, dist_type, rng = None, fanout = 2):
     assert(depth >= 1)
     assert(expt_type in ["delay", "loss"])
-
-    # Construct leaf nodes (base case)
-    if (depth == 1):
-      self.left = None
-      self.right = None
-      self.initialize_tree(expt_type, mean_delay_or_loss, dist_type)
-
-    else:
-      # construct left and right trees
-      left_tree  = Tree(depth - 1, expt_type, mean_delay_or_loss, dist_type)
-      right_tree = Tree(depth - 1, expt_type, mean_delay_or_loss, dist_type)
-
-      # set their parents (which are currently None) to self
-      left_tree.parent = self
-      right_tree.parent = self
-
-      # Now construct self itself
-      self.left  = left_tree
-      self.right = right_tree
-      self.initialize_tree(expt_type, mean_delay_or_loss, dist_type)
-
-  # get a list of receivers under this tree
+    assert(fanout >= 2)
+    if (rng == None):
+      rng = numpy.random.default_rng()
+
+    # Build the shape first, then one node object per topology index, with self as the root (index 0).
+    # Nodes are initialized in postorder (the subtrees from left to right, then their root), the order in which
+    # a recursive construction would finish them, and every tree numbers its nodes 1, 2, ... in that order.
+    topology = Topology.complete(depth, fanout)
+    all_nodes = [self] + [Tree.__new__(Tree) for k in range(1, topology.num_nodes)]
+    postorder_rank = topology.postorder_rank()
+    for k in numpy.argsort(postorder_rank).tolist():
+      all_nodes[k].child_nodes = [all_nodes[j] for j in topology.children(k).tolist()]
+      all_nodes[k].initialize_tree(expt_type, mean_delay_or_loss, dist_type, rng, int(postorder_rank[k]) + 1)
+
+    # set the parents (which are currently None)
+    for (k, parent) in enumerate(topology.parent.tolist()):
+      if (parent >= 0):
+        all_nodes[k].parent = all_nodes[parent]
+    self._topology = topology
+    self._node_list = all_nodes
+    self._receiver_list = [all_nodes[k] for k in topology.leaf_order]
+
+  # get the array-backed topology of this tree and the list of nodes indexed by topology index (preorder).
+  # Both are computed once and cached, since the shape of a tree doesn't change after construction.
+  def topology(self):
+    if (not hasattr(self, "_topology")):
+      (self._topology, self._node_list) = Topology.from_tree(self)
+      self._receiver_list = [self._node_list[k] for k in self._topology.leaf_order]
+    return self._topology
+
+  # get a list of receivers under this tree (cached, don't modify it)
   def receivers(self):
-    if (self.left == None and self.right == None):
-      return [self]
-    else:
-      return self.left.receivers() + self.right.receivers()
+    self.topology()
+    return self._receiver_list
 
-  # get a list of all nodes under this tree
+  # get a list of all nodes under this tree in preorder (cached, don't modify it)
   def nodes(self):
-    if (self.left == None and self.right == None):
-      return [self]
-    else:
-      return [self] + self.left.nodes() + self.right.nodes()
+    self.topology()
+    return self._node_list
 
   def __str__(self):
     assert(self.id != -1)
-    assert((self.left == None and self.right == None) or (self.left != None and self.right != None))
+    if (len(self.child_nodes) > 2):
+      return "Root = (" + str(self.id) + \
+             "), children=(" + ", ".join([str(child) for child in self.child_nodes]) + ")"
+    # binary trees (and leaves) keep the left/right format
+    (left, right) = self.child_nodes if (len(self.child_nodes) == 2) else (None, None)
     return "Root = (" + str(self.id) + \
-           "), left=(" + str(self.left) + \
-           "), right=(" + str(self.right) + ")"
+           "), left=(" + str(left) + \
+           "), right=(" + str(right) + ")"
 
   # send multicast probe down the tree and record outcome at all leaf nodes (receivers)
   def send_multicast_probe(self):
-    # For every node, look at whether packet is dropped on incoming link
-    # And recursively on the trees rooted at that node
-
-    # Base case: leaf node: look at whether packet is dropped on incoming link
-    if (self.left == None and self.right == None):
-      return [(self.id, self.loss_dist.deliver_probe())]
-    # Recursive case: intermediate nodes
-    else:
-      if (self.parent == None):
+    # For every node, look at whether packet is dropped on incoming link,
+    # walking the nodes in preorder so that every parent is visited before its children
+    topology = self.topology()
+    all_nodes = self.nodes()
+    delivered = [False] * topology.num_nodes
+    for k in range(0, topology.num_nodes):
+      node = all_nodes[k]
+      if (k > 0 and not delivered[topology.parent[k]]):
+        # save some work: the probe was dropped above, so it never gets to this link
+        continue
+      if (node.child_nodes != [] and node.parent == None):
         # Always deliver packets that are incoming on the root node
-        probe_delivered = True
+        delivered[k] = True
       else:
-        # Again, look at where packet is dropped on incoming link
-        probe_delivered = self.loss_dist.deliver_probe()
-
-      # recurse left and right if probe was delivered 
-      if (probe_delivered):
-        return self.left.send_multicast_probe() + self.right.send_multicast_probe()
-      # otherwise save some work and record an outcome of 0 at all receivers below self
-      else:
-        ret = []
-        for receiver in self.receivers():
-          ret += [(receiver.id, False)]
-        return ret
+        delivered[k] = node.loss_dist.deliver_probe()
+    return [(all_nodes[k].id, delivered[k]) for k in topology.leaf_order]
+
+  # Batch version of send_multicast_probe: send num_probes multicast probes down the tree at once.
+  # Every link draws its delivery outcomes for all probes in one go (a num_probes x num_nodes matrix),
+  # and drops are propagated down the tree level by level by and-ing every column with its parent's column.
+  # Returns a (num_probes x num_receivers) boolean matrix whose columns are ordered like receivers().
+  # Gilbert-Elliot links are advanced once per probe, so there is no need to tick() the nodes.
+  def send_multicast_probe_batch(self, num_probes):
+    topology = self.topology()
+    all_nodes = self.nodes()
+    delivered = numpy.ones((num_probes, topology.num_nodes), dtype = bool)
+    # Always deliver packets that are incoming on the root node (index 0), so its column stays True
+    delivered[:, 1:] = LossDistribution.deliver_probes_on_links([node.loss_dist for node in all_nodes[1:]], num_probes, self.rng)
+    topology.accumulate_down(delivered, numpy.logical_and)
+    return delivered[:, topology.leaf_order]
+
+  # Batch version of send_independent_probes: send num_probes independent probes on every link
+  # and fold all of them into the running true_loss average at once.
+  # Like send_multicast_probe_batch, Gilbert-Elliot links are advanced once per probe.
+  # If create_loss_tracker was called, each node's recent_loss is updated as well.
+  def send_independent_probe_batch(self, num_probes):
+    links = [node for node in self.nodes() if node.parent != None]
+    lost = ~LossDistribution.deliver_probes_on_links([node.loss_dist for node in links], num_probes, self.rng)
+    all_losses = numpy.count_nonzero(lost, axis = 0)
+    for (node, losses) in zip(links, all_losses):
+      node.num_packets_incoming += num_probes
+      node.true_loss = node.true_loss + (losses - num_probes * node.true_loss)/node.num_packets_incoming
+    if (hasattr(self, "loss_counter")):
+      self.loss_counter.add(lost)
+      for (node, recent_loss) in zip(links, self.loss_counter.rates()):
+        node.recent_loss = recent_loss
+
+  # In addition to the whole-run true_loss average, track a recent_loss estimate for every link
+  # that covers only the last window probes or decays exponentially (see probe_counter.py),
+  # so that the in-network approach can follow links whose loss rates change mid-run.
+  def create_loss_tracker(self, window = None, decay = None):
+    self.loss_counter = ProbeCounter(len([node for node in self.nodes() if node.parent != None]), window, decay)
+
+  # Change the loss probability of every link under this tree
+  def set_loss_prob(self, loss_prob):
+    for node in self.nodes():
+      if (node.parent != None):
+        node.loss_dist.set_loss_prob(loss_prob)
 
   # send independent probes down every node
-  # This is implemented recursively for convenience,
+  # This walks the nodes in preorder for convenience,
   # but is equivalent to running an independent random process at each node.
   def send_independent_probes(self):
-    # For the root node don't bother delivering, just recurse
-    if (self.parent == None):
-      probe_delivered = True
-    else:
-      probe_delivered = self.loss_dist.deliver_probe()
-      self.num_packets_incoming += 1
+    for node in self.nodes():
+      # For the root node don't bother delivering
+      if (node.parent == None):
+        continue
+      probe_delivered = node.loss_dist.deliver_probe()
+      node.num_packets_incoming += 1
       loss = 1 if (not probe_delivered) else 0
-      self.true_loss = self.true_loss + (loss - self.true_loss)/self.num_packets_incoming
-
-    # Recursion logic: deliver left and right probes regardless of value of probe_delivered
-    if (self.left != None and self.right != None):
-      self.left.send_independent_probes()
-      self.right.send_independent_probes()
+      node.true_loss = node.true_loss + (loss - node.true_loss)/node.num_packets_incoming
 
   # Send a multicast probe that is delayed by an independent amount
   # at each link. This amount is sampled from a delay distribution.
   # There are no losses in this function.
   # Returns a vector of end-to-end one-way delays from source to each of the receivers under the tree.
   def send_multicast_probe_with_delay(self):
-    mean_delay = 5
-    incoming_link_delay = 0
-    if (self.parent == None):
-      incoming_link_delay = 0
-    else:
-      incoming_link_delay = self.delay_dist.delay_sample()
-
-    if (self.left != None and self.right != None):
-      return [x + incoming_link_delay for x in self.left.send_multicast_probe_with_delay()] + \
-             [x + incoming_link_delay for x in self.right.send_multicast_probe_with_delay()]
-    else:
-      assert(self.left == None and self.right == None)
-      return [incoming_link_delay]
+    # accumulate delays from the root down, walking the nodes in preorder
+    topology = self.topology()
+    all_nodes = self.nodes()
+    path_delay = [0] * topology.num_nodes
+    for k in range(0, topology.num_nodes):
+      node = all_nodes[k]
+      incoming_link_delay = 0 if (node.parent == None) else node.delay_dist.delay_sample()
+      path_delay[k] = incoming_link_delay + (path_delay[topology.parent[k]] if (k > 0) else 0)
+    return [path_delay[k] for k in topology.leaf_order]
+
+  # Batch version of send_multicast_probe_with_delay: send num_probes probes at once.
+  # All link delays are drawn as one (num_probes x num_nodes) matrix and summed along root-to-leaf paths level by level.
+  # Returns a (num_probes x num_receivers) matrix of end-to-end delays whose columns are ordered like receivers().
+  def send_multicast_probe_with_delay_batch(self, num_probes):
+    topology = self.topology()
+    all_nodes = self.nodes()
+    delays = numpy.zeros((num_probes, topology.num_nodes))
+    # Like send_multicast_probe_with_delay, the root node (index 0) only has a delay on its incoming link
+    # if it has a parent (e.g., the fake root added by DelayTomographyMle.create_Y_and_root)
+    first = 0 if (self.parent != None) else 1
+    delays[:, first:] = DelayDistribution.delay_samples_on_links([node.delay_dist for node in all_nodes[first:]], num_probes, self.rng)
+    topology.accumulate_down(delays, numpy.add)
+    return delays[:, topology.leaf_order]